@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------------
+# Nature For Water Facility - The Nature Conservancy
+# -------------------------------------------------------------------------
+# InVEST - Version 3.15.1 (update July 2025)
+# -------------------------------------------------------------------------
+#                            DESCRIPTION
+# -------------------------------------------------------------------------
+# Variantes de los optimizadores de spotpy para evaluar en paralelo:
+# DDS con varias perturbaciones por ronda (PDDS) y SCE-UA por lotes. Los
+# optimizadores y FAST no guardan en la base de datos de spotpy las simulaciones
+# estimadas por el modelo sustituto.
+# -------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Package
+# ----------------------------------------------------------------------------------------------------------------------
+import numpy as np
+import spotpy
+from Surrogate_InVEST import Prediction
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Base de datos de spotpy con sólo las corridas de InVEST
+# ----------------------------------------------------------------------------------------------------------------------
+class Real_Runs(object):
+    # Las simulaciones estimadas por el sustituto (Prediction) no se escriben en PARAMETERS/<Model>_<Opt>.csv
+    def save(self, like, randompar, simulations, chains=1):
+        if not isinstance(simulations, Prediction):
+            super(Real_Runs, self).save(like, randompar, simulations, chains=chains)
+
+    def __getstate__(self):
+        # Solo el proceso principal escribe la base de datos: pathos (dill) reabriría el csv en modo 'w' en cada
+        # proceso del pool y lo dejaría vacío
+        State = self.__dict__.copy()
+        State.pop('datawriter', None)
+        return State
+
+class DDS(Real_Runs, spotpy.algorithms.dds):
+    pass
+
+class SCEUA(Real_Runs, spotpy.algorithms.sceua):
+    pass
+
+class LHS(Real_Runs, spotpy.algorithms.lhs):
+    pass
+
+class FAST(Real_Runs, spotpy.algorithms.fast):
+    pass
+
+# ----------------------------------------------------------------------------------------------------------------------
+# DDS en paralelo
+# ----------------------------------------------------------------------------------------------------------------------
+class Parallel_DDS(Real_Runs, spotpy.algorithms.dds):
+    """
+    DDS síncrono en paralelo (PDDS): en cada ronda se proponen Batch perturbaciones del mejor punto actual, se
+    evalúan juntas (un lote del pool de spotpy) y el mejor punto se reemplaza por la mejor de ellas si la mejora.
+    La probabilidad de perturbar cada parámetro sigue el calendario de DDS de spotpy, 1 - ln(i)/ln(m), con i la
+    ronda y m el número de rondas, y cada perturbación usa el mismo vecindario (r) y reflexión en los límites.
+    Con Batch=1 es DDS (Tolson, B. A. and Shoemaker, C. A. (2007), Water Resour. Res., 43, W01413).
+    """
+    def __init__(self, *args, **kwargs):
+        self.Batch = max(1, int(kwargs.pop('Batch', 1)))
+        super(Parallel_DDS, self).__init__(*args, **kwargs)
+        # Generador propio (dds usa el global de numpy, que el modelo puede usar en 'seq')
+        self._set_np_random(np.random.RandomState(kwargs.get('random_state')))
+        self.algorithm_name = 'Parallel Dynamically Dimensioned Search (PDDS) algorithm'
+
+    def _Evaluate(self, First, Candidates, Best, BestLike):
+        # Evalúa un lote (en el orden de Candidates) y retorna el mejor punto
+        for rep, x, simulations in self.repeat(((First + i, x) for i, x in enumerate(Candidates))):
+            like = self.postprocessing(rep, x, simulations)
+            if like > BestLike:
+                Best, BestLike = list(x), like
+        return Best, BestLike
+
+    def sample(self, repetitions, trials=1, x_initial=np.array([])):
+        """
+        Hace repetitions evaluaciones. El punto inicial es x_initial o la mejor de max(5, 0.5 % de repetitions)
+        muestras uniformes (como DDS), evaluadas en un lote. trials se acepta por compatibilidad con dds (una prueba).
+        """
+        self.set_repetiton(repetitions)
+        self.min_bound, self.max_bound = self.parameter()['minbound'], self.parameter()['maxbound']
+        print('Starting the PDDS algorithm with %d repetitions (%d perturbations per round)...' %
+              (repetitions, self.Batch))
+
+        if len(x_initial) == 0:
+            Initial     = int(np.max([5, round(0.005*repetitions)]))
+            Candidates  = [self.min_bound + (self.max_bound - self.min_bound)*self.np_random.rand(len(self.min_bound))
+                           for _ in range(Initial)]
+        else:
+            x_initial   = np.array(x_initial, dtype=float)
+            if len(x_initial) != len(self.min_bound):
+                raise ValueError("User specified 'x_initial' has not the same length as available parameters")
+            if not (np.all(x_initial <= self.max_bound) and np.all(x_initial >= self.min_bound)):
+                raise ValueError("User specified 'x_initial' but the values are not within the parameter range")
+            Initial     = 1
+            Candidates  = [x_initial]
+        if repetitions <= Initial:
+            raise ValueError('# Initialization samples >= Max # function evaluations.')
+        Best, BestLike = self._Evaluate(0, Candidates, None, -np.inf)
+
+        # Rondas de Batch perturbaciones (la última con las evaluaciones que quedan)
+        Left    = repetitions - Initial
+        Rounds  = int(np.ceil(Left / self.Batch))
+        for Round in range(Rounds):
+            Current     = self.fix_status_params_format(Best)
+            Candidates  = [self.calculate_next_s_test(Current, Round, max(Rounds, 2), self.r)
+                           for _ in range(min(self.Batch, Left - Round*self.Batch))]
+            Best, BestLike = self._Evaluate(Initial + Round*self.Batch, Candidates, Best, BestLike)
+
+        print('Best solution found has obj function value of ' + str(BestLike) + '\n\n')
+        self.final_call()
+        return [{'sbest': self.fix_status_params_format(Best), 'objfunc_val': BestLike}]
+
+# ----------------------------------------------------------------------------------------------------------------------
+# SCE-UA por lotes
+# ----------------------------------------------------------------------------------------------------------------------
+class Batched_SCEUA(Real_Runs, spotpy.algorithms.sceua):
+    """
+    SCE-UA (Duan, Sorooshian and Gupta, 1994) con evaluación por lotes: la población inicial (2p+1 puntos por
+    complejo) es un lote, y en cada paso de la evolución competitiva (CCE) el punto nuevo de todos los complejos se
+    evalúa en un lote: primero las reflexiones y luego, solo en los complejos en que el intento anterior no mejoró al
+    peor punto del símplex, las contracciones y los puntos aleatorios.
+    Todos los sorteos (población inicial, símplex y puntos aleatorios) se hacen en el proceso principal, con un
+    generador propio sembrado con random_state y en el orden de los complejos, y los lotes se evalúan en orden
+    ('mpc'), por lo que con la misma semilla y el mismo número de complejos (Complexes) el resultado es idéntico con
+    cualquier número de procesos. Cada evaluación de InVEST cuenta para repetitions y se guarda en la base de datos de
+    spotpy.
+    """
+    def __init__(self, *args, **kwargs):
+        self.Complexes = max(2, int(kwargs.pop('Complexes', 20)))
+        super(Batched_SCEUA, self).__init__(*args, **kwargs)
+        # Generador propio para todos los sorteos (el global de numpy lo puede usar el modelo en 'seq')
+        self.np_random = np.random.RandomState(kwargs.get('random_state'))
+        self.algorithm_name = 'Batched Shuffled Complex Evolution (SCE-UA) algorithm'
+
+    def _Evaluate(self, Points):
+        # Evalúa un lote en orden sin pasar de repetitions y retorna el error de cada punto (NaN -> peor posible)
+        Points  = Points[:max(0, self.Repetitions - self.Calls)]
+        First   = self.Calls
+        Errors  = np.full(len(Points), np.inf)
+        self.Calls += len(Points)
+        for rep, x, simulations in self.repeat(((First + i, x) for i, x in enumerate(Points))):
+            like = self.postprocessing(rep, x, simulations)
+            if np.isfinite(like):
+                Errors[rep - First] = like
+        return Errors
+
+    def _Random(self, Num):
+        # Puntos uniformes en los límites
+        return self.min_bound + (self.max_bound - self.min_bound)*self.np_random.rand(Num, len(self.min_bound))
+
+    def _CCE(self, Worst, WorstError, Center):
+        """
+        Un paso de CCE en todos los complejos (una fila por complejo): reflexión del peor punto del símplex sobre
+        el centroide de los demás (punto aleatorio si sale de los límites); donde no mejora al peor, contracción
+        hacia el centroide y, si tampoco mejora, un punto aleatorio. Cada intento es un lote. Retorna los puntos
+        nuevos y su error para los complejos que alcanzaron a evaluarse con las evaluaciones restantes.
+        """
+        Constant    = self.min_bound >= self.max_bound
+        New         = Center + (Center - Worst)
+        New[:, Constant] = Worst[:, Constant]
+        Out         = np.flatnonzero(((New < self.min_bound) | (New > self.max_bound)).any(axis=1))
+        New[Out]    = self._Random(len(Out))
+        Errors      = self._Evaluate(New)
+        New         = New[:len(Errors)]
+
+        # Contracción y, si tampoco mejora, punto aleatorio (reemplaza al peor en cualquier caso)
+        for Attempt in ['contraction', 'random']:
+            Failed  = np.flatnonzero(Errors > WorstError[:len(Errors)])
+            if len(Failed) == 0:
+                break
+            if Attempt == 'contraction':
+                Points  = Worst[Failed] + 0.5*(Center[Failed] - Worst[Failed])
+                Points[:, Constant] = Worst[Failed][:, Constant]
+            else:
+                Points  = self._Random(len(Failed))
+            Result  = self._Evaluate(Points)
+            New[Failed[:len(Result)]], Errors[Failed[:len(Result)]] = Points[:len(Result)], Result
+        return New, Errors
+
+    def _Range(self, X):
+        # Rango geométrico normalizado de la población (criterio de convergencia de SCE-UA)
+        Varies = self.max_bound > self.min_bound
+        if not Varies.any():
+            return 0.0
+        with np.errstate(divide='ignore'):
+            return np.exp(np.mean(np.log((X[:, Varies].max(axis=0) - X[:, Varies].min(axis=0)) /
+                                         (self.max_bound - self.min_bound)[Varies])))
+
+    def sample(self, repetitions, kstop=100, pcento=0.0000001, peps=0.0000001):
+        """
+        Hace hasta repetitions evaluaciones. Se detiene antes si la población converge (rango geométrico normalizado
+        menor que peps) o si el mejor error cambia menos de pcento % en los últimos kstop ciclos, como sceua.
+        """
+        self.set_repetiton(repetitions)
+        self.Repetitions, self.Calls = repetitions, 0
+        self.min_bound, self.max_bound = self.parameter()['minbound'], self.parameter()['maxbound']
+        NumPar      = len(self.min_bound)
+        NumPoint    = 2*NumPar + 1
+        NumSimplex  = NumPar + 1
+        # Distribución trapezoidal para elegir el símplex (más probable cuanto mejor es el punto en el complejo)
+        Weights     = 2.0*np.arange(NumPoint, 0, -1) / (NumPoint*(NumPoint + 1))
+        print('Starting the batched SCE-UA algorithm with %d repetitions (%d complexes of %d points)...' %
+              (repetitions, self.Complexes, NumPoint))
+
+        # Población inicial, ordenada de menor a mayor error
+        X       = self._Random(NumPoint*self.Complexes)
+        F       = self._Evaluate(X)
+        X       = X[:len(F)]
+        Order   = np.argsort(F, kind='stable')
+        X, F    = X[Order], F[Order]
+        Best    = [F[0]]
+        Loop    = 0
+        while self.Calls < repetitions and self._Range(X) > peps:
+            Loop   += 1
+            # Complejo k: puntos k, k + Complexes, k + 2*Complexes, ... de la población ordenada
+            CX      = [X[k::self.Complexes].copy() for k in range(self.Complexes)]
+            CF      = [F[k::self.Complexes].copy() for k in range(self.Complexes)]
+            for Step in range(NumPoint):
+                if self.Calls >= repetitions:
+                    break
+                Simplex = [np.sort(self.np_random.choice(NumPoint, NumSimplex, replace=False, p=Weights))
+                           for _ in range(self.Complexes)]
+                Worst   = np.array([CX[k][s[-1]] for k, s in enumerate(Simplex)])
+                Center  = np.array([CX[k][s[:-1]].mean(axis=0) for k, s in enumerate(Simplex)])
+                New, Errors = self._CCE(Worst, np.array([CF[k][s[-1]] for k, s in enumerate(Simplex)]), Center)
+                # El punto nuevo reemplaza al peor del símplex y el complejo se reordena
+                for k in range(len(Errors)):
+                    CX[k][Simplex[k][-1]], CF[k][Simplex[k][-1]] = New[k], Errors[k]
+                    Order   = np.argsort(CF[k], kind='stable')
+                    CX[k], CF[k] = CX[k][Order], CF[k][Order]
+
+            # Mezcla de los complejos
+            X, F    = np.concatenate(CX), np.concatenate(CF)
+            Order   = np.argsort(F, kind='stable')
+            X, F    = X[Order], F[Order]
+            Best.append(F[0])
+            if Loop >= kstop:
+                Change = np.abs(Best[-1] - Best[-kstop - 1])*100 / max(np.mean(np.abs(Best[-kstop - 1:])), 1e-300)
+                if Change <= pcento:
+                    print('The best point has improved in the last %d loops by less than %g %%' % (kstop, pcento))
+                    break
+
+        print('Search was stopped at trial number %d after %d complex evolution loops - best %g - normalized '
+              'geometric range %g' % (self.Calls, Loop, F[0], self._Range(X)))
+        self.final_call()
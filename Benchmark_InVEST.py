@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------------
+# Nature For Water Facility - The Nature Conservancy
+# -------------------------------------------------------------------------
+# InVEST - Version 3.15.1 (update July 2025)
+# -------------------------------------------------------------------------
+#                            DESCRIPTION
+# -------------------------------------------------------------------------
+# Pruebas de rendimiento de la calibración sobre un proyecto y suite de
+# rendimiento sobre Dummy_InVEST.zip con proyectos escalados.
+# -------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Package
+# ----------------------------------------------------------------------------------------------------------------------
+import os
+import json
+import time
+import shutil
+import zipfile
+import platform
+import openpyxl
+import rasterio
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+from rasterio.transform import Affine
+from shapely.geometry import box
+from concurrent.futures import ProcessPoolExecutor
+import Spotpy_InVEST
+from Config_InVEST import Load_Config, Models
+from Results_InVEST import Read_Results
+from Timing_InVEST import Stage_Summary
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Reparto de núcleos entre evaluaciones simultáneas y procesos de taskgraph
+# ----------------------------------------------------------------------------------------------------------------------
+def Benchmark_Workers(ProjectPath, InVEST_Main_Path, NameModel='SDR', NumEval=None, Splits=None, Seed=0):
+    """
+    Mide las evaluaciones por minuto de NameModel con distintas combinaciones (NumWorkers, TaskWorkers):
+    NumWorkers evaluaciones simultáneas (Workers de RunCalInVEST) y TaskWorkers procesos de taskgraph en cada
+    ejecución de InVEST (args['n_workers']). Todas las combinaciones evalúan los mismos NumEval vectores de
+    parámetros sin la caché de evaluaciones. Los resultados se guardan en TMP/BENCHMARK/Benchmark_Workers.csv.
+
+    Retorna la tabla ordenada de la combinación más rápida a la más lenta.
+    """
+    Cores       = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    Config      = Load_Config(InVEST_Main_Path, ProjectPath)
+    UserData    = dict(Config.UserData)
+    Params      = Spotpy_InVEST.Parameters_Model(NameModel, Config.ParamsMin, Config.ParamsMax)
+
+    # Combinaciones por defecto: 1, 2, 4, ... evaluaciones simultáneas y, para cada una, taskgraph en el mismo
+    # proceso (-1) o con los núcleos que le corresponden
+    if Splits is None:
+        Splits  = []
+        NumWorkers = 1
+        while NumWorkers <= Cores:
+            Splits.append((NumWorkers, -1))
+            if Cores // NumWorkers > 1:
+                Splits.append((NumWorkers, Cores // NumWorkers))
+            NumWorkers *= 2
+
+    # Mismo número de evaluaciones para todas las combinaciones (dos rondas de la más paralela)
+    if NumEval is None:
+        NumEval = 2 * max(Split[0] for Split in Splits)
+
+    Rng = np.random.default_rng(Seed)
+    X   = Rng.uniform([P.minbound for P in Params], [P.maxbound for P in Params], size=(NumEval, len(Params)))
+
+    BenchPath = os.path.join(ProjectPath, 'TMP', 'BENCHMARK')
+    os.makedirs(BenchPath, exist_ok=True)
+
+    # Primera evaluación fuera de la medición: llena TMP/ROUTING como en la calibración
+    _Evaluate(ProjectPath, dict(UserData, TaskWorkers=-1), NameModel, X[0], os.path.join(BenchPath, 'WARMUP'))
+
+    Results = []
+    for NumWorkers, TaskWorkers in Splits:
+        WorkRoot    = os.path.join(BenchPath, 'W%d_T%d' % (NumWorkers, TaskWorkers))
+        Data        = dict(UserData, TaskWorkers=TaskWorkers)
+        StartTime   = time.time()
+        if NumWorkers <= 1:
+            for x in X:
+                _Evaluate(ProjectPath, Data, NameModel, x, WorkRoot)
+        else:
+            with ProcessPoolExecutor(max_workers=NumWorkers) as Pool:
+                list(Pool.map(_Evaluate, *zip(*[(ProjectPath, Data, NameModel, x, WorkRoot) for x in X])))
+        Time = time.time() - StartTime
+        shutil.rmtree(WorkRoot, ignore_errors=True)
+
+        Results.append((NumWorkers, TaskWorkers, Time, 60 * NumEval / Time))
+        print('Workers: %d - TaskWorkers: %d - %0.1f s - %0.2f evaluations/min' % Results[-1])
+
+    shutil.rmtree(os.path.join(BenchPath, 'WARMUP'), ignore_errors=True)
+
+    Results = pd.DataFrame(Results, columns=['NumWorkers', 'TaskWorkers', 'Time_s', 'Eval_min'])
+    Results = Results.sort_values('Eval_min', ascending=False).reset_index(drop=True)
+    Results.to_csv(os.path.join(BenchPath, 'Benchmark_Workers.csv'), index=False)
+
+    print('Best split - Workers: %d - TaskWorkers: %d (%d cores)' %
+          (Results.loc[0, 'NumWorkers'], Results.loc[0, 'TaskWorkers'], Cores))
+
+    return Results
+
+def _Evaluate(ProjectPath, UserData, NameModel, x, WorkRoot):
+    # Una evaluación con InVEST en el directorio del proceso (sin caché de evaluaciones)
+    WorkPath = os.path.join(WorkRoot, 'PID_%d' % os.getpid())
+    for Folder in ['OUTPUTS', 'TMP']:
+        os.makedirs(os.path.join(WorkPath, Folder), exist_ok=True)
+    return getattr(Spotpy_InVEST, 'Execute_' + NameModel)(ProjectPath, UserData, x, WorkPath)
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Suite de rendimiento sobre Dummy_InVEST.zip y versiones escaladas del proyecto
+# ----------------------------------------------------------------------------------------------------------------------
+def Unpack_Dummy(WorkPath, ZipPath=None):
+    # Descomprime el proyecto de ejemplo (por defecto el Dummy_InVEST.zip del repositorio) y retorna su carpeta
+    if ZipPath is None:
+        ZipPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Dummy_InVEST.zip')
+    with zipfile.ZipFile(ZipPath) as Zip:
+        Zip.extractall(WorkPath)
+        Root = Zip.namelist()[0].split('/')[0]
+
+    return os.path.join(WorkPath, Root)
+
+def Scale_Project(SourcePath, TargetPath, PixelFactor=1, NumBasins=None, NumScenarios=2):
+    """
+    Copia de las entradas de un proyecto con más resolución y/o más cuencas de calibración, para curvas de escala
+    reproducibles:
+        PixelFactor     multiplica el número de píxeles de todos los rásteres de INPUTS (4, 16, 64: cada píxel se
+                        divide en sqrt(PixelFactor) x sqrt(PixelFactor) con el mismo valor). Pixel y Threshold_Flow
+                        de UserData se ajustan para conservar el área por píxel y la red de drenaje.
+        NumBasins       reemplaza Basin_Cal_<Modelo> por una grilla de NumBasins polígonos (ws_id 1..NumBasins)
+                        recortada a la cuenca. Obs_Data se llena con valores sintéticos: los observados de la
+                        primera cuenca escalados por área (AWY, SDR, NDR) o iguales (SWY).
+        NumScenarios    escenarios de LULC_Batch (copias de la cobertura) para medir RunInVEST en modo batch.
+    Retorna la ruta del libro del proyecto nuevo.
+    """
+    Scale = int(round(np.sqrt(PixelFactor)))
+    if Scale**2 != PixelFactor:
+        raise ValueError('PixelFactor must be a perfect square (1, 4, 16, 64, ...)')
+
+    shutil.rmtree(TargetPath, ignore_errors=True)
+    shutil.copytree(os.path.join(SourcePath, 'INPUTS'), os.path.join(TargetPath, 'INPUTS'))
+    for Folder in ['EVALUATIONS', 'FIGURES', 'OUTPUTS', 'PARAMETERS', 'TMP']:
+        os.makedirs(os.path.join(TargetPath, Folder), exist_ok=True)
+    PathBook    = os.path.join(TargetPath, 'Main_InVEST.xlsx')
+    shutil.copyfile(os.path.join(SourcePath, 'Main_InVEST.xlsx'), PathBook)
+    Config      = Load_Config(PathBook)
+    UserData    = dict(Config.UserData)
+    Changes     = {}
+
+    # Rásteres de INPUTS (incluye las carpetas mensuales de P y ETo)
+    if Scale > 1:
+        for Root, _, Names in os.walk(os.path.join(TargetPath, 'INPUTS')):
+            for Name in Names:
+                if Name.lower().endswith('.tif'):
+                    _Upscale_Raster(os.path.join(Root, Name), Scale)
+        Changes['Pixel']            = UserData['Pixel'] / PixelFactor
+        Changes['Threshold_Flow']   = UserData['Threshold'] * PixelFactor
+
+    # Cuencas de calibración
+    Obs = None
+    if NumBasins is not None:
+        Basin   = gpd.read_file(os.path.join(TargetPath, 'INPUTS', 'Basin', UserData['Basin'] + '.shp'))
+        Grid    = _Basin_Grid(Basin, NumBasins)
+        for Model in Models:
+            PathModel = os.path.join(TargetPath, 'INPUTS', 'Basin_Cal_' + Model)
+            Original  = gpd.read_file(os.path.join(PathModel, 'Basin_Cal_' + Model + '.shp'))
+            shutil.rmtree(PathModel)
+            os.makedirs(PathModel)
+            Grid.to_crs(Original.crs).to_file(os.path.join(PathModel, 'Basin_Cal_' + Model + '.shp'))
+        Obs0    = Config.Obs_Data.iloc[0]
+        Ratio   = Grid.area.values / Grid.area.sum()
+        Obs     = pd.DataFrame({'ws_id': Grid['ws_id'].values})
+        for Model in Models:
+            Obs[Model] = Obs0[Model] if Model == 'SWY' else Obs0[Model] * Ratio
+
+    # Escenarios del modo batch (copias de la cobertura actual)
+    Batch = []
+    for i in range(NumScenarios):
+        Batch.append('%s_%d' % (UserData['LULC'], i + 1))
+        shutil.copyfile(os.path.join(TargetPath, 'INPUTS', 'LULC', UserData['LULC'] + '.tif'),
+                        os.path.join(TargetPath, 'INPUTS', 'LULC', Batch[-1] + '.tif'))
+
+    Set_Book(PathBook, Values=Changes, Obs=Obs, LULC_Batch=Batch)
+    return PathBook
+
+def _Upscale_Raster(PathRaster, Scale):
+    # Cada píxel se repite Scale x Scale veces con el tamaño de píxel dividido por Scale (mismo extent)
+    with rasterio.open(PathRaster) as Src:
+        Profile = Src.profile
+        Data    = Src.read()
+    Data = np.repeat(np.repeat(Data, Scale, axis=1), Scale, axis=2)
+    Profile.update(width=Data.shape[2], height=Data.shape[1], transform=Profile['transform'] * Affine.scale(1/Scale),
+                   tiled=True, blockxsize=256, blockysize=256)
+    with rasterio.open(PathRaster, 'w', **Profile) as Dst:
+        Dst.write(Data)
+
+def _Basin_Grid(Basin, NumBasins):
+    # Grilla regular recortada a la cuenca con NumBasins polígonos no vacíos (los de mayor área)
+    Shape       = Basin.geometry.union_all() if hasattr(Basin.geometry, 'union_all') else Basin.geometry.unary_union
+    x0, y0, x1, y1 = Shape.bounds
+    n           = int(np.ceil(np.sqrt(NumBasins)))
+    while True:
+        xs, ys  = np.linspace(x0, x1, n + 1), np.linspace(y0, y1, n + 1)
+        Cells   = [box(xs[i], ys[j], xs[i + 1], ys[j + 1]).intersection(Shape) for j in range(n) for i in range(n)]
+        Cells   = [Cell for Cell in Cells if Cell.area > 0]
+        if len(Cells) >= NumBasins:
+            break
+        n += 1
+    Keep = sorted(np.argsort([-Cell.area for Cell in Cells])[:NumBasins])
+
+    return gpd.GeoDataFrame({'ws_id': np.arange(1, NumBasins + 1)}, geometry=[Cells[i] for i in Keep], crs=Basin.crs)
+
+def Set_Book(PathBook, Values=None, Run=None, Obs=None, LULC_Batch=None):
+    """
+    Modifica el libro de configuración de un proyecto de prueba:
+        Values      {Acronym de UserData: valor} (columna Value)
+        Run         modelo o lista de modelos que quedan con Run = 1 (los demás en 0)
+        Obs         tabla Obs_Data completa (ws_id y una columna por modelo)
+        LULC_Batch  lista de coberturas de la hoja LULC_Batch
+    """
+    Run     = [Run] if isinstance(Run, str) else Run
+    Book    = openpyxl.load_workbook(PathBook)
+    Sheet   = Book['UserData']
+    Header  = [Cell.value for Cell in Sheet[1]]
+    for Row in Sheet.iter_rows(min_row=2):
+        if Values and Row[0].value in Values:
+            Row[Header.index('Value')].value = Values[Row[0].value]
+        if Run is not None and Row[0].value == 'Run':
+            for Model in Models:
+                Row[Header.index(Model)].value = int(Model in Run)
+
+    if Obs is not None:
+        Sheet   = Book['Obs_Data']
+        Header  = [Cell.value for Cell in Sheet[1]]
+        Sheet.delete_rows(2, Sheet.max_row)
+        for Item in Obs.itertuples(index=False):
+            Item = Item._asdict()
+            Sheet.append([_Cell(Item.get(Name)) for Name in Header])
+
+    if LULC_Batch is not None:
+        if 'LULC_Batch' in Book.sheetnames:
+            del Book['LULC_Batch']
+        Sheet = Book.create_sheet('LULC_Batch')
+        Sheet.append(['Name LULC'])
+        for Name in LULC_Batch:
+            Sheet.append([Name])
+
+    Book.save(PathBook)
+
+def _Cell(Value):
+    # Valores de numpy a tipos de Python para openpyxl
+    return Value.item() if hasattr(Value, 'item') else Value
+
+def Benchmark_Suite(WorkPath, NumIter=10, Models=Models, Scales=((1, None),), Native=True, NumWorkers=1,
+                    ZipPath=None, Baseline=None, Tolerance=0.2, Seed=0):
+    """
+    Mide el rendimiento de la herramienta sobre Dummy_InVEST.zip y versiones escaladas del proyecto (Scale_Project).
+    Para cada escala (PixelFactor, NumBasins) de Scales:
+        - NumIter iteraciones de calibración de cada modelo de Models (Spotpy_InVEST.simulation, los mismos vectores
+          de parámetros en todas las escalas). La primera iteración (preparación de motores y ruteo) se reporta
+          aparte como Warmup_s.
+        - RunInVEST en modo simple (todos los modelos de Models) y en modo batch (LULC_Batch con NumWorkers).
+        - calculate_zonal_stats sola sobre las cuencas de calibración (primera llamada y llamadas siguientes).
+    Los resultados se guardan en WorkPath/Benchmark_Suite.json. Con Baseline (un JSON anterior) se comparan con
+    Compare_Benchmark y se marcan las regresiones mayores a Tolerance.
+
+    Retorna la tabla de resultados (y la comparación si hay Baseline).
+    """
+    Source  = Unpack_Dummy(os.path.join(WorkPath, 'SOURCE'), ZipPath)
+    Rng     = np.random.default_rng(Seed)
+    U       = Rng.uniform(size=(NumIter + 1, 8))
+
+    Results = []
+    for PixelFactor, NumBasins in Scales:
+        Case        = 'P%d_B%s' % (PixelFactor, NumBasins or 'orig')
+        ProjectPath = os.path.join(WorkPath, Case)
+        PathBook    = Scale_Project(Source, ProjectPath, PixelFactor, NumBasins)
+        Row         = {'PixelFactor': PixelFactor, 'NumBasins': NumBasins}
+
+        # Iteraciones de calibración
+        for NameModel in Models:
+            Set_Book(PathBook, Run=NameModel)
+            Setup   = Spotpy_InVEST.Spotpy_InVEST(ProjectPath, PathBook, NameModel, 'Root Mean Square Error (RMSE)', 1,
+                                                  NativeAWY=Native, NativeSWY=Native, NativeSDR=Native,
+                                                  NativeNDR=Native, EvalCache=False)
+            Low     = np.array([P.minbound for P in Setup.params])
+            High    = np.array([P.maxbound for P in Setup.params])
+            X       = Low + U[:, :len(Low)] * (High - Low)
+            Times   = []
+            for x in X:
+                StartTime = time.time()
+                Setup.simulation(x)
+                Times.append(time.time() - StartTime)
+            Setup.Store.Flush()
+            Stages  = Read_Results(Spotpy_InVEST.Results_Path(ProjectPath, NameModel, Setup.UserData['Suffix']))
+            Summary = Stage_Summary(Stages['Stages'][-NumIter:])
+            Results.append(dict(Row, Case=Case + '_' + NameModel, Task='calibration', Model=NameModel,
+                                Warmup_s=Times[0], Time_s=float(np.median(Times[1:])),
+                                Eval_min=60 / float(np.median(Times[1:])), Stages=Summary['p50_ms'].to_dict()))
+            print('%s - %s calibration - %0.3f s/iteration' % (Case, NameModel, Results[-1]['Time_s']))
+
+        # RunInVEST simple y batch con los modelos de Models
+        Set_Book(PathBook, Run=Models)
+        for Batch in [False, True]:
+            StartTime   = time.time()
+            Spotpy_InVEST.RunInVEST(ProjectPath, PathBook, BatchMode=Batch, NumWorkers=NumWorkers)
+            Name        = 'RunInVEST_batch' if Batch else 'RunInVEST'
+            Results.append(dict(Row, Case=Case + '_' + Name, Task=Name, Model=','.join(Models),
+                                Time_s=time.time() - StartTime))
+            print('%s - %s - %0.1f s' % (Case, Name, Results[-1]['Time_s']))
+
+        # Estadísticas zonales sobre el DEM
+        Config      = Load_Config(PathBook, ProjectPath)
+        Shapefile   = os.path.join(ProjectPath, 'INPUTS', 'Basin_Cal_SDR', 'Basin_Cal_SDR.shp')
+        Raster      = os.path.join(ProjectPath, 'INPUTS', Config.UserData['DEM'] + '.tif')
+        Times       = []
+        for _ in range(NumIter + 1):
+            StartTime = time.time()
+            Spotpy_InVEST.calculate_zonal_stats(Shapefile, Raster, '', SaveShp=False)
+            Times.append(time.time() - StartTime)
+        Results.append(dict(Row, Case=Case + '_zonal', Task='calculate_zonal_stats', Model='',
+                            Warmup_s=Times[0], Time_s=float(np.median(Times[1:]))))
+        print('%s - calculate_zonal_stats - %0.4f s' % (Case, Results[-1]['Time_s']))
+
+    Meta = {'Timestamp' : time.strftime('%Y-%m-%d %H:%M:%S'),
+            'Platform'  : platform.platform(),
+            'Python'    : platform.python_version(),
+            'Cores'     : os.cpu_count(),
+            'NumIter'   : NumIter,
+            'Native'    : Native,
+            'Seed'      : Seed}
+    PathResults = os.path.join(WorkPath, 'Benchmark_Suite.json')
+    with open(PathResults, 'w') as ID_File:
+        json.dump({'Meta': Meta, 'Results': Results}, ID_File, indent=2)
+    print('Benchmark results - ' + PathResults)
+
+    Results = pd.DataFrame(Results).set_index('Case')
+    if Baseline is not None:
+        return Results, Compare_Benchmark(PathResults, Baseline, Tolerance)
+    return Results
+
+def Compare_Benchmark(PathResults, PathBaseline, Tolerance=0.2):
+    """
+    Compara dos JSON de Benchmark_Suite caso por caso (Time_s). Un caso es 'regression' si es más lento que la
+    línea base en más de Tolerance (0.2 = 20 %), 'improvement' si es más rápido en más de Tolerance y 'ok' en otro
+    caso. Retorna la tabla de comparación; las regresiones también se imprimen.
+    """
+    Tables = []
+    for PathJSON in [PathResults, PathBaseline]:
+        with open(PathJSON, 'r') as ID_File:
+            Tables.append(pd.DataFrame(json.load(ID_File)['Results']).set_index('Case')['Time_s'])
+
+    Compare = pd.concat(Tables, axis=1, keys=['Time_s', 'Baseline_s'], join='inner')
+    Compare['Ratio']    = Compare['Time_s'] / Compare['Baseline_s']
+    Compare['Status']   = np.where(Compare['Ratio'] > 1 + Tolerance, 'regression',
+                                   np.where(Compare['Ratio'] < 1 - Tolerance, 'improvement', 'ok'))
+
+    Regressions = Compare[Compare['Status'] == 'regression']
+    if len(Regressions) > 0:
+        print('Benchmark regressions (more than %0.0f %% slower than the baseline):' % (100*Tolerance))
+        print(Regressions.to_string(float_format='%0.3f'))
+    else:
+        print('No benchmark regressions against ' + PathBaseline)
+
+    return Compare
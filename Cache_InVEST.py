@@ -0,0 +1,404 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------------
+# Nature For Water Facility - The Nature Conservancy
+# -------------------------------------------------------------------------
+# InVEST - Version 3.15.1 (update July 2025)
+# -------------------------------------------------------------------------
+#                            DESCRIPTION
+# -------------------------------------------------------------------------
+# Cachés persistentes del proyecto que se reutilizan entre iteraciones de
+# la calibración.
+# -------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Package
+# ----------------------------------------------------------------------------------------------------------------------
+import os
+import time
+import pickle
+import inspect
+import contextlib
+import shutil
+import sqlite3
+import hashlib
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import rasterio
+import rasterio.errors
+import rasterio.features
+
+# pygeoprocessing y natcap.invest sólo se usan al ejecutar InVEST (caché de ruteo y versión de la caché de
+# evaluaciones): sin ellos se pueden usar las demás cachés, p. ej. en las pruebas
+try:
+    import pygeoprocessing
+    import pygeoprocessing.routing
+except ImportError:
+    pygeoprocessing = None
+try:
+    import natcap.invest
+except ImportError:
+    natcap = None
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Hash de contenido de archivos (memoizado por ruta, tamaño y fecha de modificación)
+# ----------------------------------------------------------------------------------------------------------------------
+_HashMemo = {}
+
+def Hash_File(PathFile, BlockSize=2**20):
+    Stat    = os.stat(PathFile)
+    Key     = (os.path.abspath(PathFile), Stat.st_size, Stat.st_mtime_ns)
+    if Key not in _HashMemo:
+        Hash = hashlib.sha1()
+        with open(PathFile, 'rb') as File:
+            for Block in iter(lambda: File.read(BlockSize), b''):
+                Hash.update(Block)
+        _HashMemo[Key] = Hash.hexdigest()
+    return _HashMemo[Key]
+
+# Archivos que acompañan a un shapefile (atributos como ws_id en el dbf, proyección en el prj)
+ShapeSidecars = ['.shx', '.dbf', '.prj', '.cpg']
+
+def Hash_Path(PathInput):
+    """
+    Hash de contenido de una entrada de InVEST: un archivo (con sus archivos compañeros si es un shapefile) o una
+    carpeta (todos sus archivos, p. ej. los rásteres mensuales de SWY). Retorna None si la ruta no existe.
+    """
+    if os.path.isdir(PathInput):
+        Parts = []
+        for Root, Dirs, Files in os.walk(PathInput):
+            Dirs.sort()
+            for File in sorted(Files):
+                PathFile = os.path.join(Root, File)
+                Parts.append((os.path.relpath(PathFile, PathInput), Hash_File(PathFile)))
+        return hashlib.sha1(repr(Parts).encode('utf-8')).hexdigest()
+    if not os.path.isfile(PathInput):
+        return None
+    if os.path.splitext(PathInput)[1].lower() != '.shp':
+        return Hash_File(PathInput)
+    Parts = [Hash_File(PathInput)]
+    for Ext in ShapeSidecars:
+        PathFile = os.path.splitext(PathInput)[0] + Ext
+        Parts.append(Hash_File(PathFile) if os.path.isfile(PathFile) else None)
+    return hashlib.sha1(repr(Parts).encode('utf-8')).hexdigest()
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Caché de ruteo de flujo (SDR - NDR)
+# ----------------------------------------------------------------------------------------------------------------------
+# Funciones de pygeoprocessing que sólo dependen del DEM, del umbral de acumulación y del método de direcciones de flujo
+RoutingFunctions = [('routing', 'fill_pits'),
+                    ('routing', 'flow_dir_mfd'),
+                    ('routing', 'flow_dir_d8'),
+                    ('routing', 'flow_accumulation_mfd'),
+                    ('routing', 'flow_accumulation_d8'),
+                    ('routing', 'extract_streams_mfd'),
+                    ('routing', 'extract_streams_d8'),
+                    ('', 'calculate_slope')]
+
+# Versiones de pygeoprocessing (mayor.menor) cuyas funciones de ruteo se revisaron: una sola salida target_*_path y
+# las entradas ráster en argumentos *_path_band
+RoutingVersions = ['2.4']
+
+class Routing_Cache(object):
+    """
+    Reutiliza el DEM rellenado, la pendiente, las direcciones y acumulación de flujo y la red de drenaje entre
+    ejecuciones de sdr.execute / ndr.execute. Los rásteres se guardan en TMP/ROUTING/<hash DEM>_<método>_<umbral> y
+    cada entrada se identifica con el hash del contenido de los rásteres de entrada y los argumentos de la función.
+
+    with Routing_Cache(ProjectPath, args):
+        sdr.execute(args)
+
+    Dentro del bloque las funciones de RoutingFunctions se reemplazan en el módulo pygeoprocessing, es decir, en todo
+    el proceso: no debe usarse pygeoprocessing en otro hilo mientras tanto. Con una versión de pygeoprocessing que no
+    está en RoutingVersions no se reemplaza nada (InVEST calcula el ruteo en cada ejecución).
+    """
+    def __init__(self, ProjectPath, args):
+        Key             = '%s_%s_%s' % (Hash_File(args['dem_path'])[:16],
+                                        args['flow_dir_algorithm'],
+                                        args['threshold_flow_accumulation'])
+        self.CachePath  = os.path.join(ProjectPath, 'TMP', 'ROUTING', Key)
+        self.Original   = {}
+
+    def __enter__(self):
+        if not Routing_Supported():
+            return self
+        os.makedirs(self.CachePath, exist_ok=True)
+        for Module, Name in RoutingFunctions:
+            Owner = _Routing_Owner(Module)
+            self.Original[(Module, Name)] = _Original(Module, Name)
+            setattr(Owner, Name, Routing_Function(self.CachePath, Module, Name))
+        return self
+
+    def __exit__(self, *exc):
+        for (Module, Name), Fun in self.Original.items():
+            setattr(_Routing_Owner(Module), Name, Fun)
+        self.Original = {}
+        return False
+
+    @staticmethod
+    def _Key(Fun, Name, args, kwargs):
+        """
+        Ráster de salida y clave de una llamada a Fun. Los argumentos se leen por nombre con la firma de Fun: la salida
+        es el argumento target_*_path, los rásteres de entrada (*_path_band) se identifican por su contenido y
+        working_dir no cuenta. Retorna (None, None) si la llamada no tiene exactamente una salida.
+        """
+        try:
+            Arguments = inspect.signature(Fun).bind(*args, **kwargs).arguments
+        except (TypeError, ValueError):
+            return None, None
+        Targets = [NameArg for NameArg in Arguments if NameArg.startswith('target_') and NameArg.endswith('_path')]
+        if len(Targets) != 1 or not isinstance(Arguments[Targets[0]], str):
+            return None, None
+        Parts   = [Name]
+        for NameArg in sorted(Arguments):
+            Value = Arguments[NameArg]
+            if NameArg in Targets or NameArg == 'working_dir':
+                continue
+            elif NameArg.endswith('_path_band') and Value is not None:
+                Parts.append((NameArg, Hash_File(Value[0]), Value[1]))
+            else:
+                Parts.append((NameArg, repr(Value)))
+        return Arguments[Targets[0]], hashlib.sha1(repr(Parts).encode('utf-8')).hexdigest()[:16]
+
+def _Routing_Owner(Module):
+    return pygeoprocessing.routing if Module == 'routing' else pygeoprocessing
+
+# Funciones originales de pygeoprocessing (se leen antes de reemplazarlas por Routing_Function; en los procesos de
+# taskgraph el módulo no está reemplazado)
+_RoutingOriginal = {}
+
+def _Original(Module, Name):
+    if (Module, Name) not in _RoutingOriginal:
+        _RoutingOriginal[(Module, Name)] = getattr(_Routing_Owner(Module), Name)
+    return _RoutingOriginal[(Module, Name)]
+
+_RoutingSupported = []
+
+def Routing_Supported():
+    # pygeoprocessing de una versión de RoutingVersions y con la firma de cada función (se revisa una vez por proceso)
+    if not _RoutingSupported:
+        if pygeoprocessing is None:
+            raise ImportError('The routing cache needs pygeoprocessing')
+        Version     = '.'.join(pygeoprocessing.__version__.split('.')[:2])
+        Supported   = Version in RoutingVersions
+        try:
+            for Module, Name in RoutingFunctions:
+                inspect.signature(_Original(Module, Name))
+        except (TypeError, ValueError):
+            Supported = False
+        if not Supported:
+            print('Routing cache - disabled: pygeoprocessing %s is not a supported version (%s) or does not expose '
+                  'the routing function signatures' % (pygeoprocessing.__version__, ', '.join(RoutingVersions)))
+        _RoutingSupported.append(Supported)
+    return _RoutingSupported[0]
+
+class Routing_Function(object):
+    """
+    Reemplazo de una función de ruteo de pygeoprocessing que lee/escribe la caché. Es una clase (no una clausura)
+    para que taskgraph pueda enviarla a sus procesos cuando args['n_workers'] > 0.
+    """
+    def __init__(self, CachePath, Module, Name):
+        self.CachePath  = CachePath
+        self.Module     = Module
+        self.Name       = Name
+        self.__name__   = Name
+
+    def __call__(self, *args, **kwargs):
+        Fun         = _Original(self.Module, self.Name)
+        Target, Key = Routing_Cache._Key(Fun, self.Name, args, kwargs)
+        if Target is None:
+            return Fun(*args, **kwargs)
+
+        PathCache = os.path.join(self.CachePath, self.Name + '_' + Key + '.tif')
+        if os.path.exists(PathCache):
+            shutil.copyfile(PathCache, Target)
+            return None
+
+        Result = Fun(*args, **kwargs)
+        # Escritura atómica: varios workers pueden poblar la misma entrada
+        PathTmp = PathCache + '.%d.tmp' % os.getpid()
+        shutil.copyfile(Target, PathTmp)
+        os.replace(PathTmp, PathCache)
+        return Result
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Índice zonal precalculado (reemplaza rasterstats en cada iteración)
+# ----------------------------------------------------------------------------------------------------------------------
+_ZonalMemo = {}
+
+class Zonal_Index(object):
+    """
+    Rasteriza una sola vez las cuencas de un shapefile sobre la grilla de un ráster. Como rasterstats, hay un
+    registro por polígono (en el orden del shapefile), se usa el centro del píxel y se excluyen el nodata y los NaN.
+    Cada polígono se rasteriza por separado, por lo que las cuencas anidadas o traslapadas (redes de estaciones)
+    cuentan los píxeles que comparten en todas ellas: Pixels puede repetir píxeles y Labels da el polígono de cada uno.
+    Overlap indica si hay píxeles en más de una cuenca. Las estadísticas de cada iteración se calculan en una sola
+    pasada vectorizada.
+    """
+    def __init__(self, ShapePath, Src, ws_id='ws_id'):
+        Polygons = gpd.read_file(ShapePath, engine='pyogrio')
+        if Polygons.crs != Src.crs:
+            Polygons = Polygons.to_crs(Src.crs)
+        self.Polygons   = Polygons
+        self.ws_id      = Polygons[ws_id].values
+
+        # Índices planos de los píxeles de cada polígono (rasterizado en su ventana), ordenados por polígono
+        Pixels, Labels  = [], []
+        for i, Geom in enumerate(Polygons.geometry):
+            Index = np.empty(0, dtype='int64')
+            if Geom is not None and not Geom.is_empty:
+                try:
+                    Window = rasterio.features.geometry_window(Src, [Geom])
+                except rasterio.errors.WindowError:
+                    Window = None
+                if Window is not None and int(Window.width) > 0 and int(Window.height) > 0:
+                    Mask = rasterio.features.rasterize([(Geom, 1)], out_shape=(int(Window.height), int(Window.width)),
+                                                       transform=Src.window_transform(Window), fill=0, dtype='uint8')
+                    Row, Col = np.nonzero(Mask)
+                    Index = (Row + int(Window.row_off)).astype('int64')*Src.width + Col + int(Window.col_off)
+            Pixels.append(Index)
+            Labels.append(np.full(len(Index), i, dtype='int64'))
+        self.Pixels     = np.concatenate(Pixels) if Pixels else np.empty(0, dtype='int64')
+        self.Labels     = np.concatenate(Labels) if Labels else np.empty(0, dtype='int64')
+        self.Overlap    = len(np.unique(self.Pixels)) < len(self.Pixels)
+
+    @staticmethod
+    def Get(ShapePath, Src, ws_id='ws_id'):
+        # El dbf (ws_id) y el prj también cambian el índice
+        Stamp = tuple(os.stat(Path).st_mtime_ns if os.path.isfile(Path) else None
+                      for Path in [ShapePath] + [os.path.splitext(ShapePath)[0] + Ext for Ext in ['.dbf', '.prj']])
+        Key = (os.path.abspath(ShapePath), Stamp, ws_id, Src.shape, tuple(Src.transform), str(Src.crs))
+        if Key not in _ZonalMemo:
+            _ZonalMemo[Key] = Zonal_Index(ShapePath, Src, ws_id)
+        return _ZonalMemo[Key]
+
+    def Label_Raster(self, Size, Model):
+        """
+        Rótulo de cuenca por píxel (-1 fuera de las cuencas) para los motores nativos, que asignan cada píxel a una
+        sola cuenca. Con cuencas traslapadas se lanza ValueError: esa calibración debe usar el modelo de InVEST.
+        """
+        if self.Overlap:
+            raise ValueError('The native %s engine needs non-overlapping watersheds, but some polygons of the '
+                             'watersheds shapefile share pixels. Run the calibration with Native%s=False.' %
+                             (Model, Model.split('_')[0]))
+        Label               = np.full(Size, -1, dtype='int32')
+        Label[self.Pixels]  = self.Labels
+        return Label
+
+    def Stats(self, Data, NoData=None):
+        N       = len(self.ws_id)
+        Values  = Data.ravel()[self.Pixels]
+        Valid   = ~np.isnan(Values)
+        if NoData is not None:
+            # Se compara en el tipo del ráster (como rasterstats): un nodata float32 como -1e32 no es exacto en float64
+            Valid &= Values != NoData
+        Values  = Values[Valid].astype('float64')
+        Labels  = self.Labels[Valid]
+
+        Count   = np.bincount(Labels, minlength=N)
+        Sum     = np.bincount(Labels, weights=Values, minlength=N)
+        Mean    = np.full(N, np.nan)
+        Min     = np.full(N, np.nan)
+        Max     = np.full(N, np.nan)
+        Median  = np.full(N, np.nan)
+        Has     = Count > 0
+        Mean[Has] = Sum[Has] / Count[Has]
+
+        # Ordenar por cuenca y valor: mínimo, máximo y mediana salen por posición
+        Order   = np.lexsort((Values, Labels))
+        Values  = Values[Order]
+        Start   = np.concatenate(([0], np.cumsum(Count)[:-1]))[Has]
+        End     = Start + Count[Has] - 1
+        Min[Has]    = Values[Start]
+        Max[Has]    = Values[End]
+        Median[Has] = 0.5*(Values[(Start + End)//2] + Values[(Start + End + 1)//2])
+        Sum[~Has]   = np.nan
+
+        return pd.DataFrame({'mean': Mean, 'min': Min, 'max': Max, 'median': Median, 'sum': Sum})
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Caché de evaluaciones por contenido (SQLite en PARAMETERS)
+# ----------------------------------------------------------------------------------------------------------------------
+class Eval_Cache(object):
+    """
+    Guarda la simulación (ws_id, Sim) de cada ejecución de InVEST, identificada por la versión de InVEST y el hash de
+    las entradas efectivas del modelo: el diccionario args (sin el directorio de trabajo; archivos, shapefiles con sus
+    archivos compañeros y carpetas por contenido) y la tabla biofísica ya afectada por los factores.
+    Como Create_argsInVEST y Factor_BioTable redondean los parámetros, muchos vectores de spotpy distintos producen
+    entradas idénticas y se resuelven sin ejecutar el modelo. La conexión se abre en cada operación para que el
+    objeto pueda enviarse a los procesos en paralelo. Cuando la caché supera MaxMB se eliminan las entradas usadas
+    hace más tiempo (LRU).
+    """
+    # Argumentos que no cambian el resultado del modelo
+    IgnoreArgs = ['workspace_dir', 'biophysical_table_path', 'results_suffix', 'n_workers']
+
+    def __init__(self, PathDB, MaxMB=256):
+        self.PathDB     = PathDB
+        self.MaxBytes   = int(MaxMB * 2**20)
+        # Resultado de la última consulta en este proceso
+        self.LastHit    = False
+        with self._Connect() as Con:
+            Con.execute('CREATE TABLE IF NOT EXISTS evals (key TEXT PRIMARY KEY, model TEXT, ws_id BLOB, sim BLOB, '
+                        'size INTEGER, last_used REAL)')
+            Con.execute('CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)')
+            Con.execute("INSERT OR IGNORE INTO stats VALUES ('hits', 0), ('misses', 0), ('evictions', 0)")
+
+    @contextlib.contextmanager
+    def _Connect(self):
+        Con = sqlite3.connect(self.PathDB, timeout=60)
+        try:
+            Con.execute('PRAGMA journal_mode=WAL')
+            with Con:
+                yield Con
+        finally:
+            Con.close()
+
+    def Key(self, NameModel, args, Table):
+        # La versión de InVEST también cambia el resultado
+        Parts = [NameModel, None if natcap is None else natcap.invest.__version__]
+        for Name in sorted(args):
+            if Name in self.IgnoreArgs:
+                continue
+            Value = args[Name]
+            # Los archivos y carpetas de entrada se identifican por su contenido
+            if isinstance(Value, str) and os.path.exists(Value):
+                Value = Hash_Path(Value)
+            Parts.append((Name, repr(Value)))
+        Parts.append(Table.to_csv(index=False))
+        return hashlib.sha1(repr(Parts).encode('utf-8')).hexdigest()
+
+    def Get(self, Key):
+        with self._Connect() as Con:
+            Row = Con.execute('SELECT ws_id, sim FROM evals WHERE key = ?', (Key,)).fetchone()
+            self.LastHit = Row is not None
+            if Row is None:
+                Con.execute("UPDATE stats SET value = value + 1 WHERE name = 'misses'")
+                return None
+            Con.execute('UPDATE evals SET last_used = ? WHERE key = ?', (time.time(), Key))
+            Con.execute("UPDATE stats SET value = value + 1 WHERE name = 'hits'")
+        return pickle.loads(Row[0]), pickle.loads(Row[1])
+
+    def Put(self, Key, NameModel, ws_id, Sim):
+        ws_id   = pickle.dumps(np.asarray(ws_id))
+        Sim     = pickle.dumps(np.asarray(Sim))
+        with self._Connect() as Con:
+            Con.execute('INSERT OR REPLACE INTO evals VALUES (?, ?, ?, ?, ?, ?)',
+                        (Key, NameModel, ws_id, Sim, len(ws_id) + len(Sim), time.time()))
+            Total = Con.execute('SELECT COALESCE(SUM(size), 0) FROM evals').fetchone()[0]
+            if Total > self.MaxBytes:
+                # Elimina las entradas menos usadas hasta quedar en el 90 % del límite
+                Excess  = Total - int(0.9*self.MaxBytes)
+                Keys    = []
+                for KeyOld, Size in Con.execute('SELECT key, size FROM evals ORDER BY last_used'):
+                    if Excess <= 0:
+                        break
+                    Keys.append((KeyOld,))
+                    Excess -= Size
+                Con.executemany('DELETE FROM evals WHERE key = ?', Keys)
+                Con.execute("UPDATE stats SET value = value + ? WHERE name = 'evictions'", (len(Keys),))
+
+    def Stats(self):
+        with self._Connect() as Con:
+            Stats = dict(Con.execute('SELECT name, value FROM stats').fetchall())
+            Stats['entries'], Stats['bytes'] = Con.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM evals').fetchone()
+        return Stats
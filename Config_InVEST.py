@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------------
+# Nature For Water Facility - The Nature Conservancy
+# -------------------------------------------------------------------------
+# InVEST - Version 3.15.1 (update July 2025)
+# -------------------------------------------------------------------------
+#                            DESCRIPTION
+# -------------------------------------------------------------------------
+# Lectura única del libro de configuración del proyecto (Main_InVEST.xlsx).
+# -------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Package
+# ----------------------------------------------------------------------------------------------------------------------
+import os
+import types
+import pickle
+import pandas as pd
+from Cache_InVEST import Hash_File
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Campos del libro de configuración
+# ----------------------------------------------------------------------------------------------------------------------
+# Nombre en UserData <- fila de la hoja UserData (columna Value)
+UserDataRows = {'Pixel'     : 'Pixel',
+                'Suffix'    : 'Name',
+                'BioTable'  : 'BioTable',
+                'RainTable' : 'RainTable',
+                'LULC'      : 'LULC',
+                'DEM'       : 'DEM',
+                'R'         : 'R',
+                'K'         : 'K',
+                'SoilDepth' : 'SoilDepth',
+                'ETP'       : 'ETP',
+                'ETP_Path'  : 'ETP_M',
+                'P'         : 'P',
+                'P_Path'    : 'P_M',
+                'PAWC'      : 'PAWC',
+                'SoilGroup' : 'HSG',
+                'Stream'    : 'Stream',
+                'Basin'     : 'Basin',
+                'SubBasin'  : 'SubBasin',
+                'Threshold' : 'Threshold_Flow'}
+
+# Modelos de la fila Run de la hoja UserData
+Models = ['AWY', 'SWY', 'SDR', 'NDR_N', 'NDR_P']
+
+# Nombre en Params <- fila de la hoja Params
+ParamsRows = {'Z'               : 'Z',
+              'Factor-Kc'       : 'Factor-Kc',
+              'Factor-Kc_m'     : 'Factor-Kc_m',
+              'Gamma'           : 'Gamma',
+              'Beta'            : 'Beta',
+              'Alpha'           : 'Alpha',
+              'Factor-C'        : 'Factor-C',
+              'Factor-P'        : 'Factor-P',
+              'IC0'             : 'Borselli-IC0',
+              'L_max'           : 'L_max',
+              'sdr_max'         : 'sdr_max',
+              'Factor_Load_N'   : 'Factor_Load_N',
+              'Factor_Eff_N'    : 'Factor_Eff_N',
+              'SubCri_Len_N'    : 'SubCri_Len_N',
+              'Sub_Eff_N'       : 'Sub_Eff_N',
+              'Factor_Load_P'   : 'Factor_Load_P',
+              'Factor_Eff_P'    : 'Factor_Eff_P',
+              'Borselli-K_SDR'  : 'Borselli-K_SDR',
+              'Borselli-K_NDR'  : 'Borselli-K_NDR'}
+
+# Hojas que se leen del libro (LULC_Batch es opcional)
+Sheets = ['UserData', 'Params', 'Obs_Data', 'LULC_Batch']
+
+# Se incrementa si cambia la forma de leer las hojas para invalidar las cachés en disco
+ConfigVersion = 1
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Configuración del proyecto
+# ----------------------------------------------------------------------------------------------------------------------
+class ProjectConfig(object):
+    """
+    Configuración del proyecto leída del libro de Excel: UserData, Params, ParamsMin, ParamsMax, Obs_Data y
+    LULC_Batch (None si el libro no tiene esa hoja). Path es la ruta del libro y Hash el sha1 de su contenido.
+
+    Es de solo lectura: los diccionarios son vistas inmutables (usar dict(Config.UserData) para obtener una copia
+    modificable) y las tablas se entregan como copias.
+    """
+    def __init__(self, Path, Hash, Tables):
+        Errors = _Validate(Tables)
+        if Errors:
+            raise ValueError('Invalid configuration file ' + Path + ':\n  ' + '\n  '.join(Errors))
+
+        UserData    = _Index(Tables['UserData'])
+        UserData.loc['Run', Models] = [_Run(UserData, Model) for Model in Models]
+        Params      = _Index(Tables['Params'])
+
+        Data = {Name: UserData.loc[Row, 'Value'] for Name, Row in UserDataRows.items()}
+        for Model in Models:
+            Data['Status_' + Model] = UserData.loc['Run', Model]
+
+        Fields = {'Path'        : Path,
+                  'Hash'        : Hash,
+                  'UserData'    : types.MappingProxyType(Data),
+                  'Params'      : types.MappingProxyType({Name: Params.loc[Row, 'Value'] for Name, Row in ParamsRows.items()}),
+                  'ParamsMin'   : types.MappingProxyType({Name: Params.loc[Row, 'Min'] for Name, Row in ParamsRows.items()}),
+                  'ParamsMax'   : types.MappingProxyType({Name: Params.loc[Row, 'Max'] for Name, Row in ParamsRows.items()}),
+                  '_Inputs'     : UserData,
+                  '_Obs_Data'   : Tables['Obs_Data'],
+                  '_LULC_Batch' : Tables.get('LULC_Batch')}
+        for Name, Value in Fields.items():
+            object.__setattr__(self, Name, Value)
+
+    def __setattr__(self, Name, Value):
+        raise AttributeError('ProjectConfig is read-only')
+
+    @property
+    def Inputs(self):
+        # Hoja UserData con Acronym como índice
+        return self._Inputs.copy()
+
+    @property
+    def Obs_Data(self):
+        return self._Obs_Data.copy()
+
+    @property
+    def LULC_Batch(self):
+        return None if self._LULC_Batch is None else self._LULC_Batch.copy()
+
+def _Index(Table):
+    # La primera columna de la hoja es el índice (como index_col=0 en pd.read_excel)
+    return Table.set_index(Table.columns[0])
+
+def _Run(UserData, Model):
+    # Celda Run del modelo (vacía = 0: el modelo no se ejecuta)
+    Value = UserData.loc['Run', Model]
+    return 0 if pd.isna(Value) else Value
+
+def _Validate(Tables):
+    # Lista de problemas del libro (vacía si es válido)
+    Errors = []
+    for Sheet in ['UserData', 'Params', 'Obs_Data']:
+        if Sheet not in Tables:
+            Errors.append('missing sheet ' + Sheet)
+    if Errors:
+        return Errors
+
+    UserData = _Index(Tables['UserData'])
+    if 'Value' not in UserData:
+        Errors.append('UserData: missing column Value')
+    else:
+        for Row in ['Run'] + list(UserDataRows.values()):
+            if Row not in UserData.index:
+                Errors.append('UserData: missing row ' + Row)
+        for Model in Models:
+            if Model not in UserData:
+                Errors.append('UserData: missing column ' + Model)
+            elif 'Run' in UserData.index and _Run(UserData, Model) not in (0, 1):
+                Errors.append('UserData: Run of %s must be 0, 1 or empty' % Model)
+
+    # Los valores sólo se revisan para los modelos activos (columna Model de la hoja Params: AWY, SWY, SDR, NDR)
+    Active = set()
+    if not Errors:
+        Active = {Model.split('_')[0] for Model in Models if _Run(UserData, Model) == 1}
+
+    Params = _Index(Tables['Params'])
+    if not {'Min', 'Max', 'Value'}.issubset(Params.columns):
+        Errors.append('Params: missing columns Min/Max/Value')
+    else:
+        for Row in ParamsRows.values():
+            if Row not in Params.index:
+                Errors.append('Params: missing row ' + Row)
+                continue
+            if 'Model' in Params and Params.loc[Row, 'Model'] not in Active:
+                continue
+            Values = pd.to_numeric(Params.loc[Row, ['Min', 'Max', 'Value']], errors='coerce')
+            if Values.isna().any():
+                Errors.append('Params: non-numeric Min/Max/Value for ' + Row)
+            elif Values['Min'] > Values['Max']:
+                Errors.append('Params: Min > Max for ' + Row)
+
+    if 'ws_id' not in Tables['Obs_Data']:
+        Errors.append('Obs_Data: missing column ws_id')
+
+    if 'LULC_Batch' in Tables and 'Name LULC' not in Tables['LULC_Batch']:
+        Errors.append('LULC_Batch: missing column Name LULC')
+
+    return Errors
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Lectura con caché
+# ----------------------------------------------------------------------------------------------------------------------
+_ConfigMemo = {}
+
+def Load_Config(InVEST_Main_Path, ProjectPath=None):
+    """
+    Retorna el ProjectConfig del libro. El libro se abre una sola vez y las hojas leídas se guardan en
+    <ProjectPath>/TMP/Config_<libro>.pkl; la caché se reutiliza mientras el tamaño y la fecha de modificación del
+    libro no cambien, o si cambian pero el contenido (sha1) es el mismo. Si InVEST_Main_Path ya es un
+    ProjectConfig se retorna tal cual.
+    """
+    if isinstance(InVEST_Main_Path, ProjectConfig):
+        return InVEST_Main_Path
+
+    Path    = os.path.abspath(InVEST_Main_Path)
+    Stat    = os.stat(Path)
+    Key     = (Path, Stat.st_size, Stat.st_mtime_ns)
+    if Key in _ConfigMemo:
+        return _ConfigMemo[Key]
+
+    PathCache = None
+    if ProjectPath is not None:
+        PathCache = os.path.join(ProjectPath, 'TMP', 'Config_' + os.path.splitext(os.path.basename(Path))[0] + '.pkl')
+
+    Cache = None
+    if PathCache is not None and os.path.isfile(PathCache):
+        try:
+            with open(PathCache, 'rb') as ID_File:
+                Cache = pickle.load(ID_File)
+        except Exception:
+            Cache = None
+        if Cache is not None and Cache.get('Version') != ConfigVersion:
+            Cache = None
+
+    if Cache is not None and Cache['Stat'] == Key[1:]:
+        Hash, Tables = Cache['Hash'], Cache['Tables']
+    else:
+        Hash = Hash_File(Path)
+        if Cache is not None and Cache['Hash'] == Hash:
+            Tables = Cache['Tables']
+        else:
+            with pd.ExcelFile(Path) as Book:
+                Tables = {Sheet: Book.parse(Sheet) for Sheet in Sheets if Sheet in Book.sheet_names}
+
+        if PathCache is not None:
+            os.makedirs(os.path.dirname(PathCache), exist_ok=True)
+            PathTmp = PathCache + '.%d.tmp' % os.getpid()
+            with open(PathTmp, 'wb') as ID_File:
+                pickle.dump({'Version': ConfigVersion, 'Stat': Key[1:], 'Hash': Hash, 'Tables': Tables}, ID_File)
+            os.replace(PathTmp, PathCache)
+
+    Config = ProjectConfig(Path, Hash, Tables)
+    _ConfigMemo[Key] = Config
+    return Config
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------------
+# Nature For Water Facility - The Nature Conservancy
+# -------------------------------------------------------------------------
+# InVEST - Version 3.15.1 (update July 2025)
+# -------------------------------------------------------------------------
+#                            DESCRIPTION
+# -------------------------------------------------------------------------
+# Criterios de parada de la calibración (sin mejora, mejora mínima, métrica
+# objetivo y tiempo máximo), comunes a DDS, SCE-UA y LHS.
+# -------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Package
+# ----------------------------------------------------------------------------------------------------------------------
+import time
+import numpy as np
+
+class Stop_Calibration(Exception):
+    # Se cumplió un criterio de parada. La lanza objectivefunction en el proceso principal de spotpy
+    pass
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Criterios de parada
+# ----------------------------------------------------------------------------------------------------------------------
+class Convergence(object):
+    """
+    Revisa después de cada evaluación el error de la función objetivo (menor es mejor):
+        Patience        : número de evaluaciones seguidas sin mejora (None: sin límite)
+        MinImprovement  : mejora relativa mínima respecto al mejor error para contar como mejora (0.01 = 1 %)
+        TargetMetric    : error con el que la calibración ya es suficiente (None: sin objetivo)
+        MaxMinutes      : tiempo máximo de la calibración desde Start (None: sin límite)
+    Update retorna el motivo de la parada (None mientras no se cumpla ningún criterio). Las evaluaciones que se
+    reutilizan al reanudar también pasan por Update, por eso la paciencia se reconstruye igual que antes de la
+    interrupción; el tiempo se cuenta desde la reanudación.
+    """
+    def __init__(self, Patience=None, MinImprovement=0.0, TargetMetric=None, MaxMinutes=None):
+        self.Patience       = Patience
+        self.MinImprovement = MinImprovement or 0.0
+        self.TargetMetric   = TargetMetric
+        self.MaxMinutes     = MaxMinutes
+        self.Best           = np.inf
+        self.BestEval       = 0
+        self.Evaluations    = 0
+        self.StartTime      = time.time()
+
+    def Active(self):
+        return self.Patience is not None or self.TargetMetric is not None or self.MaxMinutes is not None
+
+    def Start(self):
+        self.StartTime = time.time()
+
+    def Update(self, Error):
+        self.Evaluations += 1
+        if np.isfinite(Error) and (not np.isfinite(self.Best) or
+                                   Error < self.Best - self.MinImprovement*abs(self.Best)):
+            self.Best       = Error
+            self.BestEval   = self.Evaluations
+
+        if self.TargetMetric is not None and self.Best <= self.TargetMetric:
+            return 'target metric reached (%g <= %g)' % (self.Best, self.TargetMetric)
+        if self.Patience is not None and self.Evaluations - self.BestEval >= self.Patience:
+            return 'no improvement above %g %% in %d evaluations (best %g at evaluation %d)' % \
+                   (100*self.MinImprovement, self.Patience, self.Best, self.BestEval)
+        if self.MaxMinutes is not None and time.time() - self.StartTime >= 60*self.MaxMinutes:
+            return 'time budget of %g min reached' % self.MaxMinutes
+        return None
+
+    def State(self):
+        # Resumen para el punto de control y el almacén de resultados
+        return {'evaluations': self.Evaluations, 'best': float(self.Best) if np.isfinite(self.Best) else None,
+                'best_evaluation': self.BestEval, 'minutes': (time.time() - self.StartTime)/60}
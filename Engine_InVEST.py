@@ -0,0 +1,1081 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------------
+# Nature For Water Facility - The Nature Conservancy
+# -------------------------------------------------------------------------
+# InVEST - Version 3.15.1 (update July 2025)
+# -------------------------------------------------------------------------
+#                            DESCRIPTION
+# -------------------------------------------------------------------------
+# Motores nativos (NumPy) que reproducen los modelos InVEST durante la
+# calibración sin ejecutar el flujo completo de natcap.invest.
+# -------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Package
+# ----------------------------------------------------------------------------------------------------------------------
+import os
+import json
+from array import array
+import shutil
+import hashlib
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import rasterio
+import rasterio.features
+import pygeoprocessing
+import pygeoprocessing.routing
+from Cache_InVEST import Hash_File, Routing_Cache, Zonal_Index
+from natcap.invest.seasonal_water_yield import seasonal_water_yield as swy
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Annual Water Yield (AWY)
+# ----------------------------------------------------------------------------------------------------------------------
+class AWY_Engine(object):
+    """
+    Motor Budyko por píxel equivalente a natcap.invest.annual_water_yield. Los rásteres de precipitación, ETo, PAWC,
+    profundidad de raíces y LULC se alinean (igual que awy.execute) y se leen una sola vez. Evaluate recibe un lote de
+    candidatos (Z, Kc por clase de LULC), recorre los píxeles por bloques y retorna wyield_vol por cuenca de
+    Basin_Cal_AWY, en el orden de los registros del shapefile.
+    Limitación: cada píxel se asigna a una sola cuenca; con cuencas traslapadas se lanza ValueError.
+    """
+    def __init__(self, args, WorkPath, BlockSize=2**20):
+        self.BlockSize  = BlockSize
+        EnginePath      = os.path.join(WorkPath, 'TMP', 'AWY_ENGINE')
+        os.makedirs(EnginePath, exist_ok=True)
+
+        # ---------------------------------------------------------------------
+        # Alineación de rásteres (misma configuración que awy.execute)
+        # ---------------------------------------------------------------------
+        Names       = ['eto', 'precip', 'depth_root', 'pawc', 'lulc']
+        BasePath    = [args['eto_path'], args['precipitation_path'], args['depth_to_root_rest_layer_path'],
+                       args['pawc_path'], args['lulc_path']]
+        AlignPath   = [os.path.join(EnginePath, Name + '.tif') for Name in Names]
+        pygeoprocessing.align_and_resize_raster_stack(
+            BasePath, AlignPath, ['near'] * len(BasePath),
+            pygeoprocessing.get_raster_info(args['lulc_path'])['pixel_size'], 'intersection',
+            raster_align_index=4, base_vector_path_list=[args['watersheds_path']])
+
+        Data, NoData = {}, {}
+        for Name, PathRaster in zip(Names, AlignPath):
+            with rasterio.open(PathRaster) as src:
+                Data[Name]      = src.read(1)
+                NoData[Name]    = src.nodatavals[0]
+                Shape           = src.shape
+
+        # ---------------------------------------------------------------------
+        # Tabla biofísica base: clases, raíces y vegetación
+        # ---------------------------------------------------------------------
+        Table           = pd.read_csv(args['biophysical_table_path'], encoding='latin-1')
+        Table.columns   = Table.columns.str.lower()
+        self.LuCodes    = Table['lucode'].values.astype('int64')
+        Veg             = Table['lulc_veg'].values.astype('float32')
+        if not np.isin(Veg, [0, 1]).all():
+            raise ValueError('LULC_veg value must be either 1 or 0')
+        Root            = np.where(Veg == 1, Table['root_depth'].values, 1).astype('float32')
+
+        # ---------------------------------------------------------------------
+        # Cuencas: un rótulo por registro del shapefile (mismo orden que el csv de awy)
+        # ---------------------------------------------------------------------
+        Polygons        = gpd.read_file(args['watersheds_path'], engine='pyogrio')
+        self.ws_id      = Polygons['ws_id'].values
+        self.Area       = Polygons.geometry.area.values
+        # awy.execute suma los píxeles compartidos en cada cuenca; el motor no (ValueError con cuencas traslapadas)
+        with rasterio.open(AlignPath[-1]) as src:
+            Label = Zonal_Index(args['watersheds_path'], src).Label_Raster(Shape[0]*Shape[1], 'AWY')
+        Label = Label.reshape(Shape) + 1
+
+        # ---------------------------------------------------------------------
+        # Píxeles válidos (mismas condiciones de nodata que fractp_op)
+        # ---------------------------------------------------------------------
+        Valid = (Label > 0) & ~np.isclose(Data['precip'], 0)
+        for Name in ['eto', 'precip', 'depth_root', 'pawc', 'lulc']:
+            if NoData[Name] is not None:
+                Valid &= ~np.isclose(Data[Name], NoData[Name], equal_nan=True)
+
+        Lulc    = Data['lulc'][Valid].astype('int64')
+        Missing = np.setdiff1d(np.unique(Lulc), self.LuCodes)
+        if Missing.size > 0:
+            raise ValueError('Values in the LULC raster were found that are not represented under the '
+                             "'lucode' column of the Biophysical table: %s" % Missing.tolist())
+
+        Order           = np.argsort(self.LuCodes)
+        self.Class      = Order[np.searchsorted(self.LuCodes[Order], Lulc)]
+        self.Label      = Label[Valid] - 1
+        self.Eto        = Data['eto'][Valid].astype('float32')
+        self.Precip     = Data['precip'][Valid].astype('float32')
+        self.Veg        = Veg[self.Class]
+        # Agua disponible para las plantas: min(raíz, suelo) * PAWC
+        self.Awc        = np.minimum(Root[self.Class], Data['depth_root'][Valid].astype('float32')) * \
+                          Data['pawc'][Valid].astype('float32')
+        self.Count      = np.bincount(self.Label, minlength=len(self.ws_id))
+
+    def Kc_Vector(self, Table):
+        """Kc de una tabla biofísica (ya afectada por Factor_BioTable) en el orden de LuCodes"""
+        Kc = Table.set_index(Table['lucode'].astype('int64'))['Kc']
+        return Kc.loc[self.LuCodes].values.astype('float32')
+
+    def Evaluate(self, Z, Kc):
+        """
+        Z  : (n,)          constante de estacionalidad de cada candidato
+        Kc : (n, nclases)  Kc por clase de LULC de cada candidato
+        Retorna (n, ncuencas) con wyield_vol [m3]
+        """
+        Z       = np.asarray(Z, dtype='float32').reshape(-1, 1)
+        Kc      = np.asarray(Kc, dtype='float32').reshape(len(Z), -1)
+        nCand   = len(Z)
+        nWs     = len(self.ws_id)
+        Sum     = np.zeros(nCand*nWs)
+        Offset  = (np.arange(nCand)*nWs).reshape(-1, 1)
+
+        Step = max(1, self.BlockSize // nCand)
+        for i in range(0, len(self.Label), Step):
+            Block   = slice(i, i + Step)
+            P       = self.Precip[Block]
+            Pet     = Kc[:, self.Class[Block]] * self.Eto[Block]
+            Phi     = Pet / P
+            # Parámetro w de Budyko, limitado a 5
+            W       = np.minimum((self.Awc[Block] / P) * Z + 1.25, 5)
+            Aet_P   = (1 + Phi) - (1 + Phi**W)**(1/W)
+            VegRes  = np.where(Phi < Aet_P, Phi, Aet_P)
+            NonVeg  = np.minimum(Pet, P) / P
+            Fractp  = np.where(self.Veg[Block] == 1, VegRes, NonVeg)
+            Wyield  = (1 - Fractp) * P
+            Sum    += np.bincount((self.Label[Block] + Offset).ravel(), weights=Wyield.ravel(),
+                                  minlength=nCand*nWs)
+
+        Sum     = Sum.reshape(nCand, nWs)
+        Vol     = np.full((nCand, nWs), np.nan)
+        Has     = self.Count > 0
+        # wyield_vol = wyield_mn * área / 1000 (mm a m)
+        Vol[:, Has] = Sum[:, Has] / self.Count[Has] * self.Area[Has] / 1000
+        return Vol
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Seasonal Water Yield (SWY)
+# ----------------------------------------------------------------------------------------------------------------------
+class SWY_Engine(object):
+    """
+    Motor incremental equivalente a natcap.invest.seasonal_water_yield (MFD) para la calibración. Entre candidatos
+    sólo cambian alpha_m, beta_i, gamma y los Kc mensuales, así que la alineación, el ruteo, el número de curva, el
+    flujo rápido mensual (QF) y la precipitación y ETo alineadas no cambian. La preparación ejecuta swy.execute una
+    sola vez y guarda esas pilas mensuales de los píxeles ruteados.
+
+    Evaluate reproduce calculate_local_recharge (swy.h): cada píxel se calcula cuando todos sus vecinos aguas arriba
+    tienen L_sum_avail, por lo que el resultado no depende del orden del recorrido. Los píxeles se agrupan por
+    niveles de dependencia y cada nivel se calcula vectorizado para todos los candidatos a la vez. La calibración
+    sólo usa aet, así que no se calculan L_sum ni el flujo base (route_baseflow_sum). Retorna la media de aet por
+    ws_id como calculate_zonal_stats.
+
+    La preparación se guarda en TMP/SWY_ENGINE/<hash de las entradas> y se lee como memmap.
+    Limitación: cada píxel se asigna a una sola cuenca; con cuencas traslapadas se lanza ValueError.
+    """
+    # Se incrementa si cambia la preparación para invalidar las carpetas de TMP/SWY_ENGINE
+    Version = 2
+
+    def __init__(self, ProjectPath, args, BlockSize=2**22):
+        self.BlockSize  = BlockSize
+        EnginePath      = os.path.join(ProjectPath, 'TMP', 'SWY_ENGINE', SWY_Engine.Key(args))
+        if not os.path.isfile(os.path.join(EnginePath, 'Engine.json')):
+            _Publish(EnginePath, lambda TmpPath: SWY_Engine._Build(ProjectPath, args, TmpPath))
+
+        with open(os.path.join(EnginePath, 'Engine.json')) as ID_File:
+            Meta = json.load(ID_File)
+        self.ws_id      = np.array(Meta['ws_id'])
+        self.LuCodes    = np.array(Meta['LuCodes'], dtype='int64')
+        for Name in ['Label', 'Class', 'P', 'QF', 'ET0', 'PI', 'QI', 'Levels', 'First', 'Den', 'EdSrc', 'EdProp']:
+            setattr(self, Name, np.load(os.path.join(EnginePath, Name + '.npy'), mmap_mode='r'))
+
+    @staticmethod
+    def Key(args):
+        """Carpeta del motor: hash del contenido de las entradas que no se calibran"""
+        Parts = [SWY_Engine.Version, args['flow_dir_algorithm'], args['threshold_flow_accumulation']]
+        for Name in ['dem_raster_path', 'lulc_raster_path', 'soil_group_path', 'rain_events_table_path',
+                     'biophysical_table_path']:
+            Parts.append(Hash_File(args[Name]))
+        for Name in ['precip_dir', 'et0_dir']:
+            for File in sorted(os.listdir(args[Name])):
+                Parts.append((File, Hash_File(os.path.join(args[Name], File))))
+        for Name in ['aoi_path', 'watersheds_path']:
+            for Ext in ['.shp', '.dbf']:
+                Parts.append(Hash_File(os.path.splitext(args[Name])[0] + Ext))
+        return hashlib.sha1(repr(Parts).encode('utf-8')).hexdigest()[:16]
+
+    @staticmethod
+    def _Build(ProjectPath, args, EnginePath):
+        if args['flow_dir_algorithm'] != 'MFD':
+            raise ValueError('SWY_Engine only supports flow_dir_algorithm = MFD')
+
+        # ---------------------------------------------------------------------
+        # Una ejecución de swy.execute: alineación, ruteo, CN, Si y QF mensual (desde TMP/ROUTING si ya existe)
+        # ---------------------------------------------------------------------
+        RunPath = os.path.join(EnginePath, 'RUN')
+        argsRun = dict(args, workspace_dir=RunPath, results_suffix='')
+        with Routing_Cache(ProjectPath, args):
+            swy.execute(argsRun)
+
+        def Path(Name):
+            return os.path.join(RunPath, 'intermediate_outputs', Name + '.tif')
+
+        # ---------------------------------------------------------------------
+        # Clases de LULC (-1 en nodata: kc en nodata) y cuencas de Basin_Cal_SWY
+        # ---------------------------------------------------------------------
+        Lulc, ValidLulc, _  = _Read_Raster(Path('lulc_aligned'))
+        LuCodes             = np.unique(Lulc[ValidLulc]).astype('int64')
+        Class               = np.full(Lulc.size, -1, dtype='int32')
+        Class[ValidLulc.ravel()] = np.searchsorted(LuCodes, Lulc[ValidLulc].astype('int64'))
+        with rasterio.open(Path('lulc_aligned')) as src:
+            Index = Zonal_Index(args['watersheds_path'], src)
+        Label               = Index.Label_Raster(Lulc.size, 'SWY')
+
+        # ---------------------------------------------------------------------
+        # Grafo de los píxeles de las cuencas y de todo lo que drena hacia ellos, y niveles de dependencia
+        # ---------------------------------------------------------------------
+        FlowDir, ValidDir, _ = _Read_Raster(Path('flow_dir'))
+        Code    = np.where(ValidDir, FlowDir, 0).astype('int64')
+        Node, Levels, First, Den, EdSrc, EdProp = _Upslope_Levels(Code, ValidDir, Label >= 0)
+
+        # ---------------------------------------------------------------------
+        # Pilas mensuales invariantes: P y QF (0 en nodata) y ETo (NaN en nodata: pet = 0)
+        # ---------------------------------------------------------------------
+        Stacks = {'P': [], 'QF': [], 'ET0': []}
+        for m in range(12):
+            for Name, PathName, Fill in [('P', 'prcp_a%d' % m, 0), ('QF', 'qf_%d' % (m + 1), 0),
+                                         ('ET0', 'et0_a%d' % m, np.nan)]:
+                Data, Valid, _ = _Read_Raster(Path(PathName))
+                Data = Data.ravel()[Node]
+                Stacks[Name].append(np.where(Valid.ravel()[Node], Data,
+                                             Fill).astype(np.result_type(Data.dtype, 'float32')))
+        Vectors = {Name: np.vstack(Stack) for Name, Stack in Stacks.items()}
+        Vectors['PI'] = Vectors['P'].astype('float64').sum(axis=0)
+        Vectors['QI'] = Vectors['QF'].astype('float64').sum(axis=0)
+
+        Vectors.update({'Label'     : Label[Node],
+                        'Class'     : Class[Node],
+                        'Levels'    : Levels,
+                        'First'     : First,
+                        'Den'       : Den,
+                        'EdSrc'     : EdSrc,
+                        'EdProp'    : EdProp})
+        for Name, Vector in Vectors.items():
+            np.save(os.path.join(EnginePath, Name + '.npy'), Vector)
+
+        Meta = {'ws_id'     : Index.ws_id.tolist(),
+                'LuCodes'   : LuCodes.tolist()}
+        with open(os.path.join(EnginePath, 'Engine.json'), 'w') as ID_File:
+            json.dump(Meta, ID_File)
+
+        shutil.rmtree(RunPath, ignore_errors=True)
+
+    def Kc_Matrix(self, Table):
+        """Kc_1..Kc_12 de una tabla biofísica (ya afectada por Factor_BioTable), (nclases, 12) en el orden de LuCodes"""
+        Table   = Table.set_index(Table['lucode'].astype('int64'))
+        Table.columns = Table.columns.str.lower()
+        Missing = np.setdiff1d(self.LuCodes, Table.index.values)
+        if Missing.size > 0:
+            raise ValueError('Values in the LULC raster were found that are not represented under the '
+                             "'lucode' column of the Biophysical table: %s" % Missing.tolist())
+        return Table.loc[self.LuCodes, ['kc_%d' % (m + 1) for m in range(12)]].values.astype('float32')
+
+    def Evaluate(self, Alpha, Beta, Gamma, Kc):
+        """
+        Alpha, Beta, Gamma  : (n,)              alpha_m, beta_i y gamma de cada candidato
+        Kc                  : (n, nclases, 12)  Kc mensual por clase de LULC
+        Retorna (n, ncuencas) con la media de aet por ws_id
+        """
+        nCand   = len(np.atleast_1d(Alpha))
+        nWs     = len(self.ws_id)
+        # alpha*beta en float32 como en swy.h; la columna extra de Kc es el nodata de LULC (pet = 0)
+        AB      = (np.atleast_1d(np.asarray(Alpha, dtype='float32')) * np.asarray(Beta, dtype='float32')).astype('float64')
+        Gamma   = np.atleast_1d(np.asarray(Gamma, dtype='float32')).astype('float64')
+        Kc      = np.asarray(Kc, dtype='float32').reshape(nCand, len(self.LuCodes), 12)
+        Kc      = np.concatenate((Kc, np.full((nCand, 1, 12), np.nan, dtype='float32')), axis=1).transpose(0, 2, 1)
+
+        Sum     = np.zeros((nCand, nWs))
+        Count   = np.zeros((nCand, nWs))
+        nNode   = len(self.Label)
+        # Candidatos por lote: L_sum_avail y L_avail de todos los píxeles ruteados (float32, como los rásteres)
+        Chunk   = max(1, self.BlockSize // max(nNode, 1))
+        for j in range(0, nCand, Chunk):
+            Cand    = slice(j, j + Chunk)
+            n       = len(AB[Cand])
+            LSA     = np.zeros((n, nNode), dtype='float32')
+            LA      = np.zeros((n, nNode), dtype='float32')
+            Offset  = (np.arange(n)*nWs).reshape(-1, 1)
+            for i in range(len(self.Levels) - 1):
+                Nd      = slice(self.Levels[i, 0], self.Levels[i + 1, 0])
+                Ed      = slice(self.Levels[i, 1], self.Levels[i + 1, 1])
+                # Ecuaciones 7-8: L_sum_avail de los vecinos aguas arriba
+                if i == 0:
+                    Up = np.zeros((n, Nd.stop - Nd.start))
+                else:
+                    Src = self.EdSrc[Ed]
+                    Up  = np.add.reduceat((LSA[:, Src].astype('float64') + LA[:, Src]) * self.EdProp[Ed],
+                                          self.First[Nd] - self.Levels[i, 1], axis=1) / self.Den[Nd]
+                # Ecuaciones 4-6: aet mensual = min(pet, P - QF + alpha*beta*L_sum_avail)
+                Pet     = Kc[Cand][:, :, self.Class[Nd]].astype('float64') * self.ET0[:, Nd]
+                Pet     = np.where(np.isnan(Pet), 0, Pet)
+                Avail   = self.P[:, Nd].astype('float64') - self.QF[:, Nd]
+                Aet     = np.minimum(Pet, Avail + AB[Cand, None, None] * Up[:, None, :]).sum(axis=1)
+                L       = self.PI[Nd] - self.QI[Nd] - Aet
+                LSA[:, Nd]  = Up
+                LA[:, Nd]   = np.minimum(Gamma[Cand, None] * L, L)
+
+                # Media por cuenca de aet (ráster float32)
+                Label   = self.Label[Nd]
+                In      = Label >= 0
+                if In.any():
+                    Aet     = Aet[:, In].astype('float32')
+                    Valid   = ~np.isnan(Aet)
+                    Index   = (Label[In] + Offset).ravel()
+                    Sum[Cand]   += np.bincount(Index, weights=np.where(Valid, Aet, 0).ravel(),
+                                               minlength=n*nWs).reshape(n, nWs)
+                    Count[Cand] += np.bincount(Index, weights=Valid.ravel(), minlength=n*nWs).reshape(n, nWs)
+
+        # Como calculate_zonal_stats: cuencas sin píxeles válidos quedan en NaN
+        with np.errstate(invalid='ignore'):
+            return np.where(Count > 0, Sum / Count, np.nan)
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Sediment Delivery Ratio (SDR)
+# ----------------------------------------------------------------------------------------------------------------------
+class SDR_Engine(object):
+    """
+    Motor incremental equivalente a natcap.invest.sdr (MFD, sin drainage_path) para la calibración. Entre candidatos
+    sólo cambian sdr_max, k, IC0, L_max y los valores C y P de la tabla biofísica, por lo que la alineación, el ruteo,
+    el factor LS (sin el límite L_max), R*K y S_bar se calculan una sola vez.
+
+    El único término ruteado que depende de C es W (C de la clase de LULC, mínimo 0.001), que entra en W_bar y en
+    d_dn. La acumulación y la distancia al cauce MFD son lineales en el peso, así que cada clase con Status_Cal_C = 1
+    se rutea por separado con su indicador como peso y las demás clases en conjunto con su W fijo:
+        W_bar = sum_c W_c * A_c / FA        d_dn = sum_c D_c / W_c
+    Los vectores de los píxeles de las cuencas se guardan en TMP/SDR_ENGINE/<hash de las entradas> y se leen como
+    memmap, de modo que los procesos en paralelo comparten la misma preparación. Evaluate retorna sed_export por
+    cuenca de Basin_Cal_SDR, en el orden de los registros del shapefile.
+    Limitación: cada píxel se asigna a una sola cuenca; con cuencas traslapadas se lanza ValueError.
+    """
+    # Se incrementa si cambia la preparación para invalidar las carpetas de TMP/SDR_ENGINE
+    Version = 2
+
+    def __init__(self, ProjectPath, args, BlockSize=2**18):
+        self.BlockSize  = BlockSize
+        EnginePath      = os.path.join(ProjectPath, 'TMP', 'SDR_ENGINE', SDR_Engine.Key(args))
+        if not os.path.isfile(os.path.join(EnginePath, 'Engine.json')):
+            _Publish(EnginePath, lambda TmpPath: SDR_Engine._Build(ProjectPath, args, TmpPath))
+
+        with open(os.path.join(EnginePath, 'Engine.json')) as ID_File:
+            Meta = json.load(ID_File)
+        self.ws_id      = np.array(Meta['ws_id'])
+        self.LuCodes    = np.array(Meta['LuCodes'], dtype='int64')
+        # Clases con base propia (índices en LuCodes); si Fixed, la última base agrupa las clases fijas
+        self.Basis      = np.array(Meta['Basis'], dtype='int64')
+        self.Fixed      = Meta['Fixed']
+        self.HaPerPx    = Meta['HaPerPx']
+        for Name in ['Label', 'Class', 'RK', 'L', 'S', 'Up', 'WA', 'D']:
+            setattr(self, Name, np.load(os.path.join(EnginePath, Name + '.npy'), mmap_mode='r'))
+
+    @staticmethod
+    def Key(args):
+        """Carpeta del motor: hash del contenido de las entradas que no se calibran"""
+        Parts = [SDR_Engine.Version, args['flow_dir_algorithm'], args['threshold_flow_accumulation']]
+        for Name in ['dem_path', 'lulc_path', 'erosivity_path', 'erodibility_path', 'biophysical_table_path']:
+            Parts.append(Hash_File(args[Name]))
+        for Ext in ['.shp', '.dbf']:
+            Parts.append(Hash_File(os.path.splitext(args['watersheds_path'])[0] + Ext))
+        return hashlib.sha1(repr(Parts).encode('utf-8')).hexdigest()[:16]
+
+    @staticmethod
+    def _Build(ProjectPath, args, EnginePath):
+        RasterPath = os.path.join(EnginePath, 'RASTERS')
+        os.makedirs(RasterPath, exist_ok=True)
+
+        def Path(Name):
+            return os.path.join(RasterPath, Name + '.tif')
+
+        # ---------------------------------------------------------------------
+        # Alineación y máscara común (misma configuración que sdr.execute)
+        # ---------------------------------------------------------------------
+        Names       = ['dem', 'lulc', 'erosivity', 'erodibility']
+        AlignPath   = [Path('aligned_' + Name) for Name in Names]
+        DemInfo     = pygeoprocessing.get_raster_info(args['dem_path'])
+        PixelSize   = np.min(np.abs(DemInfo['pixel_size']))
+        pygeoprocessing.align_and_resize_raster_stack(
+            [args[Name + '_path'] for Name in Names], AlignPath, ['bilinear', 'mode', 'bilinear', 'bilinear'],
+            (PixelSize, -PixelSize), 'intersection', target_projection_wkt=DemInfo['projection_wkt'],
+            base_vector_path_list=(args['watersheds_path'],), raster_align_index=0,
+            vector_mask_options={'mask_vector_path': args['watersheds_path']})
+        pygeoprocessing.raster_map(op=_Mutual_Mask_Op, rasters=AlignPath, target_path=Path('mask'), target_nodata=0)
+        pygeoprocessing.raster_map(op=_Mask_Op, rasters=[AlignPath[0], Path('mask')], target_path=Path('masked_dem'))
+
+        # ---------------------------------------------------------------------
+        # Ruteo (desde TMP/ROUTING si sdr.execute ya lo calculó) y S_bar
+        # ---------------------------------------------------------------------
+        with Routing_Cache(ProjectPath, args):
+            pygeoprocessing.routing.fill_pits((Path('masked_dem'), 1), Path('filled_dem'))
+            pygeoprocessing.calculate_slope((Path('filled_dem'), 1), Path('slope'))
+            pygeoprocessing.routing.flow_dir_mfd((Path('filled_dem'), 1), Path('flow_dir'))
+            pygeoprocessing.routing.flow_accumulation_mfd((Path('flow_dir'), 1), Path('flow_acc'))
+            pygeoprocessing.routing.extract_streams_mfd(
+                (Path('flow_acc'), 1), (Path('flow_dir'), 1), float(args['threshold_flow_accumulation']),
+                Path('stream'), trace_threshold_proportion=0.7)
+        pygeoprocessing.raster_map(op=_Threshold_Slope_Op, rasters=[Path('slope')], target_path=Path('slope_thr'))
+        pygeoprocessing.routing.flow_accumulation_mfd(
+            (Path('flow_dir'), 1), Path('s_acc'), weight_raster_path_band=(Path('slope_thr'), 1))
+
+        Data, Valid = {}, {}
+        for Name in ['mask', 'aligned_lulc', 'aligned_erosivity', 'aligned_erodibility', 'slope', 'slope_thr',
+                     'flow_acc', 's_acc', 'stream']:
+            Data[Name], Valid[Name], Profile = _Read_Raster(Path(Name))
+
+        # ---------------------------------------------------------------------
+        # Clases de LULC y bases de ruteo de W
+        # ---------------------------------------------------------------------
+        Table   = pd.read_csv(args['biophysical_table_path'], encoding='latin-1')
+        LuCodes = Table['lucode'].values.astype('int64')
+        # W fijo de las clases que no se calibran (como _calculate_w)
+        WFixed  = np.maximum(Table['usle_c'].values.astype('float32'), np.float32(0.001))
+        Cal     = Table['Status_Cal_C'].values == 1
+
+        Lulc    = Data['aligned_lulc'][Valid['mask']].astype('int64')
+        Missing = np.setdiff1d(np.unique(Lulc), LuCodes)
+        if Missing.size > 0:
+            raise ValueError('Values in the LULC raster were found that are not represented under the '
+                             "'lucode' column of the Biophysical table: %s" % Missing.tolist())
+        Order   = np.argsort(LuCodes)
+        Class   = np.full(Data['mask'].shape, -1, dtype='int32')
+        Class[Valid['mask']] = Order[np.searchsorted(LuCodes[Order], Lulc)]
+
+        Present = np.unique(Class[Valid['mask']])
+        Basis   = [int(c) for c in Present if Cal[c]]
+        Groups  = [([c], np.float32(1)) for c in Basis]
+        Fixed   = bool((~Cal[Present]).any())
+        if Fixed:
+            Groups.append((Present[~Cal[Present]], WFixed))
+
+        SlopeThr    = Data['slope_thr']
+        ValidD      = Valid['mask'] & Valid['slope_thr']
+        Profile.update(dtype='float32', nodata=-1)
+        WA, D       = [], []
+        for i, (Members, Scale) in enumerate(Groups):
+            Group = Valid['mask'] & np.isin(Class, Members)
+            Scale = np.broadcast_to(Scale, (len(LuCodes),))[Class]
+            # Peso de la acumulación: indicador de la clase (W para las clases fijas), como thresholded_w
+            Weight = np.where(Group, Scale, 0).astype('float32')
+            Weight[~Valid['mask']] = -1
+            _Write_Raster(Path('w_%d' % i), Weight, Profile)
+            # Peso de d_dn: indicador / S (1/(W*S) para las clases fijas), como ws_inverse
+            Weight = np.where(Group & ValidD, 1 / (Scale * np.where(ValidD, SlopeThr, 1)), 0).astype('float32')
+            Weight[~ValidD] = -1
+            _Write_Raster(Path('w_dn_%d' % i), Weight, Profile)
+
+            pygeoprocessing.routing.flow_accumulation_mfd(
+                (Path('flow_dir'), 1), Path('w_acc_%d' % i), weight_raster_path_band=(Path('w_%d' % i), 1))
+            pygeoprocessing.routing.distance_to_channel_mfd(
+                (Path('flow_dir'), 1), (Path('stream'), 1), Path('d_dn_%d' % i),
+                weight_raster_path_band=(Path('w_dn_%d' % i), 1))
+            WA.append(_Read_Raster(Path('w_acc_%d' % i))[:2])
+            D.append(_Read_Raster(Path('d_dn_%d' % i))[:2])
+
+        # ---------------------------------------------------------------------
+        # Cuencas: un rótulo por registro del shapefile (mismo orden que el dbf de sdr)
+        # ---------------------------------------------------------------------
+        with rasterio.open(Path('mask')) as src:
+            Index = Zonal_Index(args['watersheds_path'], src)
+        ws_id   = Index.ws_id
+        Label   = Index.Label_Raster(Data['mask'].size, 'SDR').reshape(Data['mask'].shape) + 1
+
+        # ---------------------------------------------------------------------
+        # Píxeles que aportan a sed_export: USLE válido (fuera del cauce) y d_dn definido
+        # ---------------------------------------------------------------------
+        Sel = (Label > 0) & Valid['mask'] & Valid['slope'] & Valid['slope_thr'] & Valid['flow_acc'] & \
+              Valid['s_acc'] & Valid['stream'] & (Data['stream'] == 0)
+        for (_, ValidWA), (_, ValidD) in zip(WA, D):
+            Sel &= ValidWA & ValidD
+
+        FA          = Data['flow_acc'][Sel].astype('float64')
+        CellSize    = abs(Profile['transform'].a)
+        L, S        = _LS_Factors(Data['slope'][Sel], FA, CellSize)
+        Vectors     = {'Label'  : (Label[Sel] - 1).astype('int32'),
+                       'Class'  : Class[Sel],
+                       'RK'     : Data['aligned_erosivity'][Sel].astype('float64') *
+                                  Data['aligned_erodibility'][Sel].astype('float64'),
+                       'L'      : L,
+                       'S'      : S.astype('float64'),
+                       # d_up = W_bar * S_bar * sqrt(FA * área de la celda)
+                       'Up'     : Data['s_acc'][Sel] / FA * np.sqrt(FA * CellSize**2),
+                       'WA'     : np.array([Acc[Sel] / FA for Acc, _ in WA]).reshape(len(WA), Sel.sum()),
+                       'D'      : np.array([Dist[Sel] for Dist, _ in D], dtype='float64').reshape(len(D), Sel.sum())}
+        for Name, Vector in Vectors.items():
+            np.save(os.path.join(EnginePath, Name + '.npy'), Vector)
+
+        Meta = {'ws_id'     : ws_id.tolist(),
+                'LuCodes'   : LuCodes.tolist(),
+                'Basis'     : Basis,
+                'Fixed'     : Fixed,
+                'HaPerPx'   : CellSize**2 / 10000}
+        with open(os.path.join(EnginePath, 'Engine.json'), 'w') as ID_File:
+            json.dump(Meta, ID_File)
+
+        shutil.rmtree(RasterPath, ignore_errors=True)
+
+    def CP_Vectors(self, Table):
+        """C y P de una tabla biofísica (ya afectada por Factor_BioTable) en el orden de LuCodes"""
+        Table = Table.set_index(Table['lucode'].astype('int64'))
+        return Table.loc[self.LuCodes, 'usle_c'].values, Table.loc[self.LuCodes, 'usle_p'].values
+
+    def Evaluate(self, SdrMax, K, IC0, LMax, C, P):
+        """
+        SdrMax, K, IC0, LMax : (n,)          parámetros de sdr.execute de cada candidato
+        C, P                 : (n, nclases)  usle_c y usle_p por clase de LULC de cada candidato
+        Retorna (n, ncuencas) con sed_export [t/año]
+        """
+        SdrMax, K, IC0, LMax = [np.asarray(Value, dtype='float64').reshape(-1, 1) for Value in [SdrMax, K, IC0, LMax]]
+        nCand   = len(SdrMax)
+        nWs     = len(self.ws_id)
+        C       = np.asarray(C, dtype='float32').reshape(nCand, -1)
+        P       = np.asarray(P, dtype='float32').reshape(nCand, -1)
+        Sum     = np.zeros(nCand*nWs)
+        Offset  = (np.arange(nCand)*nWs).reshape(-1, 1)
+
+        # C*P por clase y W de cada base (la base de clases fijas ya incluye su W)
+        CP      = C * P
+        W       = np.maximum(C[:, self.Basis], np.float32(0.001)).astype('float64')
+        if self.Fixed:
+            W   = np.column_stack((W, np.ones(nCand)))
+
+        Step = max(1, self.BlockSize // nCand)
+        for i in range(0, len(self.Label), Step):
+            Block   = slice(i, i + Step)
+            LS      = np.minimum(self.L[Block], LMax) * self.S[Block]
+            Usle    = (LS * self.RK[Block]).astype('float32') * CP[:, self.Class[Block]]
+            DUp     = (W @ self.WA[:, Block]) * self.Up[Block]
+            DDn     = (1 / W) @ self.D[:, Block]
+            Valid   = (DUp != 0) & (DDn != 0)
+            with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+                IC      = np.log10(DUp / DDn)
+                Sdr     = SdrMax / (1 + np.exp((IC0 - IC) / K))
+            Export  = np.where(Valid, Usle * Sdr, 0)
+            Sum    += np.bincount((self.Label[Block] + Offset).ravel(), weights=Export.ravel(),
+                                  minlength=nCand*nWs)
+
+        # Suma por cuenca en t/(ha año) por píxel -> t/año
+        return Sum.reshape(nCand, nWs) * self.HaPerPx
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Nutrient Delivery Ratio (NDR)
+# ----------------------------------------------------------------------------------------------------------------------
+class NDR_Engine(object):
+    """
+    Motor incremental equivalente a natcap.invest.ndr (MFD) para la calibración de nitrógeno y fósforo. La
+    alineación, la máscara de cuencas, el ruteo, el índice de escorrentía, IC (y su IC0) y la distancia al cauce no
+    dependen de las cargas, eficiencias, k ni de los parámetros subsuperficiales, así que se calculan una sola vez.
+
+    La retención efectiva (effective_retention.h) sí depende de eff y crit_len, y su resultado depende del orden en
+    que ndr recorre los píxeles. Al preparar el motor se reproduce ese recorrido (semillas por bloque y pila LIFO) y
+    cada cálculo de un píxel se guarda como un evento que lee los eventos vecinos vigentes en ese momento. Los
+    eventos se agrupan por niveles de dependencia y Evaluate los recorre nivel por nivel, vectorizado y para todos
+    los candidatos a la vez. Luego calcula carga, NDR y exportación (n_total_export o p_surface_export) y suma por
+    ws_id como calculate_zonal_stats.
+
+    La preparación se guarda en TMP/NDR_ENGINE/<hash de las entradas>, no depende del nutriente y se lee como
+    memmap: si Basin_Cal_NDR_N y Basin_Cal_NDR_P tienen el mismo contenido, N y P usan la misma carpeta.
+    Limitación: cada píxel se asigna a una sola cuenca; con cuencas traslapadas se lanza ValueError.
+    """
+    # Se incrementa si cambia la preparación para invalidar las carpetas de TMP/NDR_ENGINE
+    Version = 2
+
+    def __init__(self, ProjectPath, args, BlockSize=2**22):
+        self.BlockSize  = BlockSize
+        EnginePath      = os.path.join(ProjectPath, 'TMP', 'NDR_ENGINE', NDR_Engine.Key(args))
+        if not os.path.isfile(os.path.join(EnginePath, 'Engine.json')):
+            _Publish(EnginePath, lambda TmpPath: NDR_Engine._Build(ProjectPath, args, TmpPath))
+
+        with open(os.path.join(EnginePath, 'Engine.json')) as ID_File:
+            Meta = json.load(ID_File)
+        self.ws_id      = np.array(Meta['ws_id'])
+        self.LuCodes    = np.array(Meta['LuCodes'], dtype='int64')
+        self.IC0        = Meta['IC0']
+        self.CellSize   = Meta['CellSize']
+        for Name in ['Label', 'Class', 'Event', 'RPI', 'IC', 'Dist', 'Levels', 'EvKind', 'EvDen', 'EvFirst',
+                     'EdRead', 'EdProp', 'EdClass', 'EdDiag']:
+            setattr(self, Name, np.load(os.path.join(EnginePath, Name + '.npy'), mmap_mode='r'))
+
+    @staticmethod
+    def Key(args):
+        """Carpeta del motor: hash del contenido de las entradas que no se calibran"""
+        Parts = [NDR_Engine.Version, args['flow_dir_algorithm'], args['threshold_flow_accumulation']]
+        for Name in ['dem_path', 'lulc_path', 'runoff_proxy_path']:
+            Parts.append(Hash_File(args[Name]))
+        for Ext in ['.shp', '.dbf']:
+            Parts.append(Hash_File(os.path.splitext(args['watersheds_path'])[0] + Ext))
+        return hashlib.sha1(repr(Parts).encode('utf-8')).hexdigest()[:16]
+
+    @staticmethod
+    def _Build(ProjectPath, args, EnginePath):
+        RasterPath = os.path.join(EnginePath, 'RASTERS')
+        os.makedirs(RasterPath, exist_ok=True)
+
+        def Path(Name):
+            return os.path.join(RasterPath, Name + '.tif')
+
+        # ---------------------------------------------------------------------
+        # Alineación y máscara de cuencas (misma configuración que ndr.execute)
+        # ---------------------------------------------------------------------
+        Names       = ['dem', 'lulc', 'runoff_proxy']
+        AlignPath   = [Path('aligned_' + Name) for Name in Names]
+        DemInfo     = pygeoprocessing.get_raster_info(args['dem_path'])
+        pygeoprocessing.align_and_resize_raster_stack(
+            [args[Name + '_path'] for Name in Names], AlignPath, ['near']*len(Names), DemInfo['pixel_size'],
+            'intersection', base_vector_path_list=[args['watersheds_path']], raster_align_index=0)
+
+        Data, Valid = {}, {}
+        for Name, PathName in zip(Names, AlignPath):
+            Data[Name], Valid[Name], Profile = _Read_Raster(PathName)
+        Polygons    = gpd.read_file(args['watersheds_path'], engine='pyogrio')
+        if Polygons.crs != Profile['crs']:
+            Polygons = Polygons.to_crs(Profile['crs'])
+        Mask        = rasterio.features.rasterize(((Geom, 1) for Geom in Polygons.geometry),
+                                                  out_shape=Data['dem'].shape, transform=Profile['transform'],
+                                                  fill=0, dtype='uint8') == 1
+        for Name in Names:
+            Valid[Name] &= Mask
+
+        # DEM enmascarado (como _mask_raster: se conserva el nodata del DEM)
+        NoData  = Profile['nodata'] if Profile['nodata'] is not None else float(np.finfo('float32').min)
+        Dem     = np.where(Valid['dem'], Data['dem'], NoData).astype('float32')
+        _Write_Raster(Path('masked_dem'), Dem, dict(Profile, dtype='float32', nodata=NoData))
+
+        # ---------------------------------------------------------------------
+        # Ruteo (desde TMP/ROUTING si ndr.execute ya lo calculó)
+        # ---------------------------------------------------------------------
+        with Routing_Cache(ProjectPath, args):
+            pygeoprocessing.routing.fill_pits((Path('masked_dem'), 1), Path('filled_dem'))
+            pygeoprocessing.calculate_slope((Path('filled_dem'), 1), Path('slope'))
+            pygeoprocessing.routing.flow_dir_mfd((Path('filled_dem'), 1), Path('flow_dir'))
+            pygeoprocessing.routing.flow_accumulation_mfd((Path('flow_dir'), 1), Path('flow_acc'))
+            pygeoprocessing.routing.extract_streams_mfd(
+                (Path('flow_acc'), 1), (Path('flow_dir'), 1), float(args['threshold_flow_accumulation']),
+                Path('stream'))
+        pygeoprocessing.raster_map(op=_Threshold_Slope_Op, rasters=[Path('slope')], target_path=Path('slope_thr'))
+        pygeoprocessing.raster_map(op=_Inverse_Op, rasters=[Path('slope_thr')], target_path=Path('s_inv'),
+                                   target_nodata=-1)
+        pygeoprocessing.routing.flow_accumulation_mfd(
+            (Path('flow_dir'), 1), Path('s_acc'), weight_raster_path_band=(Path('slope_thr'), 1))
+        pygeoprocessing.routing.distance_to_channel_mfd(
+            (Path('flow_dir'), 1), (Path('stream'), 1), Path('d_dn'), weight_raster_path_band=(Path('s_inv'), 1))
+        pygeoprocessing.routing.distance_to_channel_mfd(
+            (Path('flow_dir'), 1), (Path('stream'), 1), Path('dist'))
+        for Name in ['flow_dir', 'flow_acc', 's_acc', 'stream', 'd_dn', 'dist']:
+            Data[Name], Valid[Name], _ = _Read_Raster(Path(Name))
+        with rasterio.open(Path('flow_dir')) as src:
+            BlockShape = src.block_shapes[0]
+
+        # ---------------------------------------------------------------------
+        # Índice de escorrentía, d_up, IC e IC0 (rásteres float32 de ndr)
+        # ---------------------------------------------------------------------
+        CellSize    = abs(Profile['transform'].a)
+        CellArea    = abs(Profile['transform'].a * Profile['transform'].e)
+        Runoff      = Data['runoff_proxy'][Valid['runoff_proxy']].astype('float64')
+        Mean        = Runoff.sum() / Runoff.size if Runoff.size > 0 else 0
+        RPI         = (Data['runoff_proxy'] / (Mean if Mean != 0 else 1)).astype('float32')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            SBar    = (Data['s_acc'] / Data['flow_acc']).astype('float32')
+            DUp     = (SBar * np.sqrt(Data['flow_acc'] * CellArea)).astype('float32')
+            ValidIC = Valid['s_acc'] & Valid['flow_acc'] & Valid['d_dn'] & (DUp != 0) & (Data['d_dn'] != 0)
+            IC      = np.log10(DUp / Data['d_dn']).astype('float32')
+        IC0 = (float(IC[ValidIC].min()) + float(IC[ValidIC].max())) / 2 if ValidIC.any() else 0.0
+
+        # ---------------------------------------------------------------------
+        # Clases de LULC presentes en la máscara
+        # ---------------------------------------------------------------------
+        Lulc                = Data['lulc'].astype('int64')
+        LuCodes             = np.unique(Lulc[Valid['lulc']])
+        Class               = np.full(Lulc.shape, -1, dtype='int32')
+        Class[Valid['lulc']] = np.searchsorted(LuCodes, Lulc[Valid['lulc']])
+
+        # ---------------------------------------------------------------------
+        # Eventos de la retención efectiva: 1 cauce (retención 0), 2 sin eff/crit_len (nodata), 0 el resto
+        # ---------------------------------------------------------------------
+        Kind    = np.where(Valid['stream'] & (Data['stream'] == 1), 1,
+                           np.where(Valid['lulc'] & Valid['stream'], 0, 2)).astype('int8')
+        Code    = np.where(Valid['flow_dir'], Data['flow_dir'], 0).astype('int64')
+        Events  = _Retention_Events(Code.ravel(), Kind.ravel(), Data['flow_dir'].shape, BlockShape)
+        EvNode, EvLevel, EvFirst, EdRead, EdProp, EdDiag, Last = Events
+
+        # Eventos ordenados por nivel (estable) y aristas agrupadas por evento en el mismo orden
+        nEv     = len(EvNode)
+        Order   = np.argsort(EvLevel, kind='stable')
+        Pos     = np.empty(nEv, dtype='int64')
+        Pos[Order] = np.arange(nEv)
+        Count   = np.diff(np.append(EvFirst, len(EdRead)))[Order]
+        First   = np.concatenate(([0], np.cumsum(Count)[:-1])).astype('int64')
+        Edges   = np.repeat(EvFirst[Order] - First, Count) + np.arange(Count.sum(), dtype='int64')
+        # Inicio de cada nivel en los eventos y en las aristas
+        Start   = np.searchsorted(EvLevel[Order], np.arange(EvLevel.max(initial=0) + 2))
+        Levels  = np.column_stack((Start, np.append(First, Count.sum())[Start]))
+        EvClass = Class.ravel()[EvNode[Order]]
+        EdRead  = EdRead[Edges]
+        # Lecturas de otro evento -> su posición; vecino sin calcular o fuera del ráster -> columna nEv (-1)
+        EdRead  = np.where(EdRead >= 0, Pos[np.maximum(EdRead, 0)], nEv)
+        EdDiag  = EdDiag[Edges]
+        EdDen   = EdProp[Edges].astype('float64')
+        # Fuera del ráster: cuenta en la suma de proporciones pero no aporta retención
+        EdProp  = np.where(EdDiag < 2, EdDen, 0)
+        EvDen   = np.bincount(np.repeat(np.arange(nEv), Count), weights=EdDen, minlength=nEv)
+
+        # ---------------------------------------------------------------------
+        # Píxeles que aportan a la exportación: cuenca, carga e IC válidos (la retención se valida en Evaluate)
+        # ---------------------------------------------------------------------
+        with rasterio.open(AlignPath[1]) as src:
+            Index = Zonal_Index(args['watersheds_path'], src)
+        Label   = Index.Label_Raster(Lulc.size, 'NDR')
+        Sel     = (Label >= 0) & (Valid['lulc'] & Valid['runoff_proxy'] & ValidIC).ravel()
+        Final   = np.where(Last >= 0, Pos[np.maximum(Last, 0)], nEv)
+        Vectors = {'Label'  : Label[Sel],
+                   'Class'  : Class.ravel()[Sel],
+                   'Event'  : Final[Sel],
+                   'RPI'    : RPI.ravel()[Sel],
+                   'IC'     : IC.ravel()[Sel],
+                   'Dist'   : np.where(Valid['dist'], Data['dist'], np.nan).astype('float64').ravel()[Sel],
+                   'Levels' : Levels.astype('int64'),
+                   'EvKind' : Kind.ravel()[EvNode[Order]],
+                   'EvDen'  : EvDen,
+                   'EvFirst': First,
+                   'EdRead' : EdRead.astype('int64'),
+                   'EdProp' : EdProp,
+                   'EdClass': np.repeat(EvClass, Count).astype('int32'),
+                   'EdDiag' : (EdDiag == 1).astype('int8')}
+        for Name, Vector in Vectors.items():
+            np.save(os.path.join(EnginePath, Name + '.npy'), Vector)
+
+        Meta = {'ws_id'     : Index.ws_id.tolist(),
+                'LuCodes'   : LuCodes.tolist(),
+                'IC0'       : IC0,
+                'CellSize'  : CellSize}
+        with open(os.path.join(EnginePath, 'Engine.json'), 'w') as ID_File:
+            json.dump(Meta, ID_File)
+
+        shutil.rmtree(RasterPath, ignore_errors=True)
+
+    def Vectors(self, Table, Nutrient):
+        """
+        load, eff, crit_len y proportion_subsurface_n (None para P) de una tabla biofísica (ya afectada por
+        Factor_BioTable) en el orden de LuCodes
+        """
+        Table   = Table.set_index(Table['lucode'].astype('int64'))
+        Missing = np.setdiff1d(self.LuCodes, Table.index.values)
+        if Missing.size > 0:
+            raise KeyError('lucode: %d is present in the landuse raster but missing from the biophysical table' %
+                           Missing[0])
+        Table   = Table.loc[self.LuCodes]
+        Prop    = Table['proportion_subsurface_n'].values if Nutrient == 'n' else None
+        return (Table['load_' + Nutrient].values, Table['eff_' + Nutrient].values,
+                Table['crit_len_' + Nutrient].values, Prop)
+
+    def Retention(self, Eff, CritLen):
+        """
+        Retención efectiva de cada evento para un lote de candidatos (Eff, CritLen: (n, nclases)).
+        Retorna (n, neventos + 1) en float32; la última columna es el nodata (-1) de los vecinos sin calcular.
+        """
+        Eff     = np.asarray(Eff, dtype='float32').astype('float64')
+        Crit    = np.asarray(CritLen, dtype='float32').astype('float64')[:, :, None]
+        Step    = np.array([self.CellSize, self.CellSize * 1.41421356237])
+        with np.errstate(divide='ignore'):
+            Factor = np.where(Crit > 0, np.exp(-5 * Step / np.where(Crit > 0, Crit, 1)), 0)
+
+        Value   = np.full((len(Eff), len(self.EvKind) + 1), -1, dtype='float32')
+        Value[:, np.flatnonzero(self.EvKind == 1)] = 0
+        for i in range(1, len(self.Levels) - 1):
+            Ev      = slice(self.Levels[i, 0], self.Levels[i + 1, 0])
+            Ed      = slice(self.Levels[i, 1], self.Levels[i + 1, 1])
+            EffE    = Eff[:, self.EdClass[Ed]]
+            Fac     = Factor[:, self.EdClass[Ed], self.EdDiag[Ed]]
+            Near    = Value[:, self.EdRead[Ed]].astype('float64')
+            # Vecino en el cauce, retención local mayor que la del vecino o se conserva la del vecino
+            Inter   = np.where(Near == 0, EffE * (1 - Fac),
+                               np.where(EffE > Near, Near * Fac + EffE * (1 - Fac), Near))
+            Sum     = np.add.reduceat(Inter * self.EdProp[Ed], self.EvFirst[Ev] - self.Levels[i, 1], axis=1)
+            Value[:, Ev] = Sum / self.EvDen[Ev]
+        return Value
+
+    def Evaluate(self, K, Load, Eff, CritLen, Prop=None, SubEff=None, SubCritLen=None):
+        """
+        K                       : (n,)          k_param de cada candidato
+        Load, Eff, CritLen      : (n, nclases)  load, eff y crit_len del nutriente por clase de LULC
+        Prop, SubEff, SubCritLen: (n, nclases), (n,), (n,) parte subsuperficial (sólo N; None para P)
+        Retorna (n, ncuencas) con la suma por ws_id de n_total_export (N) o p_surface_export (P)
+        """
+        K       = np.asarray(K, dtype='float32').reshape(-1, 1)
+        nCand   = len(K)
+        nWs     = len(self.ws_id)
+        Load, Eff, CritLen = [np.asarray(Value).reshape(nCand, -1) for Value in [Load, Eff, CritLen]]
+        Load    = Load.astype('float32')
+        if Prop is not None:
+            Prop        = np.asarray(Prop, dtype='float64').reshape(nCand, -1)
+            SubEff      = np.asarray(SubEff, dtype='float64').reshape(-1, 1)
+            SubCritLen  = np.asarray(SubCritLen, dtype='float64').reshape(-1, 1)
+
+        Sum     = np.zeros((nCand, nWs))
+        Count   = np.zeros((nCand, nWs))
+        # Candidatos por lote de retención y píxeles por bloque
+        Chunk   = max(1, self.BlockSize // (len(self.EvKind) + 1))
+        for j in range(0, nCand, Chunk):
+            Cand    = slice(j, j + Chunk)
+            n       = len(K[Cand])
+            Value   = self.Retention(Eff[Cand], CritLen[Cand])
+            Offset  = (np.arange(n)*nWs).reshape(-1, 1)
+            Step    = max(1, self.BlockSize // n)
+            for i in range(0, len(self.Label), Step):
+                Block   = slice(i, i + Step)
+                Class   = self.Class[Block]
+                Ret     = Value[:, self.Event[Block]]
+                Load_M  = Load[Cand][:, Class] * self.RPI[Block]
+                with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+                    Ndr     = (1 - Ret) / (1 + np.exp((self.IC0 - self.IC[Block]) / K[Cand]))
+                    Ndr[Ret == -1] = np.nan
+                    if Prop is None:
+                        Export  = Load_M * Ndr
+                    else:
+                        Surface = (Load_M * (1 - Prop[Cand][:, Class])).astype('float32')
+                        Sub     = (Load_M * Prop[Cand][:, Class]).astype('float32')
+                        SubNdr  = 1 - SubEff[Cand] * (1 - np.exp(-5 * self.Dist[Block] / SubCritLen[Cand]))
+                        Export  = Surface * Ndr + Sub * SubNdr
+                Valid   = ~np.isnan(Export)
+                Index   = (self.Label[Block] + Offset).ravel()
+                Sum[Cand]   += np.bincount(Index, weights=np.where(Valid, Export, 0).ravel(),
+                                           minlength=n*nWs).reshape(n, nWs)
+                Count[Cand] += np.bincount(Index, weights=Valid.ravel(), minlength=n*nWs).reshape(n, nWs)
+
+        # Como calculate_zonal_stats: cuencas sin píxeles válidos quedan en NaN
+        Sum[Count == 0] = np.nan
+        return Sum
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Funciones auxiliares de los motores
+# ----------------------------------------------------------------------------------------------------------------------
+def _Publish(EnginePath, Build):
+    # Prepara el motor en una carpeta temporal y la publica con un renombrado atómico (varios procesos pueden
+    # prepararlo a la vez; se conserva el primero que termina)
+    TmpPath = EnginePath + '.%d.tmp' % os.getpid()
+    shutil.rmtree(TmpPath, ignore_errors=True)
+    os.makedirs(TmpPath)
+    try:
+        Build(TmpPath)
+        os.replace(TmpPath, EnginePath)
+    except OSError:
+        if not os.path.isfile(os.path.join(EnginePath, 'Engine.json')):
+            raise
+    finally:
+        shutil.rmtree(TmpPath, ignore_errors=True)
+
+def _Read_Raster(PathRaster):
+    # Datos, máscara de píxeles válidos y perfil de un ráster de una banda
+    with rasterio.open(PathRaster) as src:
+        Data    = src.read(1)
+        NoData  = src.nodatavals[0]
+        Profile = src.profile
+    if NoData is None:
+        return Data, np.ones(Data.shape, dtype=bool), Profile
+    return Data, ~pygeoprocessing.array_equals_nodata(Data, NoData), Profile
+
+def _Write_Raster(PathRaster, Data, Profile):
+    with rasterio.open(PathRaster, 'w', **Profile) as dst:
+        dst.write(Data, 1)
+
+def _Mutual_Mask_Op(*Arrays):
+    # 1 donde todos los rásteres alineados tienen dato (raster_map deja nodata en el resto)
+    return 1
+
+def _Mask_Op(Array, Mask):
+    return Array
+
+def _Threshold_Slope_Op(Slope):
+    # Pendiente en m/m limitada a [0.005, 1] (Cavalli et al., 2013)
+    return np.clip(Slope / 100, 0.005, 1)
+
+def _LS_Factors(Slope, FA, CellSize):
+    """
+    Factores L (sin el límite L_max) y S de _calculate_ls_factor de sdr.py (Desmet & Govers, 1996), con la
+    pendiente en porcentaje y la acumulación de flujo en píxeles. LS = min(L, L_max) * S.
+    """
+    CellArea    = CellSize**2
+    Area        = np.sqrt((FA - 1) * CellArea)
+    Rad         = np.arctan(Slope / 100)
+    Aspect      = np.fabs(np.sin(Rad)) + np.fabs(np.cos(Rad))
+    S           = np.where(Slope < 9, 10.8*np.sin(Rad) + 0.03, 16.8*np.sin(Rad) - 0.5)
+    Beta        = (np.sin(Rad) / 0.0896) / (3*np.sin(Rad)**0.8 + 0.56)
+    # Exponente m por rangos de pendiente (Oliveira et al., 2013)
+    M           = np.array([0.2, 0.3, 0.4, 0.5])[np.digitize(np.minimum(Slope, 9), [1., 3.5, 5., 9.], right=True)]
+    M           = np.where(Slope > 9, Beta / (1 + Beta), M).astype('float32')
+    L           = ((Area + CellArea)**(M + 1) - Area**(M + 1)) / ((CellSize**(M + 2)) * (Aspect**M) * (22.13**M))
+    return L, S
+
+def _Inverse_Op(Value):
+    # 1/S de ndr (_inverse_op)
+    return np.where(Value == 0, 0, 1 / np.where(Value == 0, 1, Value))
+
+# Desplazamientos de las 8 direcciones de pygeoprocessing (0 = este, en sentido antihorario)
+_COL_OFFSETS = [1, 1, 0, -1, -1, -1, 0, 1]
+_ROW_OFFSETS = [0, -1, -1, -1, 0, 1, 1, 1]
+
+def _Retention_Events(Code, Kind, Shape, BlockShape):
+    """
+    Reproduce el recorrido de run_effective_retention (effective_retention.h de ndr 3.15.1): por cada bloque del
+    ráster de direcciones se siembran los píxeles que drenan fuera del ráster o a un píxel sin direcciones pendientes,
+    y luego se vacía la pila (LIFO) liberando los píxeles aguas arriba. Un píxel puede calcularse más de una vez y
+    puede leer un vecino todavía sin calcular (-1); cada cálculo es un evento que lee el último evento de cada vecino.
+
+    Code    : direcciones MFD (8 proporciones de 4 bits, 0 en nodata) de cada píxel, aplanado
+    Kind    : 0 se calcula, 1 cauce (0), 2 eff o crit_len en nodata (-1), aplanado
+    Retorna EvNode, EvLevel, EvFirst (primera arista de cada evento), EdRead (evento leído, -1 sin calcular y -2 fuera
+    del ráster), EdProp, EdDiag (0 ortogonal, 1 diagonal, 2 fuera del ráster) y Last (último evento de cada píxel)
+    """
+    nRows, nCols    = Shape
+    BlockRows, BlockCols = BlockShape
+    Code            = Code.tolist()
+    Kind            = Kind.tolist()
+    # Direcciones pendientes de cada píxel (bit i = drena en la dirección i)
+    Pending         = [sum(1 << i for i in range(8) if (Value >> (4*i)) & 0xF) for Value in Code]
+    Last            = [-1] * len(Code)
+    EvNode, EvLevel, EvFirst = array('q'), array('q'), array('q')
+    EdRead, EdProp, EdDiag   = array('q'), array('b'), array('b')
+    Stack           = []
+
+    for Row0 in range(0, nRows, BlockRows):
+        for Col0 in range(0, nCols, BlockCols):
+            # Semillas del bloque
+            for Row in range(Row0, min(Row0 + BlockRows, nRows)):
+                for Col in range(Col0, min(Col0 + BlockCols, nCols)):
+                    Pixel   = Row*nCols + Col
+                    Out     = Pending[Pixel]
+                    Seed    = False
+                    for i in range(8):
+                        if Out & (1 << i):
+                            ColN, RowN = Col + _COL_OFFSETS[i], Row + _ROW_OFFSETS[i]
+                            if not (0 <= ColN < nCols and 0 <= RowN < nRows) or Pending[RowN*nCols + ColN] == 0:
+                                Seed    = True
+                                Out     &= ~(1 << i)
+                    if Seed:
+                        Pending[Pixel] = Out
+                        Stack.append(Pixel)
+
+            # Cálculo de la pila
+            while Stack:
+                Pixel       = Stack.pop()
+                Row, Col    = divmod(Pixel, nCols)
+                Event       = len(EvNode)
+                Level       = 0
+                EvNode.append(Pixel)
+                EvFirst.append(len(EdRead))
+                if Kind[Pixel] == 0:
+                    for i in range(8):
+                        Prop = (Code[Pixel] >> (4*i)) & 0xF
+                        if not Prop:
+                            continue
+                        ColN, RowN = Col + _COL_OFFSETS[i], Row + _ROW_OFFSETS[i]
+                        EdProp.append(Prop)
+                        if 0 <= ColN < nCols and 0 <= RowN < nRows:
+                            Read = Last[RowN*nCols + ColN]
+                            EdRead.append(Read)
+                            EdDiag.append(i % 2)
+                            if Read >= 0 and EvLevel[Read] > Level:
+                                Level = EvLevel[Read]
+                        else:
+                            EdRead.append(-2)
+                            EdDiag.append(2)
+                    Level += 1
+                EvLevel.append(Level)
+                Last[Pixel] = Event
+
+                # Vecinos aguas arriba: se libera la dirección hacia este píxel
+                for i in range(8):
+                    ColN, RowN = Col + _COL_OFFSETS[i], Row + _ROW_OFFSETS[i]
+                    if not (0 <= ColN < nCols and 0 <= RowN < nRows):
+                        continue
+                    Neighbor    = RowN*nCols + ColN
+                    Inflow      = (i + 4) % 8
+                    if not (Code[Neighbor] >> (4*Inflow)) & 0xF or not Pending[Neighbor] & (1 << Inflow):
+                        continue
+                    Pending[Neighbor] &= ~(1 << Inflow)
+                    if Pending[Neighbor] == 0:
+                        Stack.append(Neighbor)
+
+    return (np.frombuffer(EvNode, dtype='int64'), np.frombuffer(EvLevel, dtype='int64'),
+            np.frombuffer(EvFirst, dtype='int64'), np.frombuffer(EdRead, dtype='int64'),
+            np.frombuffer(EdProp, dtype='int8'), np.frombuffer(EdDiag, dtype='int8'), np.array(Last, dtype='int64'))
+
+def _Upslope_Levels(Code, Valid, Target):
+    """
+    Niveles de dependencia del recorrido de calculate_local_recharge (swy.h): un píxel se calcula cuando todos sus
+    vecinos aguas arriba ya están calculados y las semillas son los píxeles con dirección sin flujo entrante. Sólo
+    se conservan los píxeles de Target y los que drenan hacia ellos (el valor de un píxel sólo depende de aguas
+    arriba, así que el resultado no cambia).
+
+    Code    : direcciones MFD (8 proporciones de 4 bits, 0 en nodata)
+    Valid   : píxeles con dirección de flujo (semillas posibles)
+    Target  : píxeles cuyo valor se necesita, aplanado
+    Retorna Node (píxel plano de cada nodo, ordenado por nivel), Levels (inicio de cada nivel en los nodos y en las
+    aristas), First (primera arista de cada nodo), Den (suma de proporciones entrantes), EdSrc (nodo aguas arriba)
+    y EdProp (proporción de 4 bits) de las aristas agrupadas por nodo de destino
+    """
+    nRows, nCols    = Code.shape
+    Code            = Code.ravel()
+    Rows, Cols      = np.divmod(np.arange(Code.size), nCols)
+    Src, Dst, Prop  = [], [], []
+    for i in range(8):
+        Flow    = (Code >> (4*i)) & 0xF
+        RowN    = Rows + _ROW_OFFSETS[i]
+        ColN    = Cols + _COL_OFFSETS[i]
+        Sel     = np.flatnonzero((Flow > 0) & (RowN >= 0) & (RowN < nRows) & (ColN >= 0) & (ColN < nCols))
+        Src.append(Sel)
+        Dst.append(RowN[Sel]*nCols + ColN[Sel])
+        Prop.append(Flow[Sel])
+    Src, Dst, Prop  = np.concatenate(Src), np.concatenate(Dst), np.concatenate(Prop)
+
+    # Píxeles de Target y todos los que drenan hacia ellos
+    Order       = np.argsort(Dst, kind='stable')
+    DstSorted   = Dst[Order]
+    Need        = np.asarray(Target, dtype=bool).ravel().copy()
+    Frontier    = np.flatnonzero(Need)
+    while Frontier.size > 0:
+        Start       = np.searchsorted(DstSorted, Frontier, side='left')
+        Count       = np.searchsorted(DstSorted, Frontier, side='right') - Start
+        Up          = Src[Order[np.repeat(Start - np.cumsum(Count) + Count, Count) + np.arange(Count.sum())]]
+        Frontier    = np.unique(Up[~Need[Up]])
+        Need[Frontier] = True
+    Keep            = Need[Dst]
+    Src, Dst, Prop  = Src[Keep], Dst[Keep], Prop[Keep]
+
+    # Kahn por niveles sobre las aristas ordenadas por origen
+    Order       = np.argsort(Src, kind='stable')
+    SrcSorted   = Src[Order]
+    Remaining   = np.bincount(Dst, minlength=Code.size)
+    Level       = np.full(Code.size, -1, dtype='int64')
+    Frontier    = np.flatnonzero(Need & Valid.ravel() & (Remaining == 0))
+    Number      = 0
+    while Frontier.size > 0:
+        Level[Frontier] = Number
+        Start       = np.searchsorted(SrcSorted, Frontier, side='left')
+        Count       = np.searchsorted(SrcSorted, Frontier, side='right') - Start
+        Edges       = Order[np.repeat(Start - np.cumsum(Count) + Count, Count) + np.arange(Count.sum())]
+        Down, Times = np.unique(Dst[Edges], return_counts=True)
+        Remaining[Down] -= Times
+        Frontier    = Down[Remaining[Down] == 0]
+        Number     += 1
+
+    # Nodos ordenados por nivel y aristas agrupadas por nodo de destino en el mismo orden
+    Node        = np.flatnonzero(Level >= 0)
+    Node        = Node[np.argsort(Level[Node], kind='stable')]
+    Pos         = np.full(Code.size, -1, dtype='int64')
+    Pos[Node]   = np.arange(len(Node))
+    Keep        = Pos[Dst] >= 0
+    Src, Dst, Prop = Src[Keep], Dst[Keep], Prop[Keep]
+    Order       = np.argsort(Pos[Dst], kind='stable')
+    EdSrc       = Pos[Src[Order]]
+    EdProp      = Prop[Order].astype('float64')
+    Count       = np.bincount(Pos[Dst], minlength=len(Node))
+    First       = np.concatenate(([0], np.cumsum(Count)[:-1])).astype('int64')
+    Den         = np.bincount(Pos[Dst], weights=Prop, minlength=len(Node))
+    Start       = np.searchsorted(Level[Node], np.arange(Number + 1))
+    Levels      = np.column_stack((Start, np.append(First, Count.sum())[Start])).astype('int64')
+    return Node, Levels, First, Den, EdSrc, EdProp
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------------
+# Nature For Water Facility - The Nature Conservancy
+# -------------------------------------------------------------------------
+# InVEST - Version 3.15.1 (update July 2025)
+# -------------------------------------------------------------------------
+#                            DESCRIPTION
+# -------------------------------------------------------------------------
+# Calibración multi-fidelidad: pirámides de entradas con píxeles más
+# grandes para explorar y fases de refinamiento en la resolución nativa.
+# -------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Package
+# ----------------------------------------------------------------------------------------------------------------------
+import os
+import json
+import shutil
+import rasterio
+import numpy as np
+from rasterio.enums import Resampling
+from rasterio.transform import Affine
+from rasterio.warp import reproject
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Pirámides de entradas
+# ----------------------------------------------------------------------------------------------------------------------
+def Pyramid_Path(ProjectPath, Factor):
+    return os.path.join(ProjectPath, 'TMP', 'FIDELITY', 'F%d' % Factor)
+
+def Coarse_UserData(UserData, Factor):
+    # Tamaño de píxel de la pirámide y umbral de acumulación en píxeles equivalente al nativo (misma área drenada)
+    UserData                = dict(UserData)
+    UserData['Pixel']       = UserData['Pixel'] * Factor
+    UserData['Threshold']   = max(1, round(UserData['Threshold'] / Factor**2))
+    return UserData
+
+def Build_Pyramid(ProjectPath, Factor, PathDEM, Rasters, Categorical=()):
+    """
+    Copia INPUTS del proyecto en TMP/FIDELITY/F<Factor>/INPUTS con los rásteres de Rasters remuestreados a un tamaño
+    de píxel Factor veces el del DEM, la grilla a la que InVEST alinea todas las entradas (moda para los de
+    Categorical, como LULC y grupo hidrológico; promedio para los demás).
+    Los rásteres que ya tienen un píxel igual o mayor se copian sin cambios. Los demás archivos (tablas, cuencas) se
+    copian tal cual en cada llamada; los rásteres remuestreados se reutilizan mientras no cambien los originales.
+    Retorna la carpeta de la pirámide, que se usa como ProjectPath de las evaluaciones.
+    """
+    with rasterio.open(PathDEM) as Src:
+        Pixel = min(abs(Src.transform.a), abs(Src.transform.e))
+    Source  = os.path.join(ProjectPath, 'INPUTS')
+    Target  = Pyramid_Path(ProjectPath, Factor)
+    Rasters = sorted(set(os.path.normpath(Path) for Path in Rasters if os.path.isfile(Path)))
+    Signature = {'factor': Factor, 'pixel': Pixel * Factor,
+                 'rasters': {os.path.relpath(Path, Source): [os.stat(Path).st_mtime, os.stat(Path).st_size]
+                             for Path in Rasters}}
+
+    PathSignature = os.path.join(Target, 'Pyramid.json')
+    Current = False
+    if os.path.isfile(PathSignature):
+        with open(PathSignature, 'r') as ID_File:
+            Current = json.load(ID_File) == Signature
+    if not Current:
+        shutil.rmtree(Target, ignore_errors=True)
+
+    # Tablas y cuencas al día (RunInVEST reescribe las tablas biofísicas de INPUTS)
+    shutil.copytree(Source, os.path.join(Target, 'INPUTS'), ignore=shutil.ignore_patterns('*.tif', '*.tiff'),
+                    dirs_exist_ok=True)
+    if Current:
+        return Target
+
+    print('Building input pyramid x%d (pixel %g) - %s' % (Factor, Pixel * Factor, Target))
+    for Path in Rasters:
+        Coarsen_Raster(Path, os.path.join(Target, 'INPUTS', os.path.relpath(Path, Source)), Pixel * Factor,
+                       Path in [os.path.normpath(Item) for Item in Categorical])
+    for Folder in ['OUTPUTS', 'TMP']:
+        os.makedirs(os.path.join(Target, Folder), exist_ok=True)
+
+    # La firma se escribe al final: una pirámide interrumpida se reconstruye
+    with open(PathSignature, 'w') as ID_File:
+        json.dump(Signature, ID_File)
+
+    return Target
+
+def Coarsen_Raster(PathSource, PathTarget, Pixel, Categorical=False):
+    # Remuestreo a una grilla de tamaño de píxel Pixel con la misma esquina superior izquierda
+    os.makedirs(os.path.dirname(PathTarget), exist_ok=True)
+    with rasterio.open(PathSource) as Src:
+        ResX, ResY = abs(Src.transform.a), abs(Src.transform.e)
+        if min(ResX, ResY) >= Pixel:
+            shutil.copyfile(PathSource, PathTarget)
+            return
+        Width       = max(1, int(np.ceil(Src.width * ResX / Pixel)))
+        Height      = max(1, int(np.ceil(Src.height * ResY / Pixel)))
+        Transform   = Affine(Pixel, 0, Src.transform.c, 0, -Pixel, Src.transform.f)
+        Profile     = Src.profile
+        Data        = Src.read()
+        Coarse      = np.full((Src.count, Height, Width), Src.nodata if Src.nodata is not None else 0,
+                              dtype=Data.dtype)
+        reproject(Data, Coarse, src_transform=Src.transform, src_crs=Src.crs, src_nodata=Src.nodata,
+                  dst_transform=Transform, dst_crs=Src.crs, dst_nodata=Src.nodata,
+                  resampling=Resampling.mode if Categorical else Resampling.average)
+
+    Profile.update(width=Width, height=Height, transform=Transform, tiled=True, blockxsize=256, blockysize=256)
+    with rasterio.open(PathTarget, 'w', **Profile) as Dst:
+        Dst.write(Coarse)
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Fases de la calibración
+# ----------------------------------------------------------------------------------------------------------------------
+def Fidelity_Phases(NumSim, Factors=None, CoarseShare=0.5, TopK=5):
+    """
+    Reparte NumSim evaluaciones entre las fases [(Factor, evaluaciones del optimizador), ...]: CoarseShare de
+    NumSim en partes iguales para los factores de Factors (de mayor a menor) y el resto en la resolución nativa
+    (Factor 1). Las fases después de la primera empiezan con la evaluación de los TopK mejores candidatos de la fase
+    anterior, que se descuentan de su presupuesto. Sin Factors hay una sola fase nativa con NumSim evaluaciones.
+    """
+    Factors = sorted(set(int(Factor) for Factor in (Factors or []) if int(Factor) > 1), reverse=True)
+    if not Factors:
+        return [(1, NumSim)]
+
+    Coarse  = int(round(NumSim * CoarseShare / len(Factors)))
+    Phases  = [(Factor, Coarse if i == 0 else Coarse - TopK) for i, Factor in enumerate(Factors)]
+    Phases.append((1, NumSim - Coarse * len(Factors) - TopK))
+    if min(Sim for _, Sim in Phases) < 1:
+        raise ValueError('NumSim=%d is too small for fidelity phases %s with TopK=%d' % (NumSim, Factors, TopK))
+    return Phases
+
+def Top_Candidates(Params, Metric, TopK=5):
+    # Los TopK vectores de parámetros con menor error (sin repetir)
+    Order   = np.argsort(np.where(np.isnan(Metric), np.inf, Metric), kind='stable')
+    Best    = []
+    for i in Order:
+        if len(Best) == TopK:
+            break
+        if not any(np.array_equal(Params[i], x) for x in Best):
+            Best.append(Params[i])
+    return np.array(Best)
+
+def Narrow_Bounds(Best, Lower, Upper, Margin=0.1):
+    """
+    Límites de la fase siguiente: el rango de los mejores candidatos ampliado en Margin del rango original a cada
+    lado, dentro de los límites originales.
+    """
+    Lower, Upper = np.asarray(Lower, dtype=float), np.asarray(Upper, dtype=float)
+    Width = Margin * (Upper - Lower)
+    return np.maximum(Best.min(axis=0) - Width, Lower), np.minimum(Best.max(axis=0) + Width, Upper)
@@ -122,6 +122,18 @@ def main():
             messagebox.showerror("Invalid Input", "The number of simulations must be an integer greater than 1.")
             return False
 
+    # Validar cantidad de procesos en paralelo
+    def validate_workers():
+        try:
+            value = int(workers_entry.get())
+            if value >= 1:
+                return True
+            else:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Invalid Input", "The number of workers must be an integer greater than or equal to 1.")
+            return False
+
     # Función para ejecutar el modelo en un hilo separado
     def run_calibration():
         try:
@@ -131,6 +143,7 @@ def main():
             log_info(f"Metric: {metric_combobox.get()}")
             log_info(f"Method: {method_combobox.get()}")
             log_info(f"Simulations: {nsim_entry.get()}")
+            log_info(f"Workers: {workers_entry.get()}")
             print("━" * 60)
 
             Spotpy_InVEST.RunCalInVEST(
@@ -138,7 +151,8 @@ def main():
                 main_file_path.get(),
                 metric_combobox.get(),
                 method_combobox.get(),
-                nsim_entry.get()
+                nsim_entry.get(),
+                NumWorkers=int(workers_entry.get())
             )
             print("━" * 60)
             log_success("Calibration completed successfully!")
@@ -149,7 +163,7 @@ def main():
 
     # Función que inicia el hilo
     def start_calibration():
-        if validate_simulations():
+        if validate_simulations() and validate_workers():
             thread = threading.Thread(target=run_calibration)
             thread.daemon = True
             thread.start()
@@ -164,7 +178,8 @@ def main():
 
             Spotpy_InVEST.RunInVEST(
                 edit_projects_path.get(),
-                main_file_path.get()
+                main_file_path.get(),
+                NumWorkers=int(workers_entry.get())
             )
             print("━" * 60)
             log_success("Execution completed successfully!")
@@ -175,7 +190,7 @@ def main():
 
     # Función que inicia el hilo
     def start_execution():
-        if validate_simulations():
+        if validate_simulations() and validate_workers():
             thread = threading.Thread(target=run_execution)
             thread.daemon = True
             thread.start()
@@ -459,6 +474,28 @@ def main():
     nsim_entry.pack(side="left", padx=(0, 20))
     nsim_entry.insert(0, "5")
 
+    # Number of parallel workers
+    workers_label = ctk.CTkLabel(
+        horizontal_frame,
+        text="Workers",
+        font=ctk.CTkFont(size=12, weight="bold"),
+        text_color=COLORS['text_primary']
+    )
+    workers_label.pack(side="left", padx=(0, 10))
+
+    workers_entry = ctk.CTkEntry(
+        horizontal_frame,
+        placeholder_text="1",
+        width=50,
+        height=38,
+        font=ctk.CTkFont(size=11),
+        fg_color=COLORS['bg_secondary'],
+        border_color=COLORS['border'],
+        corner_radius=6
+    )
+    workers_entry.pack(side="left", padx=(0, 20))
+    workers_entry.insert(0, "1")
+
     # Buttons en la misma línea
     button_run_cal = ctk.CTkButton(
         horizontal_frame,
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------------
+# Nature For Water Facility - The Nature Conservancy
+# -------------------------------------------------------------------------
+# InVEST - Version 3.15.1 (update July 2025)
+# -------------------------------------------------------------------------
+#                            DESCRIPTION
+# -------------------------------------------------------------------------
+# Monitor de recursos (memoria, CPU, archivos abiertos, disco) que corre
+# en segundo plano durante RunCalInVEST y RunInVEST.
+# -------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Package
+# ----------------------------------------------------------------------------------------------------------------------
+import os
+import time
+import shutil
+import threading
+import psutil
+import pandas as pd
+from Timing_InVEST import Current_Stage
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Aviso de parada por falta de espacio en disco
+# ----------------------------------------------------------------------------------------------------------------------
+def Abort_Path(ProjectPath):
+    # Archivo que crea el monitor cuando el espacio libre baja del mínimo (lo leen todos los procesos)
+    return os.path.join(ProjectPath, 'TMP', 'Monitor_Abort.txt')
+
+def Check_Abort(ProjectPath):
+    # Detiene la evaluación si el monitor pidió parar (sólo con MinFreeMB); en paralelo llega al proceso principal
+    PathAbort = Abort_Path(ProjectPath)
+    if os.path.isfile(PathAbort):
+        with open(PathAbort, 'r') as ID_File:
+            raise RuntimeError('Resource monitor stopped the run: ' + ID_File.read())
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Monitor
+# ----------------------------------------------------------------------------------------------------------------------
+class Resource_Monitor(object):
+    """
+    Hilo que cada Interval segundos registra, para el proceso actual y sus procesos hijos (workers de spotpy y de
+    RunInVEST): memoria RSS, uso de CPU, archivos abiertos, bytes leídos y escritos en disco, memoria disponible del
+    sistema y espacio libre de cada carpeta de Folders ({nombre: ruta}). Cada muestra lleva la iteración
+    (Iteration() si se pasa) y la etapa en curso del proceso principal (Timing_InVEST) y se agrega de inmediato a
+    PathLog (CSV), para que el registro sobreviva a una caída del proceso.
+
+    Si el espacio libre de alguna carpeta baja de MinFreeMB, el monitor crea Abort_Path(ProjectPath) y las
+    evaluaciones siguientes se detienen con Check_Abort (la calibración se puede reanudar desde el punto de
+    control después de liberar espacio). Con MinFreeMB=None (por defecto) sólo se registra el espacio libre.
+    """
+    Columns = ['time', 'iteration', 'stage', 'rss_mb', 'cpu_pct', 'handles', 'read_mb', 'write_mb', 'avail_mem_mb']
+
+    def __init__(self, ProjectPath, PathLog, Folders, Interval=30, MinFreeMB=None, Iteration=None):
+        self.ProjectPath    = ProjectPath
+        self.PathLog        = PathLog
+        self.Folders        = {Name: Path for Name, Path in Folders.items() if Path and os.path.isdir(Path)}
+        self.Interval       = Interval
+        self.MinFreeMB      = MinFreeMB
+        self.Iteration      = Iteration
+        self.Aborted        = False
+        self._Stop          = threading.Event()
+        self._Process       = psutil.Process()
+        self._Children      = {}
+        self._Thread        = threading.Thread(target=self._Run, name='Resource_Monitor', daemon=True)
+
+    def __enter__(self):
+        return self.Start()
+
+    def __exit__(self, *Error):
+        self.Stop()
+
+    def Start(self):
+        # Un aviso de parada de una ejecución anterior no aplica a esta
+        if os.path.isfile(Abort_Path(self.ProjectPath)):
+            os.remove(Abort_Path(self.ProjectPath))
+        os.makedirs(os.path.dirname(self.PathLog), exist_ok=True)
+        with open(self.PathLog, 'w') as ID_File:
+            ID_File.write(','.join(self.Columns + ['free_%s_mb' % Name for Name in self.Folders]) + '\n')
+        self._Process.cpu_percent(None)
+        self._Thread.start()
+        return self
+
+    def Stop(self):
+        # Última muestra y resumen
+        self._Stop.set()
+        self._Thread.join()
+        self.Sample()
+        if os.path.isfile(Abort_Path(self.ProjectPath)):
+            os.remove(Abort_Path(self.ProjectPath))
+        return self.Summary()
+
+    def _Run(self):
+        while not self._Stop.wait(self.Interval):
+            try:
+                self.Sample()
+            except Exception as e:
+                # El monitor nunca detiene la calibración por un error propio
+                print('Resource monitor - sample failed: ' + repr(e))
+
+    def _Tree(self):
+        # Proceso actual e hijos vivos; los objetos se reutilizan para que cpu_percent mida desde la muestra anterior
+        Tree = [self._Process]
+        for Child in self._Process.children(recursive=True):
+            if Child.pid not in self._Children:
+                self._Children[Child.pid] = Child
+                Child.cpu_percent(None)
+            Tree.append(self._Children[Child.pid])
+        return Tree
+
+    def Sample(self):
+        Rss = Cpu = Handles = Read = Write = 0
+        for Item in self._Tree():
+            try:
+                with Item.oneshot():
+                    Rss     += Item.memory_info().rss
+                    Cpu     += Item.cpu_percent(None)
+                    Handles += Item.num_handles() if os.name == 'nt' else Item.num_fds()
+                    if hasattr(Item, 'io_counters'):
+                        IO      = Item.io_counters()
+                        Read    += IO.read_bytes
+                        Write   += IO.write_bytes
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                self._Children.pop(Item.pid, None)
+
+        Free = [shutil.disk_usage(Path).free / 2**20 for Path in self.Folders.values()]
+        Row  = [self.Iteration() if self.Iteration else '', Current_Stage(), Rss / 2**20, Cpu, Handles,
+                Read / 2**20, Write / 2**20, psutil.virtual_memory().available / 2**20] + Free
+        with open(self.PathLog, 'a') as ID_File:
+            ID_File.write(','.join(['%0.3f' % time.time()] +
+                                   [Value if isinstance(Value, str) else '%0.6g' % Value for Value in Row]) + '\n')
+
+        # Parada antes de llenar el disco (si se pidió un mínimo)
+        Low = [] if self.MinFreeMB is None else [Name for Name, Value in zip(self.Folders, Free)
+                                                 if Value < self.MinFreeMB]
+        if Low and not self.Aborted:
+            self.Aborted = True
+            Message = 'less than %d MB free in %s' % (self.MinFreeMB, ', '.join(Low))
+            with open(Abort_Path(self.ProjectPath), 'w') as ID_File:
+                ID_File.write(Message)
+            print('Resource monitor - ' + Message + ' - stopping after the current evaluations')
+
+    def Summary(self):
+        """
+        Imprime y retorna el resumen del registro: memoria RSS máxima, CPU media y máxima, archivos abiertos máximos,
+        MB leídos y escritos (los contadores de procesos que terminaron no se acumulan) y espacio libre mínimo.
+        """
+        Log = pd.read_csv(self.PathLog)
+        Summary = {'samples'        : len(Log),
+                   'peak_rss_mb'    : Log['rss_mb'].max(),
+                   'mean_cpu_pct'   : Log['cpu_pct'].mean(),
+                   'peak_cpu_pct'   : Log['cpu_pct'].max(),
+                   'peak_handles'   : Log['handles'].max(),
+                   'read_mb'        : Log['read_mb'].max(),
+                   'write_mb'       : Log['write_mb'].max(),
+                   'min_avail_mem_mb': Log['avail_mem_mb'].min()}
+        for Name in self.Folders:
+            Summary['min_free_%s_mb' % Name] = Log['free_%s_mb' % Name].min()
+
+        if len(Log) > 0:
+            Peak = Log.loc[Log['rss_mb'].idxmax()]
+            print('Resource monitor - %d samples | peak RSS %0.0f MB (iteration %s, %s) | CPU mean %0.0f %%, peak '
+                  '%0.0f %% | handles %d | read %0.0f MB, written %0.0f MB | %s' %
+                  (len(Log), Peak['rss_mb'], '%d' % Peak['iteration'] if not pd.isna(Peak['iteration']) else '-',
+                   Peak['stage'] if isinstance(Peak['stage'], str) else '-', Summary['mean_cpu_pct'],
+                   Summary['peak_cpu_pct'], Summary['peak_handles'], Summary['read_mb'], Summary['write_mb'],
+                   ', '.join('min free %s %0.0f MB' % (Name, Summary['min_free_%s_mb' % Name]) for Name in self.Folders)))
+        return Summary
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------------
+# Nature For Water Facility - The Nature Conservancy
+# -------------------------------------------------------------------------
+# InVEST - Version 3.15.1 (update July 2025)
+# -------------------------------------------------------------------------
+#                            DESCRIPTION
+# -------------------------------------------------------------------------
+# Perfiles de las evaluaciones de calibración (cProfile o pyinstrument) y
+# pilas colapsadas para gráficas de llama (flamegraph.pl, speedscope).
+# -------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Package
+# ----------------------------------------------------------------------------------------------------------------------
+import os
+import glob
+import pstats
+import cProfile
+from collections import Counter
+
+# pyinstrument (perfilador por muestreo) es opcional
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Rutas
+# ----------------------------------------------------------------------------------------------------------------------
+def Profile_Folder(ProjectPath):
+    return os.path.join(ProjectPath, 'PARAMETERS', 'profiles')
+
+def Clear_Profiles(ProjectPath, NameModel):
+    # Perfiles de una calibración anterior del modelo
+    for PathFile in glob.glob(os.path.join(Profile_Folder(ProjectPath), NameModel + '_*')):
+        os.remove(PathFile)
+
+def Profiler_Name(Profiler='auto'):
+    # 'auto': pyinstrument si está instalado, si no cProfile
+    if Profiler == 'auto':
+        return 'pyinstrument' if pyinstrument is not None else 'cProfile'
+    if Profiler == 'pyinstrument' and pyinstrument is None:
+        raise ImportError('pyinstrument is not installed (use Profiler="cProfile")')
+    if Profiler not in ('pyinstrument', 'cProfile'):
+        raise ValueError('Unknown profiler: ' + str(Profiler))
+    return Profiler
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Perfil de una llamada
+# ----------------------------------------------------------------------------------------------------------------------
+# Evaluaciones de este proceso. En paralelo spotpy envía una copia del objeto de calibración con cada tarea, por eso
+# el contador no puede vivir en el objeto
+_Calls = [0]
+
+def Next_Call():
+    _Calls[0] += 1
+    return _Calls[0]
+
+def Profile_Call(Function, Args, PathBase, Profiler='auto'):
+    """
+    Ejecuta Function(*Args) con el perfilador y retorna su resultado. Guarda el perfil en PathBase + '.prof'
+    (cProfile; snakeviz, pstats) o PathBase + '.html' (pyinstrument) y sus pilas colapsadas en
+    PathBase + '.collapsed' (una línea 'f1;f2;f3 microsegundos' por pila). El perfil se guarda aunque la llamada
+    termine con una excepción.
+    """
+    os.makedirs(os.path.dirname(PathBase), exist_ok=True)
+    if Profiler_Name(Profiler) == 'pyinstrument':
+        Profiler = pyinstrument.Profiler(interval=0.001)
+        Profiler.start()
+        try:
+            return Function(*Args)
+        finally:
+            Session = Profiler.stop()
+            with open(PathBase + '.html', 'w', encoding='utf-8') as ID_File:
+                ID_File.write(Profiler.output_html())
+            Write_Collapsed(PathBase + '.collapsed', _Collapse_Frame(Session.root_frame()))
+    else:
+        Profiler = cProfile.Profile()
+        try:
+            return Profiler.runcall(Function, *Args)
+        finally:
+            Profiler.dump_stats(PathBase + '.prof')
+            Write_Collapsed(PathBase + '.collapsed', _Collapse_Stats(pstats.Stats(Profiler).stats))
+
+def _Frame_Name(File, Line, Function):
+    # 'función (archivo.py:línea)'; las funciones de C quedan solo con su nombre
+    if not File or File == '~' or File.startswith('<'):
+        return Function
+    return '%s (%s:%s)' % (Function, os.path.basename(File), Line)
+
+def _Collapse_Frame(Root):
+    # Pilas de pyinstrument: el tiempo propio de cada marco es su tiempo menos el de sus hijos
+    Stacks = Counter()
+    def Walk(Frame, Path):
+        Path     = Path + [_Frame_Name(Frame.file_path, Frame.line_no, Frame.function)]
+        Children = [Child for Child in Frame.children if not getattr(Child, 'is_synthetic', False)]
+        Self     = Frame.time - sum(Child.time for Child in Children)
+        if Self > 0:
+            Stacks[';'.join(Path)] += 1e6*Self
+        for Child in Children:
+            Walk(Child, Path)
+    if Root is not None:
+        Walk(Root, [])
+    return Stacks
+
+def _Collapse_Stats(Stats, MinShare=1e-4):
+    """
+    Pilas aproximadas a partir del grafo de llamadas de cProfile, que solo guarda pares llamador-llamado: el tiempo
+    de cada función se reparte entre sus llamadores según el tiempo de cada arco. Se omiten las ramas con menos de
+    MinShare del tiempo total y las llamadas recursivas.
+    """
+    Callees = {}
+    for Function, (_, _, _, _, Callers) in Stats.items():
+        for Caller, Edge in Callers.items():
+            Callees.setdefault(Caller, []).append((Function, Edge[3]))
+    Roots   = [Function for Function, Value in Stats.items() if not Value[4]]
+    MinTime = MinShare*sum(Stats[Function][3] for Function in Roots)
+    Stacks  = Counter()
+
+    def Walk(Function, Path, Seen, Time):
+        _, _, Tt, Ct, _ = Stats[Function]
+        Share = min(Time/Ct, 1) if Ct > 0 else 0
+        Path  = Path + [_Frame_Name(*Function)]
+        if Tt*Share > 0:
+            Stacks[';'.join(Path)] += 1e6*Tt*Share
+        for Callee, EdgeTime in Callees.get(Function, []):
+            if Callee not in Seen and EdgeTime*Share >= MinTime:
+                Walk(Callee, Path, Seen | {Callee}, EdgeTime*Share)
+
+    for Function in Roots:
+        Walk(Function, [], {Function}, Stats[Function][3])
+    return Stacks
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Pilas colapsadas
+# ----------------------------------------------------------------------------------------------------------------------
+def Write_Collapsed(PathFile, Stacks):
+    with open(PathFile, 'w', encoding='utf-8') as ID_File:
+        for Stack, Value in sorted(Stacks.items()):
+            if int(Value) > 0:
+                ID_File.write('%s %d\n' % (Stack, Value))
+
+def Read_Collapsed(PathFile):
+    Stacks = Counter()
+    with open(PathFile, 'r', encoding='utf-8') as ID_File:
+        for Line in ID_File:
+            Stack, Value = Line.rstrip('\n').rsplit(' ', 1)
+            Stacks[Stack] += int(Value)
+    return Stacks
+
+def Merge_Profiles(ProjectPath, NameModel, Top=10):
+    """
+    Suma las pilas colapsadas de todas las evaluaciones perfiladas del modelo (todos los procesos) en
+    PARAMETERS/profiles/<Model>_Profile.collapsed e imprime las Top funciones con más tiempo propio. Retorna la ruta
+    del archivo (None si no hay perfiles).
+    """
+    PathMerged = os.path.join(Profile_Folder(ProjectPath), NameModel + '_Profile.collapsed')
+    Files      = sorted(glob.glob(os.path.join(Profile_Folder(ProjectPath), NameModel + '_*.collapsed')))
+    Files      = [PathFile for PathFile in Files if PathFile != PathMerged]
+    if not Files:
+        return None
+
+    Stacks = Counter()
+    for PathFile in Files:
+        Stacks.update(Read_Collapsed(PathFile))
+    Write_Collapsed(PathMerged, Stacks)
+
+    # Tiempo propio por función (último marco de cada pila)
+    SelfTime = Counter()
+    for Stack, Value in Stacks.items():
+        SelfTime[Stack.rsplit(';', 1)[-1]] += Value
+    Total = max(sum(SelfTime.values()), 1)
+    print('Profile - %s - %d profiled evaluations - %s' % (NameModel, len(Files), PathMerged))
+    for Name, Value in SelfTime.most_common(Top):
+        print('%8.1f ms %5.1f %%  %s' % (Value/1e3, 100*Value/Total, Name))
+
+    return PathMerged
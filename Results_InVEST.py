@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------------
+# Nature For Water Facility - The Nature Conservancy
+# -------------------------------------------------------------------------
+# InVEST - Version 3.15.1 (update July 2025)
+# -------------------------------------------------------------------------
+#                            DESCRIPTION
+# -------------------------------------------------------------------------
+# Almacenamiento de los resultados de la calibración (una fila por
+# evaluación) en SQLite.
+# -------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Package
+# ----------------------------------------------------------------------------------------------------------------------
+import os
+import json
+import time
+import sqlite3
+import contextlib
+import numpy as np
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Almacén de resultados
+# ----------------------------------------------------------------------------------------------------------------------
+class Results_Store(object):
+    """
+    Guarda una fila por evaluación del modelo en EVALUATIONS/<Model>_Results_<Suffix>.sqlite: vector de parámetros,
+    métrica, simulación por ws_id (alineada con Obs_Data, NaN si la cuenca no se simuló), tiempo de ejecución, estado
+    de la caché, tiempos por etapa (Timing_InVEST), factor de fidelidad (1 = resolución nativa, k = pirámide con
+    píxeles k veces más grandes, ver Fidelity_InVEST), si la evaluación es del tamizado de sensibilidad
+    (Screening_InVEST) y los MB que InVEST escribió en su workspace y los que quedaron después de la poda
+    (Prune_Workspace; NaN sin workspace). Los observados, los ws_id y los nombres de los parámetros se guardan una
+    sola vez.
+
+    Las filas se escriben por lotes de BatchSize. En los procesos del pool (distintos al que creó el objeto) cada
+    evaluación se escribe de inmediato porque spotpy puede terminar esos procesos sin avisar.
+    """
+    def __init__(self, PathDB, ParamNames, ws_id, Obs, NameFunObj, BatchSize=50):
+        self.PathDB     = PathDB
+        self.BatchSize  = BatchSize
+        self.Buffer     = []
+        self.OwnerPid   = os.getpid()
+        with self._Connect() as Con:
+            Con.execute('CREATE TABLE IF NOT EXISTS evals (id INTEGER PRIMARY KEY AUTOINCREMENT, metric REAL, '
+                        'wall_time REAL, cache TEXT, pid INTEGER, timestamp REAL, params BLOB, sim BLOB, stages TEXT, '
+                        'fidelity INTEGER DEFAULT 1, screening INTEGER DEFAULT 0, written_mb REAL, kept_mb REAL)')
+            # Almacenes creados antes de registrar los tiempos por etapa, la fidelidad, el tamizado y el workspace
+            Columns = [Row[1] for Row in Con.execute('PRAGMA table_info(evals)')]
+            if 'stages' not in Columns:
+                Con.execute('ALTER TABLE evals ADD COLUMN stages TEXT')
+            if 'fidelity' not in Columns:
+                Con.execute('ALTER TABLE evals ADD COLUMN fidelity INTEGER DEFAULT 1')
+            if 'screening' not in Columns:
+                Con.execute('ALTER TABLE evals ADD COLUMN screening INTEGER DEFAULT 0')
+            for Column in ['written_mb', 'kept_mb']:
+                if Column not in Columns:
+                    Con.execute('ALTER TABLE evals ADD COLUMN %s REAL' % Column)
+            Con.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+            # Los vectores guardados siguen el orden de los parámetros con que se creó el almacén: con otro orden se
+            # leerían con los nombres cambiados
+            Row = Con.execute("SELECT value FROM meta WHERE name = 'params'").fetchone()
+            if Row is not None and Row[0] != ','.join(ParamNames):
+                raise ValueError('The results store %s was written with the parameters %s, not %s. Move or delete it '
+                                 'to start a new one.' % (PathDB, Row[0], ','.join(ParamNames)))
+            Meta = {'params': ','.join(ParamNames),
+                    'ws_id' : ','.join(str(i) for i in ws_id),
+                    'obs'   : ','.join(repr(float(i)) for i in Obs),
+                    'funobj': NameFunObj}
+            Con.executemany('INSERT OR REPLACE INTO meta VALUES (?, ?)', Meta.items())
+
+    @contextlib.contextmanager
+    def _Connect(self):
+        Con = sqlite3.connect(self.PathDB, timeout=60)
+        try:
+            Con.execute('PRAGMA journal_mode=WAL')
+            with Con:
+                yield Con
+        finally:
+            Con.close()
+
+    def Add(self, x, Metric, Sim, WallTime=np.nan, Cache='off', Stages=None, Fidelity=1, Screening=False,
+            WrittenMB=np.nan, KeptMB=np.nan):
+        self.Buffer.append((float(Metric), float(WallTime), Cache, os.getpid(), time.time(),
+                            np.asarray(x, dtype='float64').tobytes(), np.asarray(Sim, dtype='float64').tobytes(),
+                            json.dumps(Stages or []), int(Fidelity), int(Screening), float(WrittenMB), float(KeptMB)))
+        if len(self.Buffer) >= self.BatchSize or os.getpid() != self.OwnerPid:
+            self.Flush()
+
+    def Flush(self):
+        if not self.Buffer:
+            return
+        with self._Connect() as Con:
+            Con.executemany('INSERT INTO evals (metric, wall_time, cache, pid, timestamp, params, sim, stages, '
+                            'fidelity, screening, written_mb, kept_mb) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                            self.Buffer)
+        self.Buffer = []
+
+    def Set_Meta(self, Name, Value):
+        # Datos de la calibración (p. ej. el motivo de la parada) junto a las evaluaciones
+        with self._Connect() as Con:
+            Con.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (Name, json.dumps(Value)))
+
+def Read_Results(PathDB, FirstId=0, Fidelity=None, Screening=None):
+    """
+    Lee el almacén de resultados (evaluaciones con id > FirstId y, si se indica, del factor de fidelidad Fidelity y
+    del tamizado de sensibilidad (Screening=True) o de la calibración (Screening=False)).
+    Retorna un diccionario con:
+        Params (n x p), Metric (n), Sim (n x g), ws_id (g), Obs (g), WallTime (n), Cache (n), Pid (n), Fidelity (n),
+        Screening (n), WrittenMB (n), KeptMB (n), Stages (n listas de [etapa, inicio, duración]), ParamNames,
+        NameFunObj, Stop (motivo de la parada de la última calibración, None si no se registró)
+    """
+    Con = sqlite3.connect(PathDB, timeout=60)
+    try:
+        Meta = dict(Con.execute('SELECT name, value FROM meta').fetchall())
+        Columns = [Row[1] for Row in Con.execute('PRAGMA table_info(evals)')]
+        Column  = 'fidelity' if 'fidelity' in Columns else '1'
+        Tag     = 'screening' if 'screening' in Columns else '0'
+        Where   = ('' if Fidelity is None else ' AND %s = %d' % (Column, Fidelity)) + \
+                  ('' if Screening is None else ' AND %s = %d' % (Tag, int(Screening)))
+        Extra   = ', '.join(Name if Name in Columns else 'NULL' for Name in ['stages', 'written_mb', 'kept_mb'])
+        Rows = Con.execute('SELECT metric, wall_time, cache, params, sim, pid, %s, %s, %s FROM evals WHERE id > ?%s '
+                           'ORDER BY id' % (Extra, Column, Tag, Where), (FirstId,)).fetchall()
+    finally:
+        Con.close()
+
+    ParamNames  = Meta['params'].split(',')
+    ws_id       = np.array([float(i) for i in Meta['ws_id'].split(',')])
+    Obs         = np.array([float(i) for i in Meta['obs'].split(',')])
+    Results = {'ParamNames' : ParamNames,
+               'NameFunObj' : Meta['funobj'],
+               'Stop'       : json.loads(Meta['stop']) if 'stop' in Meta else None,
+               'ws_id'      : ws_id,
+               'Obs'        : Obs,
+               'Metric'     : np.array([Row[0] for Row in Rows], dtype='float64'),
+               'WallTime'   : np.array([Row[1] for Row in Rows], dtype='float64'),
+               'Cache'      : np.array([Row[2] for Row in Rows]),
+               'Pid'        : np.array([Row[5] for Row in Rows]),
+               'Stages'     : [json.loads(Row[6]) if Row[6] else [] for Row in Rows],
+               'WrittenMB'  : np.array([Row[7] for Row in Rows], dtype='float64'),
+               'KeptMB'     : np.array([Row[8] for Row in Rows], dtype='float64'),
+               'Fidelity'   : np.array([Row[9] for Row in Rows], dtype='int64'),
+               'Screening'  : np.array([Row[10] for Row in Rows], dtype=bool),
+               'Params'     : np.array([np.frombuffer(Row[3]) for Row in Rows]).reshape(len(Rows), len(ParamNames)),
+               'Sim'        : np.array([np.frombuffer(Row[4]) for Row in Rows]).reshape(len(Rows), len(Obs))}
+    return Results
+
+def Read_Replay(PathDB, FirstId=0, Fidelity=1, Screening=False):
+    """
+    Evaluaciones ya guardadas (id > FirstId, del factor de fidelidad Fidelity, del tamizado o de la calibración)
+    indexadas por el vector de parámetros, para reanudar una calibración sin volver a ejecutar InVEST:
+    {bytes del vector: [Sim, ...]}
+    """
+    Replay = {}
+    if not os.path.isfile(PathDB):
+        return Replay
+    Con = sqlite3.connect(PathDB, timeout=60)
+    try:
+        Columns = [Row[1] for Row in Con.execute('PRAGMA table_info(evals)')]
+        Where   = ('AND fidelity = %d ' % Fidelity if 'fidelity' in Columns else '') + \
+                  ('AND screening = %d ' % int(Screening) if 'screening' in Columns else '')
+        Rows = Con.execute('SELECT params, sim FROM evals WHERE id > ? %sORDER BY id' % Where, (FirstId,)).fetchall()
+    finally:
+        Con.close()
+    for Params, Sim in Rows:
+        Replay.setdefault(bytes(Params), []).append(np.frombuffer(Sim).copy())
+    return Replay
+
+def Last_Id(PathDB):
+    # Último id del almacén de resultados (0 si no existe)
+    if not os.path.isfile(PathDB):
+        return 0
+    Con = sqlite3.connect(PathDB, timeout=60)
+    try:
+        return Con.execute('SELECT COALESCE(MAX(id), 0) FROM evals').fetchone()[0]
+    finally:
+        Con.close()
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Punto de control de la calibración
+# ----------------------------------------------------------------------------------------------------------------------
+def Read_Checkpoint(PathCheckpoint):
+    if not os.path.isfile(PathCheckpoint):
+        return None
+    with open(PathCheckpoint, 'r') as ID_File:
+        return json.load(ID_File)
+
+def Write_Checkpoint(PathCheckpoint, Checkpoint):
+    # Escritura atómica para que una interrupción no deje el archivo a medias
+    PathTmp = PathCheckpoint + '.tmp'
+    with open(PathTmp, 'w') as ID_File:
+        json.dump(Checkpoint, ID_File, indent=2)
+    os.replace(PathTmp, PathCheckpoint)
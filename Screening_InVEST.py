@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------------
+# Nature For Water Facility - The Nature Conservancy
+# -------------------------------------------------------------------------
+# InVEST - Version 3.15.1 (update July 2025)
+# -------------------------------------------------------------------------
+#                            DESCRIPTION
+# -------------------------------------------------------------------------
+# Tamizado de sensibilidad global (FAST de spotpy) antes de la calibración:
+# los parámetros poco sensibles se fijan en su valor del libro.
+# -------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Package
+# ----------------------------------------------------------------------------------------------------------------------
+import math
+import numpy as np
+import pandas as pd
+
+# Armónicos de FAST (el M por defecto de spotpy.algorithms.fast)
+M = 4
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Tamizado
+# ----------------------------------------------------------------------------------------------------------------------
+def Screening_Sim(NumParams, ScreeningSim=None):
+    """
+    Evaluaciones del tamizado FAST: N por parámetro, con N > 4*M*M = 64 para que exista al menos una frecuencia para
+    los parámetros complementarios y N distinto de 1 módulo 2*M (el índice de primer orden de spotpy se sale del
+    espectro). ScreeningSim (total) se redondea hacia arriba a un múltiplo de NumParams; sin ScreeningSim se usa el
+    mínimo.
+    """
+    N = max(4*M*M + 2, int(math.ceil((ScreeningSim or 0) / NumParams)))
+    if N % (2*M) == 1:
+        N += 1
+    return N*NumParams
+
+def FAST_Indices(Sampler, Lower, Upper, Names, Error):
+    """
+    Índices de primer orden (S1) y total (ST) con spotpy.algorithms.fast.analyze a partir del error de cada
+    evaluación en el orden de la matriz de FAST. Las evaluaciones sin resultado (NaN) toman el peor error.
+    Retorna una tabla con Parameter, S1 y ST.
+    """
+    Error   = np.asarray(Error, dtype=float)
+    Worst   = np.nanmax(Error) if np.isfinite(Error).any() else 0.0
+    Error   = np.where(np.isfinite(Error), Error, Worst)
+    Si      = Sampler.analyze([[Low, High] for Low, High in zip(Lower, Upper)], Error, len(Names), Names, M=M)
+    return pd.DataFrame({'Parameter': Names, 'S1': Si['S1'], 'ST': Si['ST']})
+
+def Select_Parameters(Indices, Values, Threshold=0.05):
+    """
+    Ordena los parámetros por ST (de mayor a menor) y fija los que tienen ST < Threshold en su valor del libro
+    (Values, en el orden de Indices). Se deja libre al menos el más sensible.
+    Retorna la tabla con Rank, Status ('free'/'fixed') y Value, y el diccionario {posición: valor} de los fijos.
+    """
+    Table           = Indices.copy()
+    Table['Value']  = np.asarray(Values, dtype=float)
+    Table['Rank']   = Table['ST'].rank(ascending=False, method='first').astype(int)
+    Fixed           = (Table['ST'] < Threshold).values
+    Fixed[Table['Rank'].values == 1] = False
+    Table['Status'] = np.where(Fixed, 'fixed', 'free')
+    return Table.sort_values('Rank'), {int(i): float(Table['Value'][i]) for i in np.flatnonzero(Fixed)}
+
+def Population_Size(NameOpt, NumParams, Complexes=None):
+    # Evaluaciones de la población inicial de SCE-UA (Complexes complejos, ngs=20 en spotpy, de 2*p+1 puntos);
+    # 0 para DDS y LHS
+    return (Complexes or 20)*(2*NumParams + 1) if NameOpt == "Shuffled Complex Evolution (SCE-UA)" else 0
@@ -34,6 +34,10 @@
 # Package
 # ----------------------------------------------------------------------------------------------------------------------
 import os, sys
+import time
+import shutil
+import atexit
+import hashlib
 import spotpy
 import numpy as np
 import pandas as pd
@@ -51,7 +55,6 @@ rcParams['mathtext.fontset'] = 'custom'
 rcParams['mathtext.rm'] = 'Times New Roman'
 rcParams['mathtext.it'] = 'Times New Roman:italic'
 rcParams['mathtext.bf'] = 'Times New Roman:bold'
-from rasterstats import zonal_stats
 # Seasonal Water Yield
 from natcap.invest.seasonal_water_yield import seasonal_water_yield as swy
 # Sediment Delivery Ratio
@@ -62,6 +65,30 @@ from natcap.invest.ndr import ndr
 import natcap.invest.annual_water_yield as awy
 # Carbons
 from natcap.invest import carbon
+# Cachés de la calibración
+from Cache_InVEST import Routing_Cache, Zonal_Index, Eval_Cache
+# Motores nativos
+from Engine_InVEST import AWY_Engine, SWY_Engine, SDR_Engine, NDR_Engine
+# Almacén de resultados
+from Results_InVEST import Results_Store, Read_Results, Read_Replay, Last_Id, Read_Checkpoint, Write_Checkpoint
+# Configuración del proyecto
+from Config_InVEST import Load_Config
+# Tiempos por etapa de cada evaluación
+from Timing_InVEST import Stage, Take_Stages, Stage_Summary, Write_Trace
+# Monitor de recursos
+from Monitor_InVEST import Resource_Monitor, Check_Abort
+# Perfiles de evaluaciones (cProfile o pyinstrument)
+from Profile_InVEST import Profile_Folder, Profile_Call, Profiler_Name, Next_Call, Clear_Profiles, Merge_Profiles
+# Criterios de parada de la calibración
+from Convergence_InVEST import Convergence, Stop_Calibration
+# Calibración multi-fidelidad (pirámides de entradas)
+from Fidelity_InVEST import Build_Pyramid, Coarse_UserData, Fidelity_Phases, Top_Candidates, Narrow_Bounds
+# Tamizado de sensibilidad (FAST)
+from Screening_InVEST import Screening_Sim, FAST_Indices, Select_Parameters, Population_Size
+# Modelo sustituto que descarta candidatos sin ejecutar InVEST
+from Surrogate_InVEST import Surrogate_Model, Surrogate_Kinds, Prediction
+# Variantes en paralelo de los optimizadores de spotpy
+from Algorithms_InVEST import DDS, SCEUA, LHS, FAST, Parallel_DDS, Batched_SCEUA
 
 gdal.PushErrorHandler('CPLQuietErrorHandler')
 
@@ -72,12 +99,27 @@ def CreateFolder(dir):
         # directory already exists
         pass
 
-def RunCalInVEST(ProjectPath, InVEST_Main_Path, NameFunObj, NameOpt, NumSim=5):
+def RunCalInVEST(ProjectPath, InVEST_Main_Path, NameFunObj, NameOpt, NumSim=5, NumWorkers=1, NativeAWY=False, EvalCache=True,
+                 CheckpointEvery=20, TaskWorkers=-1, NativeSDR=False, NativeNDR=False, NativeSWY=False,
+                 ScratchPath=None, ScratchMinMB=1024, PruneOutputs=True, WorkspaceMaxMB=None, MonitorInterval=30,
+                 MinFreeMB=None, ProfileEvery=0, Profiler='auto', Patience=None, MinImprovement=0.0,
+                 TargetMetric=None, MaxMinutes=None, Fidelity=None, CoarseShare=0.5, TopK=5, Screening=None,
+                 ScreeningSim=None, ScreeningThreshold=0.05, ScreeningFidelity=1, Surrogate=None, Exploration=0.1,
+                 RetrainEvery=10, DDSBatch=None, SCEComplexes=None):
 
     # ----------------------------------------------------------------------------------------------------------------------
     # Inputs
     # ----------------------------------------------------------------------------------------------------------------------
-    Inputs = pd.read_excel(InVEST_Main_Path, sheet_name='UserData', index_col=0)
+    Config = Load_Config(InVEST_Main_Path, ProjectPath)
+    Inputs = Config.Inputs
+
+    # spotpy no tiene Morris: el tamizado de sensibilidad es FAST
+    if Screening and Screening != 'FAST':
+        raise ValueError('Unknown screening method: ' + str(Screening) + ' (use "FAST")')
+    if Surrogate and Surrogate not in Surrogate_Kinds:
+        raise ValueError('Unknown surrogate model: ' + str(Surrogate) + ' (use "rbf", "gp" or "rf")')
+    if SCEComplexes and SCEComplexes != 'auto' and int(SCEComplexes) < 2:
+        raise ValueError('SCEComplexes must be "auto" or at least 2: ' + str(SCEComplexes))
 
     # ----------------------------------------------------------------------------------------------------------------------
     # Configuración de calibración
@@ -96,43 +138,254 @@ def RunCalInVEST(ProjectPath, InVEST_Main_Path, NameFunObj, NameOpt, NumSim=5):
             elif NameOpt == "Latin Hypercube Sampling (LHS)":
                 FactorMetric = 1
 
-            # Crear Objecto - Spotpy para AWY
-            spot_setup = Spotpy_InVEST(ProjectPath,
-                                       InVEST_Main_Path,
-                                       NameModel,
-                                       NameFunObj,
-                                       FactorMetric)
-
             # Almacenamiento de resultados
             results     = []
             # Número de simulaciones en calibración
             rep         = int(NumSim)
-            # Timepo de salida de mensajes
-            timeout     = 2
+            # Sin tiempo límite: InVEST se ejecuta dentro de spot_setup.simulation
+            timeout     = None
             # Ejecución en paralelo o secuencial
-            parallel    = "seq"
+            parallel    = Parallel_Mode(NameOpt, NumWorkers, DDSBatch)
             # Formato de salida
             dbformat    = "csv"
 
-            # Configuración de caso de optimización
-            if NameOpt == "Dynamical dimensional search (DDS)":
-                # Directorio de resultados
-                PathRestuls = os.path.join(ProjectPath, 'PARAMETERS', NameModel + '_DDS')
-                sampler     = spotpy.algorithms.dds(spot_setup, parallel=parallel, dbname=PathRestuls, dbformat=dbformat,
-                                                sim_timeout=timeout)
-            elif NameOpt == "Shuffled Complex Evolution (SCE-UA)":
-                # Directorio de resultados
-                PathRestuls = os.path.join(ProjectPath, 'PARAMETERS', NameModel + '_SCE')
-                sampler     = spotpy.algorithms.sceua(spot_setup, parallel=parallel, dbname=PathRestuls, dbformat=dbformat,
-                                                sim_timeout=timeout)
-            elif NameOpt == "Latin Hypercube Sampling (LHS)":
-                # Directorio de resultados
-                PathRestuls = os.path.join(ProjectPath, 'PARAMETERS', NameModel + '_LHS')
-                sampler     = spotpy.algorithms.lhs(spot_setup, parallel=parallel, dbname=PathRestuls, dbformat=dbformat,
-                                                sim_timeout=timeout)
-
-            sampler.sample(rep)
-            results.append(sampler.getdata())
+            # ----------------------------------------------------------------------------------------------------------
+            # Punto de control: si la calibración anterior con la misma configuración no terminó, se reanuda con la
+            # misma semilla y las evaluaciones guardadas se reutilizan sin ejecutar InVEST. Con la misma semilla el
+            # optimizador repite exactamente los mismos pasos (mejor punto e iteración de DDS, complejos de SCE-UA y
+            # matriz de LHS) hasta el punto donde se detuvo.
+            # ----------------------------------------------------------------------------------------------------------
+            PathCheckpoint  = os.path.join(ProjectPath, 'PARAMETERS', NameModel + '_Checkpoint.json')
+            PathStore       = Results_Path(ProjectPath, NameModel, Inputs.loc['Name', 'Value'])
+            RunConfig       = {'Model': NameModel, 'NameOpt': NameOpt, 'NameFunObj': NameFunObj, 'NumSim': rep}
+            if Fidelity:
+                RunConfig['Fidelity'] = [sorted(Fidelity), CoarseShare, TopK]
+            if Screening:
+                RunConfig['Screening'] = [Screening, ScreeningSim, ScreeningThreshold, ScreeningFidelity]
+            if Surrogate:
+                RunConfig['Surrogate'] = [Surrogate, Exploration, RetrainEvery]
+            if NameOpt == "Dynamical dimensional search (DDS)" and DDSBatch and int(DDSBatch) > 1:
+                RunConfig['DDSBatch'] = int(DDSBatch)
+            # SCE-UA por lotes: número de complejos ('auto': uno por proceso, al menos 2)
+            Complexes       = None
+            if NameOpt == "Shuffled Complex Evolution (SCE-UA)" and SCEComplexes:
+                Complexes   = max(2, int(NumWorkers)) if SCEComplexes == 'auto' else int(SCEComplexes)
+                RunConfig['SCEComplexes'] = Complexes
+            Checkpoint      = Read_Checkpoint(PathCheckpoint)
+            if Checkpoint is not None and Checkpoint['Status'] == 'running' and Checkpoint['Config'] == RunConfig:
+                Seed                = Checkpoint['Seed']
+                print('Resuming calibration - %d evaluations replayed from the results store' %
+                      (Last_Id(PathStore) - Checkpoint['FirstId']))
+            else:
+                Seed                = int(np.random.randint(0, 2**30))
+                Checkpoint          = {'Config': RunConfig, 'Seed': Seed, 'FirstId': Last_Id(PathStore), 'Status': 'running'}
+                Write_Checkpoint(PathCheckpoint, Checkpoint)
+
+            # Workspaces de las evaluaciones en la carpeta rápida (None: en el proyecto)
+            ScratchRoot = Scratch_Root(ProjectPath, ScratchPath, ScratchMinMB)
+
+            # Fases de la calibración: exploración en las pirámides de entradas gruesas (Fidelity) y refinamiento en la
+            # resolución nativa. Sin Fidelity hay una sola fase nativa con NumSim evaluaciones
+            Phases = Fidelity_Phases(rep, Fidelity, CoarseShare, TopK)
+
+            # Limpia directorios de procesos de una ejecución anterior interrumpida
+            if parallel != "seq":
+                shutil.rmtree(os.path.join(ProjectPath, 'TMP', 'WORKERS'), ignore_errors=True)
+
+            # Monitor de recursos en EVALUATIONS/<Modelo>_Monitor_<Name>.csv (se detiene antes de llenar el disco)
+            sampler = None
+            Monitor = None
+            if MonitorInterval:
+                Monitor = Resource_Monitor(ProjectPath,
+                                           os.path.join(ProjectPath, 'EVALUATIONS', NameModel + '_Monitor_' +
+                                                        Inputs.loc['Name', 'Value'] + '.csv'),
+                                           {'OUTPUTS'   : os.path.join(ProjectPath, 'OUTPUTS'),
+                                            'TMP'       : os.path.join(ProjectPath, 'TMP'),
+                                            'SCRATCH'   : ScratchRoot},
+                                           MonitorInterval, MinFreeMB,
+                                           Iteration=lambda: getattr(getattr(sampler, 'status', None), 'rep', 0)).Start()
+
+            # Perfiles de una calibración anterior del modelo
+            if ProfileEvery:
+                Clear_Profiles(ProjectPath, NameModel)
+
+            # Opciones comunes de los objetos de calibración del tamizado y de las fases
+            Options = dict(NumWorkers=NumWorkers, NativeAWY=NativeAWY, NativeSDR=NativeSDR, NativeNDR=NativeNDR,
+                           NativeSWY=NativeSWY, ScratchRoot=ScratchRoot, ScratchMinMB=ScratchMinMB,
+                           PruneOutputs=PruneOutputs, WorkspaceMaxMB=WorkspaceMaxMB, ProfileEvery=ProfileEvery,
+                           Profiler=Profiler, EvalCache=EvalCache, CheckpointEvery=CheckpointEvery)
+
+            # Etapas registradas antes de la calibración en este proceso
+            Take_Stages()
+            # Motivo de la parada (sin criterios de parada se hacen las NumSim evaluaciones)
+            Stop    = 'NumSim reached'
+            Bounds  = None
+            Best    = []
+            Fixed   = {}
+            ScreenInfo = None
+            Surrogates = []
+            try:
+                # Tamizado de sensibilidad: los parámetros con índice total de FAST menor que ScreeningThreshold se
+                # fijan en su Value del libro y el optimizador solo calibra los demás
+                if Screening:
+                    Fixed, ScreenInfo = Screen_Parameters(ProjectPath, Config, NameModel, NameFunObj, FactorMetric,
+                                                          NameOpt, Seed, Checkpoint['FirstId'], ScreeningSim,
+                                                          ScreeningThreshold, ScreeningFidelity, TaskWorkers, Options,
+                                                          Complexes)
+
+                for Phase, (Factor, PhaseSim) in enumerate(Phases):
+                    # Crear Objecto - Spotpy. spotpy calcula step y optguess de los parámetros con muestras
+                    # aleatorias, por eso se fija la semilla antes de crearlo (la de la fase 0 es la de siempre)
+                    np.random.seed(Seed + Phase)
+                    spot_setup = Spotpy_InVEST(ProjectPath, Config, NameModel, NameFunObj, FactorMetric,
+                                               Fidelity=Factor,
+                                               Bounds=Bounds,
+                                               Fixed=Fixed,
+                                               # Los criterios de parada se aplican a la métrica de la resolución nativa
+                                               Patience=Patience if Factor == 1 else None,
+                                               MinImprovement=MinImprovement,
+                                               TargetMetric=TargetMetric if Factor == 1 else None,
+                                               MaxMinutes=MaxMinutes if Factor == 1 else None,
+                                               Surrogate=Surrogate,
+                                               Exploration=Exploration,
+                                               RetrainEvery=RetrainEvery,
+                                               FirstId=Checkpoint['FirstId'],
+                                               TaskWorkers=Task_Workers(NumWorkers if parallel != "seq" else 1,
+                                                                        TaskWorkers),
+                                               **Options)
+                    # Evaluaciones de la fase que se reutilizan al reanudar
+                    spot_setup.Replay = Read_Replay(PathStore, Checkpoint['FirstId'], Factor)
+                    if spot_setup.Surrogate is not None:
+                        Surrogates.append(spot_setup.Surrogate)
+
+                    # Configuración de caso de optimización (las fases gruesas guardan su base de datos con _F<k>)
+                    Tag = '' if Factor == 1 else '_F%d' % Factor
+                    if NameOpt == "Dynamical dimensional search (DDS)":
+                        # Directorio de resultados
+                        PathRestuls = os.path.join(ProjectPath, 'PARAMETERS', NameModel + '_DDS' + Tag)
+                        if DDSBatch and int(DDSBatch) > 1:
+                            # PDDS: DDSBatch perturbaciones del mejor punto por ronda, evaluadas en paralelo
+                            sampler = Parallel_DDS(spot_setup, parallel=parallel, dbname=PathRestuls,
+                                                   dbformat=dbformat, sim_timeout=timeout, random_state=Seed + Phase,
+                                                   Batch=int(DDSBatch))
+                        else:
+                            sampler = DDS(spot_setup, parallel=parallel, dbname=PathRestuls, dbformat=dbformat,
+                                          sim_timeout=timeout, random_state=Seed + Phase)
+                    elif NameOpt == "Shuffled Complex Evolution (SCE-UA)":
+                        # Directorio de resultados
+                        PathRestuls = os.path.join(ProjectPath, 'PARAMETERS', NameModel + '_SCE' + Tag)
+                        if Complexes:
+                            # Población inicial y pasos de CCE de todos los complejos evaluados por lotes
+                            sampler = Batched_SCEUA(spot_setup, parallel=parallel, dbname=PathRestuls,
+                                                    dbformat=dbformat, sim_timeout=timeout, random_state=Seed + Phase,
+                                                    Complexes=Complexes)
+                        else:
+                            sampler = SCEUA(spot_setup, parallel=parallel, dbname=PathRestuls, dbformat=dbformat,
+                                            sim_timeout=timeout, random_state=Seed + Phase)
+                    elif NameOpt == "Latin Hypercube Sampling (LHS)":
+                        # Directorio de resultados
+                        PathRestuls = os.path.join(ProjectPath, 'PARAMETERS', NameModel + '_LHS' + Tag)
+                        sampler     = LHS(spot_setup, parallel=parallel, dbname=PathRestuls, dbformat=dbformat,
+                                          sim_timeout=timeout, random_state=Seed + Phase)
+
+                    # Contadores de la caché de evaluaciones al inicio y límites originales de los parámetros
+                    if Phase == 0:
+                        Lower = [Item.minbound for Item in spot_setup.AllParams]
+                        Upper = [Item.maxbound for Item in spot_setup.AllParams]
+                        if spot_setup.Cache is not None:
+                            CacheStats = spot_setup.Cache.Stats()
+
+                    if len(Phases) > 1:
+                        print('Fidelity phase %d/%d - x%d - %d evaluations' % (Phase + 1, len(Phases), Factor, PhaseSim))
+                    if spot_setup.Convergence is not None:
+                        spot_setup.Convergence.Start()
+                    try:
+                        # Refinamiento: los mejores candidatos de la fase anterior se evalúan con InVEST (sin el
+                        # sustituto) en la fidelidad de esta fase y cuentan para el sustituto y los criterios de parada
+                        for x in Best:
+                            spot_setup.objectivefunction(spot_setup.simulation(x[spot_setup.Free], Screen=False),
+                                                         spot_setup.evaluation())
+                        # DDS parte del mejor candidato de la fase anterior
+                        if NameOpt == "Dynamical dimensional search (DDS)" and len(Best) > 0:
+                            sampler.sample(PhaseSim, x_initial=Best[0][spot_setup.Free])
+                        else:
+                            sampler.sample(PhaseSim)
+                    except Stop_Calibration as e:
+                        Stop = str(e)
+                        # En paralelo spotpy ya envió al pool las evaluaciones pendientes y su terminate no hace nada:
+                        # se detienen los procesos (clear lo saca de la caché de pathos para la siguiente calibración)
+                        Pool = getattr(sampler.repeat, 'pool', None)
+                        if Pool is not None:
+                            Pool.terminate()
+                            Pool.clear()
+                        # Cierra la base de datos de spotpy que sample no alcanzó a cerrar
+                        sampler.final_call()
+                        break
+                    else:
+                        results.append(sampler.getdata())
+                    finally:
+                        # Evaluaciones hechas hasta una parada (se reutilizan al reanudar)
+                        spot_setup.Store.Flush()
+
+                    # Mejores candidatos y límites de la fase siguiente
+                    if Phase < len(Phases) - 1:
+                        Results = Read_Results(PathStore, Checkpoint['FirstId'], Factor, Screening=False)
+                        Best    = Top_Candidates(Results['Params'], FactorMetric*Results['Metric'], TopK)
+                        Bounds  = Narrow_Bounds(Best, Lower, Upper)
+            finally:
+                if Monitor is not None:
+                    Monitor.Stop()
+                # Los workspaces de la carpeta rápida y los modelos sustitutos no se necesitan para reanudar
+                Remove_Scratch(ScratchRoot)
+                for Item in Surrogates:
+                    Item.Remove()
+
+            # Resumen de la caché de evaluaciones en esta calibración
+            if spot_setup.Cache is not None:
+                Stats = spot_setup.Cache.Stats()
+                print('Evaluation cache - hits: %d | misses: %d | evictions: %d | entries: %d (%0.1f MB)' %
+                      (Stats['hits'] - CacheStats['hits'], Stats['misses'] - CacheStats['misses'],
+                       Stats['evictions'] - CacheStats['evictions'], Stats['entries'], Stats['bytes']/2**20))
+
+            # Escribe las evaluaciones pendientes y cierra el punto de control con el motivo de la parada
+            spot_setup.Store.Flush()
+            # Espacio en disco de los workspaces de InVEST en esta calibración (Prune_Workspace)
+            Workspace_Summary(PathStore, NameModel, Checkpoint['FirstId'], WorkspaceMaxMB)
+            StopInfo = {'reason': Stop, 'first_id': Checkpoint['FirstId']}
+            if spot_setup.Convergence is not None:
+                StopInfo.update(spot_setup.Convergence.State())
+            print('Calibration stopped - ' + Stop)
+            # Ahorro del tamizado: evaluaciones del tamizado y de la calibración con el espacio reducido
+            if ScreenInfo is not None:
+                StopInfo['screening_evaluations']   = ScreenInfo['evaluations']
+                StopInfo['calibration_evaluations'] = len(Read_Results(PathStore, Checkpoint['FirstId'],
+                                                                       Screening=False)['Metric'])
+                print('Sensitivity screening - %d screening + %d calibration evaluations with %d of %d parameters '
+                      '(NumSim %d)' % (StopInfo['screening_evaluations'], StopInfo['calibration_evaluations'],
+                                       ScreenInfo['free'], ScreenInfo['parameters'], rep))
+            # Candidatos del optimizador que el sustituto resolvió sin ejecutar InVEST (todas las fases)
+            if Surrogates:
+                Real        = sum(Item.Real for Item in Surrogates)
+                Predicted   = sum(Item.Predicted for Item in Surrogates)
+                StopInfo['surrogate'] = {'candidates': Real + Predicted, 'invest_runs': Real, 'predicted': Predicted}
+                print('Surrogate - %d candidates | %d InVEST runs | %d predicted (%0.1fx fewer runs)' %
+                      (Real + Predicted, Real, Predicted, (Real + Predicted) / max(Real, 1)))
+            spot_setup.Store.Set_Meta('stop', StopInfo)
+            Checkpoint['Status'] = 'done'
+            Checkpoint['Stop']   = StopInfo
+            Write_Checkpoint(PathCheckpoint, Checkpoint)
+
+            # Exporta los CSV de EVALUATIONS
+            Export_Evaluations(ProjectPath, NameModel, Inputs.loc['Name', 'Value'])
+            # Tiempos por etapa de esta calibración (también las evaluaciones anteriores a una reanudación)
+            Export_Timing(ProjectPath, NameModel, Inputs.loc['Name', 'Value'], Checkpoint['FirstId'])
+            # Pilas colapsadas de las evaluaciones perfiladas (PARAMETERS/profiles/<Modelo>_Profile.collapsed)
+            if ProfileEvery:
+                Merge_Profiles(ProjectPath, NameModel)
+
+            # Elimina los workspaces temporales de los procesos en paralelo
+            if parallel != "seq":
+                shutil.rmtree(os.path.join(ProjectPath, 'TMP', 'WORKERS'), ignore_errors=True)
 
             # Plot Results
             if NameFunObj == "Mean Square Error (MSE)":
@@ -146,18 +399,18 @@ def RunCalInVEST(ProjectPath, InVEST_Main_Path, NameFunObj, NameOpt, NumSim=5):
 
             # Gráficas de resultados (Scatter Plot)
             if NameModel == 'AWY':
-                Plot_AWY(ProjectPath, Inputs.loc['Name', 'Value'], FO, InVEST_Main_Path, FactorMetric)
+                Plot_AWY(ProjectPath, Inputs.loc['Name', 'Value'], FO, Config.Path, FactorMetric)
             if NameModel == 'SWY':
-                Plot_SWY(ProjectPath, Inputs.loc['Name', 'Value'], FO, InVEST_Main_Path, FactorMetric)
+                Plot_SWY(ProjectPath, Inputs.loc['Name', 'Value'], FO, Config.Path, FactorMetric)
             if NameModel == 'SDR':
-                Plot_SDR(ProjectPath, Inputs.loc['Name', 'Value'], FO, InVEST_Main_Path, FactorMetric)
+                Plot_SDR(ProjectPath, Inputs.loc['Name', 'Value'], FO, Config.Path, FactorMetric)
             if NameModel == 'NDR_N':
-                Plot_NDR_N(ProjectPath, Inputs.loc['Name', 'Value'], FO, InVEST_Main_Path, FactorMetric)
+                Plot_NDR_N(ProjectPath, Inputs.loc['Name', 'Value'], FO, Config.Path, FactorMetric)
             if NameModel == 'NDR_P':
-                Plot_NDR_P(ProjectPath, Inputs.loc['Name', 'Value'], FO, InVEST_Main_Path, FactorMetric)
+                Plot_NDR_P(ProjectPath, Inputs.loc['Name', 'Value'], FO, Config.Path, FactorMetric)
 
-            # Execution Model whith best parameters
-            RunInVEST(ProjectPath, InVEST_Main_Path)
+            # Execution Model whith best parameters (los Plot_* escriben los parámetros en el libro, que se lee de nuevo)
+            RunInVEST(ProjectPath, Config.Path, TaskWorkers=TaskWorkers, MonitorInterval=MonitorInterval, MinFreeMB=MinFreeMB)
 
             print('#################################################')
             print('   //////////   ')
@@ -171,6 +424,73 @@ def RunCalInVEST(ProjectPath, InVEST_Main_Path, NameFunObj, NameOpt, NumSim=5):
             print('successful calibration - ' + NameModel)
             print('#################################################')
 
+def Screen_Parameters(ProjectPath, Config, NameModel, NameFunObj, FactorMetric, NameOpt, Seed, FirstId,
+                      ScreeningSim=None, Threshold=0.05, Fidelity=1, TaskWorkers=-1, Options={}, Complexes=None):
+    """
+    Tamizado de sensibilidad global con FAST (spotpy.algorithms.fast) sobre todos los parámetros del modelo, con el
+    error de la función objetivo como respuesta. Las evaluaciones se guardan en el almacén marcadas como tamizado
+    (se reutilizan al reanudar y no entran en los CSV ni en las gráficas). Escribe los índices S1 y ST, el orden y
+    los parámetros fijos en EVALUATIONS/<Model>_Sensitivity_<Name>.csv.
+    Los parámetros con Min = Max no se tamizan y quedan fijos en ese valor; con menos de dos parámetros con rango no
+    se hace el tamizado (retorna {}, None).
+    Retorna {posición: Value del libro} de los parámetros con ST < Threshold y el resumen del tamizado.
+    """
+    Suffix      = Config.UserData['Suffix']
+    PathStore   = Results_Path(ProjectPath, NameModel, Suffix)
+    # FAST necesita las evaluaciones en el orden de su matriz ('mpc' conserva el orden)
+    parallel    = Parallel_Mode("Fourier Amplitude Sensitivity Test (FAST)", Options.get('NumWorkers', 1))
+
+    # Los parámetros con rango nulo (Min = Max) no se tamizan: quedan fijos en ese valor
+    AllParams   = Parameters_Model(NameModel, Config.ParamsMin, Config.ParamsMax)
+    Names       = [Item.name for Item in AllParams]
+    Lower       = np.array([Item.minbound for Item in AllParams], dtype=float)
+    Upper       = np.array([Item.maxbound for Item in AllParams], dtype=float)
+    Constant    = {int(i): float(Lower[i]) for i in np.flatnonzero(Lower >= Upper)}
+    Free        = Lower < Upper
+    if Free.sum() < 2:
+        print('Sensitivity screening - skipped: %s has fewer than two parameters with a range' % NameModel)
+        return {}, None
+
+    np.random.seed(Seed)
+    spot_setup  = Spotpy_InVEST(ProjectPath, Config, NameModel, NameFunObj, FactorMetric, Fidelity=Fidelity,
+                                Fixed=Constant, Screening=True,
+                                TaskWorkers=Task_Workers(Options.get('NumWorkers', 1) if parallel != "seq" else 1,
+                                                         TaskWorkers),
+                                **Options)
+    spot_setup.Replay = Read_Replay(PathStore, FirstId, Fidelity, Screening=True)
+    sampler     = FAST(spot_setup, parallel=parallel, dbformat="csv", random_state=Seed,
+                       dbname=os.path.join(ProjectPath, 'PARAMETERS', NameModel + '_FAST'))
+
+    NumSim      = Screening_Sim(int(Free.sum()), ScreeningSim)
+    print('Sensitivity screening (FAST) - %d parameters - %d evaluations%s' %
+          (Free.sum(), NumSim, '' if spot_setup.Fidelity == 1 else ' - x%d' % spot_setup.Fidelity))
+    try:
+        sampler.sample(NumSim)
+    finally:
+        spot_setup.Store.Flush()
+
+    # Índices de sensibilidad (0 para los de rango nulo) y parámetros que se fijan en su Value del libro
+    Indices = FAST_Indices(sampler, Lower[Free], Upper[Free], list(np.array(Names)[Free]),
+                           FactorMetric*sampler.getdata()['like1'])
+    Indices = Indices.set_index('Parameter').reindex(Names, fill_value=0.0).reset_index()
+    Values  = [Constant.get(i, Config.Params[Key]) for i, Key in enumerate(ModelParams[NameModel])]
+    Table, Fixed = Select_Parameters(Indices, Values, Threshold)
+    Table.to_csv(os.path.join(ProjectPath, 'EVALUATIONS', NameModel + '_Sensitivity_' + Suffix + '.csv'),
+                 index=False)
+    print(Table[['Rank', 'Parameter', 'S1', 'ST', 'Status', 'Value']].to_string(index=False, float_format='%0.4f'))
+
+    # Ahorro: dimensión del optimizador y, para SCE-UA, tamaño de la población inicial
+    Info = {'method': 'FAST', 'evaluations': NumSim, 'threshold': Threshold, 'parameters': len(Names),
+            'free': len(Names) - len(Fixed), 'fixed': {Names[i]: Value for i, Value in Fixed.items()},
+            'indices': Indices.set_index('Parameter')[['S1', 'ST']].to_dict('index')}
+    print('Sensitivity screening - %d of %d parameters fixed (ST < %g)%s' %
+          (len(Fixed), len(Names), Threshold,
+           '' if not Population_Size(NameOpt, len(Names)) else ' - SCE-UA initial population %d -> %d evaluations' %
+           (Population_Size(NameOpt, len(Names), Complexes), Population_Size(NameOpt, Info['free'], Complexes))))
+    spot_setup.Store.Set_Meta('screening', Info)
+
+    return Fixed, Info
+
 def Create_argsInVEST(ProjectPath,UserData,Params,StatusK='SDR'):
     # ----------------------------------------------------------------------------------------------------------------------
     # Capas de entrada para modelos InVEST
@@ -210,6 +530,8 @@ def Create_argsInVEST(ProjectPath,UserData,Params,StatusK='SDR'):
     args['do_redd']                         = False
     args['do_valuation']                    = False
     args['flow_dir_algorithm']              = 'MFD'
+    # Procesos de taskgraph dentro de cada ejecución de InVEST (-1 = en el mismo proceso)
+    args['n_workers']                       = UserData.get('TaskWorkers', -1)
 
     # AWY
     if StatusK == "AWY":
@@ -247,6 +569,17 @@ def Create_argsInVEST(ProjectPath,UserData,Params,StatusK='SDR'):
 
     return args
 
+def Input_Rasters(ProjectPath, UserData):
+    # Rásteres de entrada de los modelos (los que se remuestrean en las pirámides de Fidelity_InVEST; el DEM primero)
+    # y los categóricos
+    args    = Create_argsInVEST(ProjectPath, UserData, {}, StatusK=None)
+    Rasters = [args['dem_path']] + [Path for Path in args.values() if isinstance(Path, str) and
+                                    Path.lower().endswith('.tif') and Path != args['dem_path']]
+    for Folder in [args['precip_dir'], args['et0_dir']]:
+        if os.path.isdir(Folder):
+            Rasters += [os.path.join(Folder, Name) for Name in os.listdir(Folder) if Name.lower().endswith('.tif')]
+    return Rasters, [args['lulc_path'], args['soil_group_path']]
+
 def Factor_BioTable(PathBioTable, Params, UserData):
     # --------------------------------------------------------------------------------------------------------------
     # Read Biophycial Table
@@ -346,7 +679,27 @@ def Factor_BioTable(PathBioTable, Params, UserData):
 
     return Table
 
-def RunInVEST(ProjectPath, InVEST_Main_Path, BatchMode=False):
+# ----------------------------------------------------------------------------------------------------------------------
+# Carpeta de salida de cada modelo en OUTPUTS
+# ----------------------------------------------------------------------------------------------------------------------
+ModelFolder = {'AWY'    : '01-AWY',
+               'SWY'    : '02-SWY',
+               'SDR'    : '03-SDR',
+               'NDR_N'  : '04-NDR_N',
+               'NDR_P'  : '04-NDR_P'}
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Salidas de InVEST que lee cada Execute_* en la calibración (relativas a workspace_dir, {Suffix} de UserData). Lo
+# demás puede borrarse después de cada evaluación (Prune_Workspace)
+# ----------------------------------------------------------------------------------------------------------------------
+NeededOutputs = {'AWY'  : [os.path.join('output', 'watershed_results_wyield_{Suffix}.csv')],
+                 'SWY'  : [os.path.join('intermediate_outputs', 'aet_{Suffix}.tif')],
+                 'SDR'  : ['watershed_results_sdr_{Suffix}.dbf'],
+                 'NDR_N': ['n_total_export_{Suffix}.tif'],
+                 'NDR_P': ['p_surface_export_{Suffix}.tif']}
+
+def RunInVEST(ProjectPath, InVEST_Main_Path, BatchMode=False, NumWorkers=1, TaskWorkers=-1, MonitorInterval=30,
+              MinFreeMB=None):
     """
 
     Parameters
@@ -354,23 +707,37 @@ def RunInVEST(ProjectPath, InVEST_Main_Path, BatchMode=False):
     ProjectPath
         Path project
     InVEST_Main_Path
-        Path Main Project
+        Path Main Project (o ProjectConfig)
+    BatchMode
+        Ejecuta todos los escenarios de la hoja LULC_Batch
+    NumWorkers
+        Número de trabajos (escenario x modelo) que se ejecutan en paralelo en modo batch
+    TaskWorkers
+        Procesos de taskgraph en cada ejecución de InVEST ('auto' reparte los núcleos entre los trabajos)
+    MonitorInterval
+        Segundos entre muestras del monitor de recursos (OUTPUTS/RunInVEST_Monitor.csv); None lo desactiva
+    MinFreeMB
+        Espacio libre mínimo en OUTPUTS y TMP; por debajo los trabajos que no han empezado no se ejecutan (None no
+        detiene la ejecución)
     Returns
     -------
-
+    Tabla con el estado de cada trabajo (LULC, Model, Status, Time_s, Error)
     """
     # ----------------------------------------------------------------------------------------------------------------------
     # Directorio de trabajo
     # ----------------------------------------------------------------------------------------------------------------------
     CreateFolder(os.path.join(ProjectPath, 'OUTPUTS'))
 
+    Config      = Load_Config(InVEST_Main_Path, ProjectPath)
+
     # Read parameters
-    Params      = Read_Parameters_InVEST(InVEST_Main_Path)
+    Params      = dict(Config.Params)
 
     print('Load Parameters - Ok')
 
     # Read user Data
-    UserData    = Read_Inputs_InVEST(InVEST_Main_Path)
+    UserData    = dict(Config.UserData)
+    UserData['TaskWorkers'] = Task_Workers(NumWorkers if BatchMode else 1, TaskWorkers)
 
     print('Load Inputs - Ok')
 
@@ -378,399 +745,303 @@ def RunInVEST(ProjectPath, InVEST_Main_Path, BatchMode=False):
     # Read List LULC
     # ----------------------------------------------------------------------------------------------------------------------
     if BatchMode:
-        Tmp         = pd.read_excel(InVEST_Main_Path, sheet_name='LULC_Batch')
-        List_LULC   = Tmp['Name LULC']
+        if Config.LULC_Batch is None:
+            raise ValueError('Batch mode requires the LULC_Batch sheet in ' + Config.Path)
+        List_LULC   = list(Config.LULC_Batch['Name LULC'])
     else:
         List_LULC   = [UserData['LULC']]
 
-    for LULC in List_LULC:
-        NL  = os.path.join(ProjectPath, 'INPUTS', 'LULC', LULC + '.tif')
-
-        print('----------------------------')
-        print('Execution used: ' + LULC)
-        print('----------------------------')
-
-        NameModel = ''
-
-        # --------------------------------------------------------------------------------------------------------------
-        # Read Biophycial Table
-        # --------------------------------------------------------------------------------------------------------------
-        PathBioTable = os.path.join(ProjectPath, 'INPUTS', UserData['BioTable'] + '.csv')
+    # ----------------------------------------------------------------------------------------------------------------------
+    # Tablas biofísicas con los factores calibrados. Son iguales para todos los escenarios, por eso se escriben una
+    # sola vez antes de lanzar los trabajos (que solo las leen)
+    # ----------------------------------------------------------------------------------------------------------------------
+    # Descarta las etapas registradas antes de esta ejecución
+    Take_Stages()
+    PathBioTable    = os.path.join(ProjectPath, 'INPUTS', UserData['BioTable'] + '.csv')
+    with Stage('Factor_BioTable'):
+        Table       = Factor_BioTable(PathBioTable, Params, UserData)
+    NameModels      = [Name for Name in ModelFolder if UserData['Status_' + Name] == 1]
+    for NameModel in NameModels:
+        with Stage('to_csv'):
+            Table.to_csv(os.path.join(ProjectPath, 'INPUTS', UserData['BioTable'] + '_Execution_' + NameModel + '.csv'),
+                         index=False)
 
-        # Anual Water Yield
-        if UserData['Status_AWY'] == 1:
-            print('----------------------------')
-            print('Run AWY')
-            print('----------------------------')
+    # --------------------------------------------------------------------------------------------------------------
+    # Trabajos (escenario x modelo). En modo batch cada trabajo escribe en OUTPUTS/<Modelo>/<LULC> para que los
+    # escenarios no se sobrescriban entre sí
+    # --------------------------------------------------------------------------------------------------------------
+    Jobs = []
+    for LULC in List_LULC:
+        for NameModel in NameModels:
+            Workspace = os.path.join(ProjectPath, 'OUTPUTS', ModelFolder[NameModel])
+            if BatchMode:
+                Workspace = os.path.join(Workspace, LULC)
+            Jobs.append((ProjectPath, UserData, Params, NameModel, LULC, Workspace))
+
+    Monitor = None
+    if MonitorInterval:
+        Monitor = Resource_Monitor(ProjectPath, os.path.join(ProjectPath, 'OUTPUTS', 'RunInVEST_Monitor.csv'),
+                                   {'OUTPUTS'   : os.path.join(ProjectPath, 'OUTPUTS'),
+                                    'TMP'       : os.path.join(ProjectPath, 'TMP')},
+                                   MonitorInterval, MinFreeMB).Start()
+    try:
+        if BatchMode and int(NumWorkers) > 1 and len(Jobs) > 1:
+            Status = Run_Jobs_Parallel(Jobs, int(NumWorkers))
+        else:
+            Status = [Execute_Job(*Job) for Job in Jobs]
+    finally:
+        if Monitor is not None:
+            Monitor.Stop()
 
-            # Aplicar factores a la tabla biofisica
-            Table = Factor_BioTable(PathBioTable, Params, UserData)
+    # --------------------------------------------------------------------------------------------------------------
+    # Guardar Table Biofisica final
+    # --------------------------------------------------------------------------------------------------------------
+    PathTable = os.path.join(ProjectPath, 'INPUTS', UserData['BioTable'] + '_Execution_Total.csv')
+    Table.to_csv(PathTable, index=False)
 
-            # --------------------------------------------------------------------------------------------------------------
-            # Guardar Table Biofisica temporal
-            # --------------------------------------------------------------------------------------------------------------
-            PathTable = os.path.join(ProjectPath, 'INPUTS', UserData['BioTable'] + '_Execution_AWY' + '.csv')
-            Table.to_csv(PathTable, index=False)
+    # --------------------------------------------------------------------------------------------------------------
+    # Tiempos por etapa de los trabajos y traza en OUTPUTS/RunInVEST_Trace.json (chrome://tracing o ui.perfetto.dev)
+    # --------------------------------------------------------------------------------------------------------------
+    Records = [Row[5] for Row in Status if Row[5] is not None] + [(os.getpid(), Take_Stages())]
+    Write_Trace(os.path.join(ProjectPath, 'OUTPUTS', 'RunInVEST_Trace.json'), Records)
+    print('Stage timing - RunInVEST')
+    print(Stage_Summary([Spans for _, Spans in Records]).to_string(float_format='%0.2f'))
 
-            # Create args
-            args = Create_argsInVEST(ProjectPath, UserData, Params, StatusK="AWY")
+    # --------------------------------------------------------------------------------------------------------------
+    # Estado de los trabajos
+    # --------------------------------------------------------------------------------------------------------------
+    Status = pd.DataFrame([Row[:5] for Row in Status], columns=['LULC', 'Model', 'Status', 'Time_s', 'Error'])
+    if BatchMode:
+        Status.to_csv(os.path.join(ProjectPath, 'OUTPUTS', 'Batch_Status.csv'), index=False)
 
-            # LULC
-            args['lulc_path']           = NL
-            args['lulc_raster_path']    = NL
-            args['lulc_cur_path']       = NL
+    for LULC in List_LULC:
+        Tmp         = Status[Status['LULC'] == LULC]
+        Failed      = Tmp[Tmp['Status'] != 'ok']
+        NameModel   = ''.join('| ' + Name + ' |' for Name in Tmp['Model'])
+        print('#################################################')
+        if len(Failed) > 0:
+            for Name, Error in zip(Failed['Model'], Failed['Error']):
+                print('failed execution - ' + Name + ' LULC: ' + LULC)
+                print(Error)
+        else:
+            print('   //////////   ')
+            print('   |        |   ')
+            print('  _|  _   _ |_  ')
+            print(' |.|-(.)-(.)+.| ')
+            print('  \\|    J   |/  ')
+            print('   \\   ---  /   ')
+            print('    \\      /    ')
+            print('     "####"     ')
+            print('successful execution - ' + NameModel + ' LULC: ' + LULC)
+        print('#################################################')
 
-            # Biophysical Table Path
-            args['biophysical_table_path']  = PathTable
+    # Fuera del modo batch un error se propaga como antes (la interfaz lo reporta)
+    if not BatchMode and (Status['Status'] != 'ok').any():
+        raise RuntimeError('InVEST execution failed: ' + ', '.join(Status.loc[Status['Status'] != 'ok', 'Model']))
 
-            # Project Path
-            args['workspace_dir']           = os.path.join(ProjectPath, 'OUTPUTS', '01-AWY')
+    return Status
 
-            # Run AWY
-            awy.execute(args)
+def Run_Jobs_Parallel(Jobs, NumWorkers):
+    """
+    Ejecuta los trabajos de RunInVEST en un pool de procesos. Un error de InVEST en un trabajo queda registrado en su
+    estado sin detener a los demás. Si un proceso muere (memoria, GDAL) el pool se rompe y los trabajos que no
+    terminaron se lanzan de nuevo en un pool nuevo, una sola vez; si fallan otra vez quedan como 'failed'.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from concurrent.futures.process import BrokenProcessPool
+
+    Status  = {}
+    Pending = list(range(len(Jobs)))
+    for Attempt in range(2):
+        Broken = []
+        # Un proceso por trabajo: la memoria de GDAL/taskgraph se libera al terminar cada escenario
+        with ProcessPoolExecutor(max_workers=min(NumWorkers, len(Pending)), max_tasks_per_child=1) as Pool:
+            Futures = {Pool.submit(Execute_Job, *Jobs[i]): i for i in Pending}
+            for Future in as_completed(Futures):
+                i = Futures[Future]
+                try:
+                    Status[i] = Future.result()
+                except BrokenProcessPool:
+                    Broken.append(i)
+                    Status[i] = (Jobs[i][4], Jobs[i][3], 'failed', np.nan, 'worker process terminated abruptly', None)
+                except Exception as e:
+                    Status[i] = (Jobs[i][4], Jobs[i][3], 'failed', np.nan, repr(e), None)
+                print('Job %d/%d - %s - %s: %s' % (len(Status), len(Jobs), Jobs[i][4], Jobs[i][3], Status[i][2]))
+        if not Broken:
+            break
+        Pending = sorted(Broken)
+        print('Retrying %d jobs after a worker process terminated' % len(Pending))
+
+    return [Status[i] for i in range(len(Jobs))]
+
+def Execute_Job(ProjectPath, UserData, Params, NameModel, LULC, Workspace):
+    """
+    Ejecuta un modelo de InVEST para un escenario de uso del suelo en su propio workspace.
+    Retorna (LULC, Model, Status, Time_s, Error, (pid, etapas)); los errores no se propagan para no detener el batch.
+    """
+    import traceback
 
-            # Name model
-            NameModel = NameModel + '| AWY |'
+    StartTime = time.time()
+    try:
+        # Parada del monitor de recursos (poco espacio en disco)
+        Check_Abort(ProjectPath)
 
-        # Seasonal Water Yield
-        if UserData['Status_SWY'] == 1:
-            print('----------------------------')
-            print('Run SWY')
-            print('----------------------------')
+        print('----------------------------')
+        print('Run ' + NameModel + ' - LULC: ' + LULC)
+        print('----------------------------')
 
-            # Aplicar factores a la tabla biofisica
-            Table = Factor_BioTable(PathBioTable, Params, UserData)
+        CreateFolder(Workspace)
+        NL = os.path.join(ProjectPath, 'INPUTS', 'LULC', LULC + '.tif')
 
-            # --------------------------------------------------------------------------------------------------------------
-            # Guardar Table Biofisica temporal
-            # --------------------------------------------------------------------------------------------------------------
-            PathTable = os.path.join(ProjectPath, 'INPUTS', UserData['BioTable'] + '_Execution_SWY' + '.csv')
-            Table.to_csv(PathTable, index=False)
+        # Create args
+        args = Create_argsInVEST(ProjectPath, UserData, Params, StatusK=NameModel)
 
-            # Create args
-            args = Create_argsInVEST(ProjectPath, UserData, Params, StatusK="SWY")
+        # LULC
+        args['lulc_path']           = NL
+        args['lulc_raster_path']    = NL
+        args['lulc_cur_path']       = NL
 
-            # LULC
-            args['lulc_path']           = NL
-            args['lulc_raster_path']    = NL
-            args['lulc_cur_path']       = NL
+        # Biophysical Table Path
+        args['biophysical_table_path']  = os.path.join(ProjectPath, 'INPUTS', UserData['BioTable'] + '_Execution_' + NameModel + '.csv')
 
-            # Biophysical Table Path
-            args['biophysical_table_path']  = PathTable
+        # Project Path
+        args['workspace_dir']           = Workspace
 
-            # Project Path
-            args['workspace_dir']           = os.path.join(ProjectPath, 'OUTPUTS', '02-SWY')
+        Watershed = os.path.join(ProjectPath, 'INPUTS', 'Basin', UserData['Basin'] + '.shp')
 
-            # Run SWY
-            swy.execute(args)
+        # Anual Water Yield
+        if NameModel == 'AWY':
+            with Stage('awy.execute'):
+                awy.execute(args)
 
-            # Model
-            NameModel = NameModel + '| SWY |'
+        # Seasonal Water Yield
+        elif NameModel == 'SWY':
+            with Stage('swy.execute'):
+                swy.execute(args)
 
             # ETR zonal
-            raster_path = os.path.join(ProjectPath, 'OUTPUTS', '02-SWY', 'intermediate_outputs','aet_' + UserData['Suffix'] + '.tif')
-            Watershed   = os.path.join(ProjectPath, 'INPUTS', 'Basin', UserData['Basin'] + '.shp')
-            output_path = os.path.join(ProjectPath, 'OUTPUTS', '02-SWY')
-            calculate_zonal_stats(Watershed, raster_path, output_path, Suffix=LULC + "_SWY")
+            raster_path = os.path.join(Workspace, 'intermediate_outputs', 'aet_' + UserData['Suffix'] + '.tif')
+            with Stage('calculate_zonal_stats'):
+                calculate_zonal_stats(Watershed, raster_path, Workspace, Suffix=LULC + "_SWY")
 
         # Sediment Delivery Ratio
-        if UserData['Status_SDR'] == 1:
-            print('----------------------------')
-            print('Run SDR')
-            print('----------------------------')
-
-            # Aplicar factores a la tabla biofisica
-            Table = Factor_BioTable(PathBioTable, Params, UserData)
-
-            # --------------------------------------------------------------------------------------------------------------
-            # Guardar Table Biofisica temporal
-            # --------------------------------------------------------------------------------------------------------------
-            PathTable = os.path.join(ProjectPath, 'INPUTS', UserData['BioTable'] + '_Execution_SDR' + '.csv')
-            Table.to_csv(PathTable, index=False)
-
-            # Create args
-            args = Create_argsInVEST(ProjectPath, UserData, Params, StatusK='SDR')
-
-            # LULC
-            args['lulc_path']           = NL
-            args['lulc_raster_path']    = NL
-            args['lulc_cur_path']       = NL
-
-            # Biophysical Table Path
-            args['biophysical_table_path']  = PathTable
-
-            # Project Path
-            args['workspace_dir']           = os.path.join(ProjectPath, 'OUTPUTS', '03-SDR')
-
-            # Run SDR
-            sdr.execute(args)
-
-            # Model
-            NameModel = NameModel + '| SDR |'
-
-        # Nutrient Delivery Ratio
-        if (UserData['Status_NDR_N'] == 1):
-            print('----------------------------')
-            print('Run NDR_N')
-            print('----------------------------')
-
-            # Aplicar factores a la tabla biofisica
-            Table = Factor_BioTable(PathBioTable, Params, UserData)
-
-            # --------------------------------------------------------------------------------------------------------------
-            # Guardar Table Biofisica temporal
-            # --------------------------------------------------------------------------------------------------------------
-            PathTable = os.path.join(ProjectPath, 'INPUTS', UserData['BioTable'] + '_Execution_NDR_N' + '.csv')
-            Table.to_csv(PathTable, index=False)
-
-            # Create args
-            args = Create_argsInVEST(ProjectPath, UserData, Params, StatusK='NDR_N')
-
-            # LULC
-            args['lulc_path']           = NL
-            args['lulc_raster_path']    = NL
-            args['lulc_cur_path']       = NL
-
-            # Biophysical Table Path
-            args['biophysical_table_path']  = PathTable
-
-            # Project Path
-            args['workspace_dir']           = os.path.join(ProjectPath, 'OUTPUTS', '04-NDR_N')
+        elif NameModel == 'SDR':
+            with Stage('sdr.execute'):
+                sdr.execute(args)
 
-            # run NDR
-            ndr.execute(args)
+        # Nutrient Delivery Ratio - Nitrogen
+        elif NameModel == 'NDR_N':
+            with Stage('ndr.execute'):
+                ndr.execute(args)
 
             # Zonal nitgrogen
-            raster_path = os.path.join(ProjectPath, 'OUTPUTS', '04-NDR_N', 'n_total_export_' + UserData['Suffix'] + '.tif')
-            Watershed   = os.path.join(ProjectPath, 'INPUTS',  'Basin', UserData['Basin'] + '.shp')
-            output_path = os.path.join(ProjectPath, 'OUTPUTS', '04-NDR_N')
-            calculate_zonal_stats(Watershed, raster_path, output_path, Suffix=LULC + "_NDR_N")
-
-            NameModel = NameModel + '| NDR_N |'
-
-        # Nutrient Delivery Ratio
-        if (UserData['Status_NDR_P'] == 1):
-            print('----------------------------')
-            print('Run NDR_P')
-            print('----------------------------')
-
-            # Aplicar factores a la tabla biofisica
-            Table = Factor_BioTable(PathBioTable, Params, UserData)
-
-            # --------------------------------------------------------------------------------------------------------------
-            # Guardar Table Biofisica temporal
-            # --------------------------------------------------------------------------------------------------------------
-            PathTable = os.path.join(ProjectPath, 'INPUTS', UserData['BioTable'] + '_Execution_NDR_P' + '.csv')
-            Table.to_csv(PathTable, index=False)
-
-            # Create args
-            args = Create_argsInVEST(ProjectPath, UserData, Params, StatusK='NDR_P')
+            raster_path = os.path.join(Workspace, 'n_total_export_' + UserData['Suffix'] + '.tif')
+            with Stage('calculate_zonal_stats'):
+                calculate_zonal_stats(Watershed, raster_path, Workspace, Suffix=LULC + "_NDR_N")
 
-            # LULC
-            args['lulc_path']           = NL
-            args['lulc_raster_path']    = NL
-            args['lulc_cur_path']       = NL
-
-            # Biophysical Table Path
-            args['biophysical_table_path']  = PathTable
-
-            # Project Path
-            args['workspace_dir']           = os.path.join(ProjectPath, 'OUTPUTS', '04-NDR_P')
-
-            # run NDR
-            ndr.execute(args)
+        # Nutrient Delivery Ratio - Phosphorus
+        elif NameModel == 'NDR_P':
+            with Stage('ndr.execute'):
+                ndr.execute(args)
 
             # zonal Phosphorus
-            raster_path = os.path.join(ProjectPath, 'OUTPUTS', '04-NDR_P','p_surface_export_' + UserData['Suffix'] + '.tif')
-            Watershed   = os.path.join(ProjectPath, 'INPUTS', 'Basin', UserData['Basin'] + '.shp')
-            output_path = os.path.join(ProjectPath, 'OUTPUTS', '04-NDR_P')
-            calculate_zonal_stats(Watershed, raster_path, output_path, Suffix=LULC + "_NDR_P")
-
-            NameModel = NameModel + '| NDR_P |'
-
-        """
-        # Carbons
-        if UserData['Status_CO2'] == 1:
-            print('----------------------------')
-            print('Run CO2')
-            print('----------------------------')
-
-            # Aplicar factores a la tabla biofisica
-            Table = Factor_BioTable(PathBioTable, Params, UserData)
-
-            # --------------------------------------------------------------------------------------------------------------
-            # Guardar Table Biofisica temporal
-            # --------------------------------------------------------------------------------------------------------------
-            PathTable = os.path.join(ProjectPath, 'INPUTS', UserData['BioTable'] + '_Execution_CO2' + '.csv')
-            Table.to_csv(PathTable, index=False)
-
-            # Create args
-            args                        = Create_argsInVEST(ProjectPath, UserData, Params, StatusK="CO2")
+            raster_path = os.path.join(Workspace, 'p_surface_export_' + UserData['Suffix'] + '.tif')
+            with Stage('calculate_zonal_stats'):
+                calculate_zonal_stats(Watershed, raster_path, Workspace, Suffix=LULC + "_NDR_P")
 
-            # LULC
-            args['lulc_path']           = NL
-            args['lulc_raster_path']    = NL
-            args['lulc_cur_path']       = NL
+        Status = (LULC, NameModel, 'ok', time.time() - StartTime, '')
 
-            # Biophysical Table Path
-            args['carbon_pools_path']   = PathTable
+    except Exception:
+        Status = (LULC, NameModel, 'failed', time.time() - StartTime, traceback.format_exc())
 
-            # Project Path
-            args['workspace_dir']       = os.path.join(ProjectPath, 'OUTPUTS', '05-CO2')
-
-            # Run CO2
-            carbon.execute(args)
-
-            # zonal Phosphorus
-            raster_path = os.path.join(ProjectPath, 'OUTPUTS', '05-CO2','tot_c_cur_' + UserData['Suffix'] + '.tif')
-            Watershed   = os.path.join(ProjectPath, 'INPUTS', 'Basin', UserData['Basin'] + '.shp')
-            output_path = os.path.join(ProjectPath, 'OUTPUTS', '05-CO2')
-            calculate_zonal_stats(Watershed, raster_path, output_path, Suffix=LULC + "_CO2")
-
-            NameModel = NameModel + '| CO2 |'
-        """
-
-        # --------------------------------------------------------------------------------------------------------------
-        # Guardar Table Biofisica final
-        # --------------------------------------------------------------------------------------------------------------
-        # Aplicar factores a la tabla biofisica
-        Table = Factor_BioTable(PathBioTable, Params, UserData)
-        PathTable = os.path.join(ProjectPath, 'INPUTS', UserData['BioTable'] + '_Execution_Total.csv')
-        Table.to_csv(PathTable, index=False)
-
-        print('#################################################')
-        print('   //////////   ')
-        print('   |        |   ')
-        print('  _|  _   _ |_  ')
-        print(' |.|-(.)-(.)+.| ')
-        print('  \\|    J   |/  ')
-        print('   \\   ---  /   ')
-        print('    \\      /    ')
-        print('     "####"     ')
-        print('successful execution - ' + NameModel + ' LULC: ' + LULC)
-        print('#################################################')
+    # Etapas del trabajo (en modo paralelo se registran en el proceso del pool)
+    return Status + ((os.getpid(), Take_Stages()),)
 
 def Read_Inputs_InVEST(InVEST_Main_Path):
     # ----------------------------------------------------------------------------------------------------------------------
-    # Input Data for InVEST models
+    # Input Data for InVEST models (copia modificable de ProjectConfig.UserData)
     # ----------------------------------------------------------------------------------------------------------------------
-    Tmp = pd.read_excel(InVEST_Main_Path,sheet_name='UserData',index_col=0)
-    UserData = {}
-    UserData['Pixel']           = Tmp.loc['Pixel', 'Value']
-    UserData['Suffix']          = Tmp.loc['Name', 'Value']
-    UserData['BioTable']        = Tmp.loc['BioTable', 'Value']
-    UserData['RainTable']       = Tmp.loc['RainTable', 'Value']
-    UserData['LULC']            = Tmp.loc['LULC', 'Value']
-    UserData['DEM']             = Tmp.loc['DEM', 'Value']
-    UserData['R']               = Tmp.loc['R', 'Value']
-    UserData['K']               = Tmp.loc['K', 'Value']
-    UserData['SoilDepth']       = Tmp.loc['SoilDepth', 'Value']
-    UserData['ETP']             = Tmp.loc['ETP', 'Value']
-    UserData['ETP_Path']        = Tmp.loc['ETP_M', 'Value']
-    UserData['P']               = Tmp.loc['P', 'Value']
-    UserData['P_Path']          = Tmp.loc['P_M', 'Value']
-    UserData['PAWC']            = Tmp.loc['PAWC', 'Value']
-    UserData['SoilGroup']       = Tmp.loc['HSG', 'Value']
-    UserData['Stream']          = Tmp.loc['Stream', 'Value']
-    UserData['Basin']           = Tmp.loc['Basin', 'Value']
-    UserData['SubBasin']        = Tmp.loc['SubBasin', 'Value']
-    UserData['Threshold']       = Tmp.loc['Threshold_Flow', 'Value']
-    UserData['Status_AWY']      = Tmp.loc['Run', 'AWY']
-    UserData['Status_SWY']      = Tmp.loc['Run', 'SWY']
-    UserData['Status_SDR']      = Tmp.loc['Run', 'SDR']
-    UserData['Status_NDR_N']    = Tmp.loc['Run', 'NDR_N']
-    UserData['Status_NDR_P']    = Tmp.loc['Run', 'NDR_P']
-    #UserData['Status_CO2']      = Tmp.loc['Run', 'CO2']
-
-    return UserData
+    return dict(Load_Config(InVEST_Main_Path).UserData)
 
 def Read_Parameters_InVEST(InVEST_Main_Path):
-
     # ----------------------------------------------------------------------------------------------------------------------
     # Parameters
     # ----------------------------------------------------------------------------------------------------------------------
-    Tmp = pd.read_excel(InVEST_Main_Path, sheet_name='Params', index_col=0)
-    Params = {}
-    Params['Z']                 = Tmp.loc['Z', 'Value']
-    Params['Factor-Kc']         = Tmp.loc['Factor-Kc', 'Value']
-    Params['Factor-Kc_m']       = Tmp.loc['Factor-Kc_m', 'Value']
-    Params['Gamma']             = Tmp.loc['Gamma', 'Value']
-    Params['Beta']              = Tmp.loc['Beta', 'Value']
-    Params['Alpha']             = Tmp.loc['Alpha', 'Value']
-    Params['Factor-C']          = Tmp.loc['Factor-C', 'Value']
-    Params['Factor-P']          = Tmp.loc['Factor-P', 'Value']
-    Params['IC0']               = Tmp.loc['Borselli-IC0', 'Value']
-    Params['L_max']             = Tmp.loc['L_max', 'Value']
-    Params['sdr_max']           = Tmp.loc['sdr_max', 'Value']
-    Params['Factor_Load_N']     = Tmp.loc['Factor_Load_N', 'Value']
-    Params['Factor_Eff_N']      = Tmp.loc['Factor_Eff_N', 'Value']
-    Params['SubCri_Len_N']      = Tmp.loc['SubCri_Len_N', 'Value']
-    Params['Sub_Eff_N']         = Tmp.loc['Sub_Eff_N', 'Value']
-    Params['Factor_Load_P']     = Tmp.loc['Factor_Load_P', 'Value']
-    Params['Factor_Eff_P']      = Tmp.loc['Factor_Eff_P', 'Value']
-    Params['Borselli-K_SDR']    = Tmp.loc['Borselli-K_SDR', 'Value']
-    Params['Borselli-K_NDR']    = Tmp.loc['Borselli-K_NDR', 'Value']
-
-    return Params
+    return dict(Load_Config(InVEST_Main_Path).Params)
 
 def Read_ParameterRange_InVEST(InVEST_Main_Path):
-    
     # ----------------------------------------------------------------------------------------------------------------------
     # Parameters range
     # ----------------------------------------------------------------------------------------------------------------------
-    Tmp = pd.read_excel(InVEST_Main_Path,sheet_name='Params',index_col=0)
-
-    # Minimum values
-    ParamsMin = {}
-    ParamsMin['Z']              = Tmp.loc['Z', 'Min']
-    ParamsMin['Factor-Kc']      = Tmp.loc['Factor-Kc', 'Min']
-    ParamsMin['Factor-Kc_m']    = Tmp.loc['Factor-Kc_m', 'Min']
-    ParamsMin['Gamma']          = Tmp.loc['Gamma', 'Min']
-    ParamsMin['Beta']           = Tmp.loc['Beta', 'Min']
-    ParamsMin['Alpha']          = Tmp.loc['Alpha', 'Min']
-    ParamsMin['Factor-C']       = Tmp.loc['Factor-C', 'Min']
-    ParamsMin['Factor-P']       = Tmp.loc['Factor-P', 'Min']
-    ParamsMin['IC0']            = Tmp.loc['Borselli-IC0', 'Min']
-    ParamsMin['L_max']          = Tmp.loc['L_max', 'Min']
-    ParamsMin['sdr_max']        = Tmp.loc['sdr_max', 'Min']
-    ParamsMin['Factor_Load_N']  = Tmp.loc['Factor_Load_N', 'Min']
-    ParamsMin['Factor_Eff_N']   = Tmp.loc['Factor_Eff_N', 'Min']
-    ParamsMin['SubCri_Len_N']   = Tmp.loc['SubCri_Len_N', 'Min']
-    ParamsMin['Sub_Eff_N']      = Tmp.loc['Sub_Eff_N', 'Min']
-    ParamsMin['Factor_Load_P']  = Tmp.loc['Factor_Load_P', 'Min']
-    ParamsMin['Factor_Eff_P']   = Tmp.loc['Factor_Eff_P', 'Min']
-    ParamsMin['Borselli-K_SDR'] = Tmp.loc['Borselli-K_SDR', 'Min']
-    ParamsMin['Borselli-K_NDR'] = Tmp.loc['Borselli-K_NDR', 'Min']
-
-    # Maximum values
-    ParamsMax = {}
-    ParamsMax['Z']              = Tmp.loc['Z', 'Max']
-    ParamsMax['Factor-Kc']      = Tmp.loc['Factor-Kc', 'Max']
-    ParamsMax['Factor-Kc_m']    = Tmp.loc['Factor-Kc_m', 'Max']
-    ParamsMax['Gamma']          = Tmp.loc['Gamma', 'Max']
-    ParamsMax['Beta']           = Tmp.loc['Beta', 'Max']
-    ParamsMax['Alpha']          = Tmp.loc['Alpha', 'Max']
-    ParamsMax['Factor-C']       = Tmp.loc['Factor-C', 'Max']
-    ParamsMax['Factor-P']       = Tmp.loc['Factor-P', 'Max']
-    ParamsMax['IC0']            = Tmp.loc['Borselli-IC0', 'Max']
-    ParamsMax['L_max']          = Tmp.loc['L_max', 'Max']
-    ParamsMax['sdr_max']        = Tmp.loc['sdr_max', 'Max']
-    ParamsMax['Factor_Load_N']  = Tmp.loc['Factor_Load_N', 'Max']
-    ParamsMax['Factor_Eff_N']   = Tmp.loc['Factor_Eff_N', 'Max']
-    ParamsMax['SubCri_Len_N']   = Tmp.loc['SubCri_Len_N', 'Max']
-    ParamsMax['Sub_Eff_N']      = Tmp.loc['Sub_Eff_N', 'Max']
-    ParamsMax['Factor_Load_P']  = Tmp.loc['Factor_Load_P', 'Max']
-    ParamsMax['Factor_Eff_P']   = Tmp.loc['Factor_Eff_P', 'Max']
-    ParamsMax['Borselli-K_SDR'] = Tmp.loc['Borselli-K_SDR', 'Max']
-    ParamsMax['Borselli-K_NDR'] = Tmp.loc['Borselli-K_NDR', 'Max']
-
-    return ParamsMin, ParamsMax
+    Config = Load_Config(InVEST_Main_Path)
+    return dict(Config.ParamsMin), dict(Config.ParamsMax)
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Filas de la hoja Params (Config_InVEST.ParamsRows) de los parámetros de cada modelo, en el orden de Parameters_Model
+# ----------------------------------------------------------------------------------------------------------------------
+ModelParams = {'AWY'    : ['Z', 'Factor-Kc'],
+               'SWY'    : ['Alpha', 'Beta', 'Gamma', 'Factor-Kc_m'],
+               'SDR'    : ['sdr_max', 'Borselli-K_SDR', 'IC0', 'L_max', 'Factor-C', 'Factor-P'],
+               'NDR_N'  : ['SubCri_Len_N', 'Sub_Eff_N', 'Borselli-K_NDR', 'Factor_Load_N', 'Factor_Eff_N'],
+               'NDR_P'  : ['Borselli-K_NDR', 'Factor_Load_P', 'Factor_Eff_P']}
+
+def Parameters_Model(NameModel, ParamsMin, ParamsMax):
+    # Parámetros de spotpy de cada modelo (el orden es el del vector x de Execute_<Model>)
+    # Parameters - Annual Water Yield (AWY)
+    if NameModel == 'AWY':
+        # Parameters
+        Params = [spotpy.parameter.Uniform('Z',            ParamsMin['Z'],             ParamsMax['Z']),
+                  spotpy.parameter.Uniform('Factor-Kc',    ParamsMin['Factor-Kc'],     ParamsMax['Factor-Kc'])
+                  ]
+
+    # Parameters - Seasonal Water Yield (SWY)
+    elif NameModel == 'SWY':
+        # Parameters
+        Params = [spotpy.parameter.Uniform('Alpha',        ParamsMin['Alpha'],         ParamsMax['Alpha']),
+                  spotpy.parameter.Uniform('Beta',         ParamsMin['Beta'],          ParamsMax['Beta']),
+                  spotpy.parameter.Uniform('Gamma',        ParamsMin['Gamma'],         ParamsMax['Gamma']),
+                  spotpy.parameter.Uniform('Factor-Kc',    ParamsMin['Factor-Kc_m'],   ParamsMax['Factor-Kc_m'])
+                  ]
+
+    # Parameters - Sediment Delivery Ratio (SDR)
+    elif NameModel == 'SDR':
+        Params = [spotpy.parameter.Uniform('sdr_max',      ParamsMin['sdr_max'],       ParamsMax['sdr_max']),
+                  spotpy.parameter.Uniform('Borselli_K',   ParamsMin['Borselli-K_SDR'],ParamsMax['Borselli-K_SDR']),
+                  spotpy.parameter.Uniform('ic_0_param',   ParamsMin['IC0'],           ParamsMax['IC0']),
+                  spotpy.parameter.Uniform('l_max',        ParamsMin['L_max'],         ParamsMax['L_max']),
+                  spotpy.parameter.Uniform('Factor-C',     ParamsMin['Factor-C'],      ParamsMax['Factor-C']),
+                  spotpy.parameter.Uniform('Factor-P',     ParamsMin['Factor-P'],      ParamsMax['Factor-P']),
+                  ]
+
+    # Parameters - Nutrient Delivery Ratio - Nitrogen (NDR)
+    elif NameModel == 'NDR_N':
+        Params = [spotpy.parameter.Uniform('SubCri_Len_N', ParamsMin['SubCri_Len_N'],  ParamsMax['SubCri_Len_N']),
+                  spotpy.parameter.Uniform('Sub_Eff_N',    ParamsMin['Sub_Eff_N'],     ParamsMax['Sub_Eff_N']),
+                  spotpy.parameter.Uniform('Borselli_K',   ParamsMin['Borselli-K_NDR'],ParamsMax['Borselli-K_NDR']),
+                  spotpy.parameter.Uniform('Factor_Load_N',ParamsMin['Factor_Load_N'], ParamsMax['Factor_Load_N']),
+                  spotpy.parameter.Uniform('Factor_Eff_N', ParamsMin['Factor_Eff_N'],  ParamsMax['Factor_Eff_N']),
+                  ]
+
+    # Parameters - Nutrient Delivery Ratio - Phosphorus (NDR)
+    elif NameModel == 'NDR_P':
+        Params = [spotpy.parameter.Uniform('Borselli_K',   ParamsMin['Borselli-K_NDR'],ParamsMax['Borselli-K_NDR']),
+                  spotpy.parameter.Uniform('Factor_Load_P',ParamsMin['Factor_Load_P'], ParamsMax['Factor_Load_P']),
+                  spotpy.parameter.Uniform('Factor_Eff_P', ParamsMin['Factor_Eff_P'],  ParamsMax['Factor_Eff_P']),
+
+                  ]
+
+    return Params
 
 # ----------------------------------------------------------------------------------------------------------------------
 # Inicialización de archivos temporales para calibración metricas
 # ----------------------------------------------------------------------------------------------------------------------
 class Spotpy_InVEST(object):
-    def __init__(self,ProjectPath, InVEST_Main_Path, NameModel, NameFunObj, FactorMetric):
+    def __init__(self,ProjectPath, InVEST_Main_Path, NameModel, NameFunObj, FactorMetric, NumWorkers=1, NativeAWY=False, EvalCache=True,
+                 CheckpointEvery=20, TaskWorkers=-1, NativeSDR=False, NativeNDR=False, NativeSWY=False,
+                 ScratchRoot=None, ScratchMinMB=1024, PruneOutputs=True, WorkspaceMaxMB=None, ProfileEvery=0,
+                 Profiler='auto', Patience=None, MinImprovement=0.0, TargetMetric=None, MaxMinutes=None, Fidelity=1,
+                 Bounds=None, Fixed=None, Screening=False, Surrogate=None, Exploration=0.1, RetrainEvery=10,
+                 FirstId=0):
         # Create Paths
         CreateFolder(os.path.join(ProjectPath, 'EVALUATIONS'))
         CreateFolder(os.path.join(ProjectPath, 'PARAMETERS'))
@@ -778,57 +1049,47 @@ class Spotpy_InVEST(object):
         CreateFolder(os.path.join(ProjectPath, 'FIGURES'))
         CreateFolder(os.path.join(ProjectPath, 'TMP'))
         
+        # Configuración del proyecto
+        Config = Load_Config(InVEST_Main_Path, ProjectPath)
+
         # Read UserData
-        UserData = Read_Inputs_InVEST(InVEST_Main_Path)
+        UserData = dict(Config.UserData)
+        UserData['TaskWorkers'] = Task_Workers(NumWorkers, TaskWorkers)
+        # Poda de las salidas que la calibración no lee (Prune_Workspace)
+        UserData['PruneOutputs']    = PruneOutputs
+        UserData['WorkspaceMaxMB']  = WorkspaceMaxMB
+
+        # Multi-fidelidad: con Fidelity > 1 las evaluaciones leen las entradas de la pirámide con píxeles Fidelity
+        # veces más grandes (los resultados, el almacén y los workspaces siguen en el proyecto)
+        InputPath = ProjectPath
+        if int(Fidelity) > 1:
+            Rasters, Categorical = Input_Rasters(ProjectPath, UserData)
+            InputPath   = Build_Pyramid(ProjectPath, int(Fidelity), Rasters[0], Rasters, Categorical)
+            UserData    = Coarse_UserData(UserData, int(Fidelity))
 
         # Read Parameter Range Model
-        ParamsMin, ParamsMax = Read_ParameterRange_InVEST(InVEST_Main_Path)
-
-        # Parameters - Annual Water Yield (AWY)
-        if NameModel == 'AWY':
-            # Parameters
-            self.params = [spotpy.parameter.Uniform('Z',            ParamsMin['Z'],             ParamsMax['Z']),
-                           spotpy.parameter.Uniform('Factor-Kc',    ParamsMin['Factor-Kc'],     ParamsMax['Factor-Kc'])
-                           ]
-
-        # Parameters - Seasonal Water Yield (AWY)
-        if NameModel == 'SWY':
-            # Parameters
-            self.params = [spotpy.parameter.Uniform('Gamma',        ParamsMin['Gamma'],         ParamsMax['Gamma']),
-                           spotpy.parameter.Uniform('Beta',         ParamsMin['Beta'],          ParamsMax['Beta']),
-                           spotpy.parameter.Uniform('Alpha',        ParamsMin['Alpha'],         ParamsMax['Alpha']),
-                           spotpy.parameter.Uniform('Factor-Kc',    ParamsMin['Factor-Kc_m'],   ParamsMax['Factor-Kc_m'])
-                           ]
-
-        # Parameters - Sediment Delivery Ratio (SDR)
-        elif NameModel == 'SDR':
-            self.params = [spotpy.parameter.Uniform('sdr_max',      ParamsMin['sdr_max'],       ParamsMax['sdr_max']),
-                           spotpy.parameter.Uniform('Borselli_K',   ParamsMin['Borselli-K_SDR'],ParamsMax['Borselli-K_SDR']),
-                           spotpy.parameter.Uniform('ic_0_param',   ParamsMin['IC0'],           ParamsMax['IC0']),
-                           spotpy.parameter.Uniform('l_max',        ParamsMin['L_max'],         ParamsMax['L_max']),
-                           spotpy.parameter.Uniform('Factor-C',     ParamsMin['Factor-C'],      ParamsMax['Factor-C']),
-                           spotpy.parameter.Uniform('Factor-P',     ParamsMin['Factor-P'],      ParamsMax['Factor-P']),
-                           ]
-
-        # Parameters - Nutrient Delivery Ratio - Nitrogen (NDR)
-        elif NameModel == 'NDR_N':
-            self.params = [spotpy.parameter.Uniform('SubCri_Len_N', ParamsMin['SubCri_Len_N'],  ParamsMax['SubCri_Len_N']),
-                           spotpy.parameter.Uniform('Sub_Eff_N',    ParamsMin['Sub_Eff_N'],     ParamsMax['Sub_Eff_N']),
-                           spotpy.parameter.Uniform('Borselli_K',   ParamsMin['Borselli-K_NDR'],ParamsMax['Borselli-K_NDR']),
-                           spotpy.parameter.Uniform('Factor_Load_N',ParamsMin['Factor_Load_N'], ParamsMax['Factor_Load_N']),
-                           spotpy.parameter.Uniform('Factor_Eff_N', ParamsMin['Factor_Eff_N'],  ParamsMax['Factor_Eff_N']),
-                           ]
-
-        # Parameters - Nutrient Delivery Ratio - Phosphorus (NDR)
-        elif NameModel == 'NDR_P':
-            self.params = [spotpy.parameter.Uniform('Borselli_K',   ParamsMin['Borselli-K_NDR'],ParamsMax['Borselli-K_NDR']),
-                           spotpy.parameter.Uniform('Factor_Load_P',ParamsMin['Factor_Load_P'], ParamsMax['Factor_Load_P']),
-                           spotpy.parameter.Uniform('Factor_Eff_P', ParamsMin['Factor_Eff_P'],  ParamsMax['Factor_Eff_P']),
-
-                           ]
+        ParamsMin, ParamsMax = dict(Config.ParamsMin), dict(Config.ParamsMax)
+
+        # Parameters
+        self.params = Parameters_Model(NameModel, ParamsMin, ParamsMax)
+        # Límites acotados por una fase anterior de la calibración multi-fidelidad ([mínimos], [máximos])
+        if Bounds is not None:
+            self.params = [spotpy.parameter.Uniform(Item.name, Low, High)
+                           for Item, Low, High in zip(self.params, Bounds[0], Bounds[1])]
+        # Parámetros fijados por el tamizado de sensibilidad ({posición: valor}). El optimizador solo recibe los
+        # libres (Free) y simulation completa el vector con los fijos
+        self.AllParams      = self.params
+        self.Fixed          = dict(Fixed or {})
+        self.Free           = np.array([i not in self.Fixed for i in range(len(self.AllParams))])
+        self.params         = [Item for i, Item in enumerate(self.AllParams) if self.Free[i]]
 
         # Project Path
         self.ProjectPath    = ProjectPath
+        # Proyecto de donde se leen las entradas (la pirámide en las fases gruesas) y factor de fidelidad
+        self.InputPath      = InputPath
+        self.Fidelity       = int(Fidelity)
+        # Evaluaciones del tamizado de sensibilidad (se marcan en el almacén)
+        self.Screening      = bool(Screening)
         # UserData
         self.UserData       = UserData
         # Name Model
@@ -837,38 +1098,201 @@ class Spotpy_InVEST(object):
         self.NameFunObj     = NameFunObj
         # Factor Metric
         self.FactorMetric   = FactorMetric
+        # Número de procesos que evalúan el modelo en paralelo (1 = secuencial)
+        self.NumWorkers     = int(NumWorkers)
+        # AWY con el motor nativo (NumPy) en lugar de awy.execute
+        self.NativeAWY      = NativeAWY
+        # SDR con el motor incremental (ruteo precalculado) en lugar de sdr.execute
+        self.NativeSDR      = NativeSDR
+        # NDR (N y P) con el motor incremental (ruteo y retención precalculados) en lugar de ndr.execute
+        self.NativeNDR      = NativeNDR
+        # SWY con el motor incremental (QF, P y ETo mensuales precalculados) en lugar de swy.execute
+        self.NativeSWY      = NativeSWY
+        # Carpeta rápida de los workspaces de las evaluaciones (ver Scratch_Root) y espacio libre mínimo
+        self.ScratchRoot    = ScratchRoot
+        self.ScratchMinMB   = ScratchMinMB
+        # Caché de evaluaciones por contenido (PARAMETERS/Evaluations_Cache.sqlite)
+        self.Cache          = Eval_Cache(os.path.join(ProjectPath, 'PARAMETERS', 'Evaluations_Cache.sqlite')) if EvalCache else None
         # Datos observados
-        self.Obs            = pd.read_excel(InVEST_Main_Path, sheet_name='Obs_Data')
+        self.Obs            = Config.Obs_Data
+        # Almacén de resultados (una fila por evaluación)
+        self.Store          = Results_Store(Results_Path(ProjectPath, NameModel, UserData['Suffix']),
+                                            EvalFormat[NameModel][0].split(','),
+                                            self.Obs['ws_id'].values, self.Obs[NameModel].values, NameFunObj,
+                                            BatchSize=CheckpointEvery)
+        # Evaluaciones de una calibración interrumpida que se reutilizan al reanudar
+        self.Replay         = {}
+        # Perfil de una de cada ProfileEvery evaluaciones de cada proceso (0 = sin perfiles)
+        self.ProfileEvery   = int(ProfileEvery or 0)
+        self.Profiler       = Profiler_Name(Profiler) if self.ProfileEvery else None
+        # Criterios de parada (None si no se fijó ninguno)
+        self.Convergence    = Convergence(Patience, MinImprovement, TargetMetric, MaxMinutes)
+        if not self.Convergence.Active():
+            self.Convergence = None
+        # Modelo sustituto ('rbf', 'gp' o 'rf') sobre los parámetros libres, entrenado con las evaluaciones del
+        # almacén con id > FirstId y la misma fidelidad (None: todos los candidatos se evalúan con InVEST). Los
+        # procesos del pool leen el modelo de TMP/SURROGATE en lugar de recibirlo con cada evaluación
+        self.FirstId        = FirstId
+        self.Surrogate      = None
+        if Surrogate:
+            CreateFolder(os.path.join(ProjectPath, 'TMP', 'SURROGATE'))
+            self.Surrogate  = Surrogate_Model([Item.minbound for Item in self.params],
+                                              [Item.maxbound for Item in self.params], Exploration, RetrainEvery,
+                                              Kind=Surrogate,
+                                              File=os.path.join(ProjectPath, 'TMP', 'SURROGATE', '%s_%d_F%d' %
+                                                                (NameModel, FirstId, self.Fidelity)))
 
     def parameters(self):
         return spotpy.parameter.generate(self.params)
 
-    def simulation(self, vector):
-        return np.array(vector)
+    def simulation(self, vector, Screen=True):
+        # Candidatos que el sustituto resuelve sin ejecutar InVEST (Screen=False: siempre con InVEST)
+        if self.Surrogate is not None and Screen:
+            Sim = self.Surrogate.Screen(vector, lambda Sim: self.FactorMetric*self.Metric(Sim, self.Obs))
+            if Sim is not None:
+                return Sim
+
+        # Sin perfiles el único costo es esta comparación
+        if self.ProfileEvery:
+            Call = Next_Call()
+            if Call % self.ProfileEvery == 0:
+                return Profile_Call(self.Simulate, (vector,),
+                                    os.path.join(Profile_Folder(self.ProjectPath), '%s_%d_%05d' %
+                                                 (self.NameModel, os.getpid(), Call)), self.Profiler)
+        return self.Simulate(vector)
+
+    def Full_Vector(self, vector):
+        # Vector de todos los parámetros del modelo (orden de Parameters_Model) con los fijos del tamizado
+        x               = np.empty(len(self.Free))
+        x[self.Free]    = np.asarray(vector, dtype=float)
+        x[~self.Free]   = [self.Fixed[i] for i in sorted(self.Fixed)]
+        return x
+
+    def Simulate(self, vector):
+        # --------------------------------------------------------------------------------------------------------------
+        # La ejecución de InVEST se hace aquí y no en objectivefunction para que spotpy la reparta entre los
+        # procesos del pool (mpc/umpc). En paralelo cada proceso trabaja en su propio directorio
+        # --------------------------------------------------------------------------------------------------------------
+        WorkPath    = Worker_Path(self.ProjectPath, self.NumWorkers, self.ScratchRoot, self.ScratchMinMB)
+        x           = self.Full_Vector(vector)
+        StartTime   = time.time()
+
+        # Parada del monitor de recursos (poco espacio en disco)
+        Check_Abort(self.ProjectPath)
+
+        # Reanudación: el vector ya se evaluó antes de la interrupción
+        Replay      = self.Replay.get(x.tobytes())
+        if Replay:
+            return Replay.pop(0)
+
+        with Stage('evaluation'):
+            # Annual Water Yield (AWY)
+            if self.NameModel == 'AWY' and self.NativeAWY:
+                ws_id, Sim = Execute_AWY_Batch(self.InputPath, self.UserData, [x], WorkPath)
+                Sim = Sim[0]
+            elif self.NameModel == 'AWY':
+                ws_id, Sim = Execute_AWY(self.InputPath, self.UserData, x, WorkPath, self.Cache)
+            # Seasonal Water Yield (SWY) con el motor incremental
+            elif self.NameModel == 'SWY' and self.NativeSWY:
+                ws_id, Sim = Execute_SWY_Batch(self.InputPath, self.UserData, [x])
+                Sim = Sim[0]
+            # Seasonal Water Yield (SWY)
+            elif self.NameModel == 'SWY':
+                ws_id, Sim = Execute_SWY(self.InputPath, self.UserData, x, WorkPath, self.Cache)
+            # Sediment Delivery Ratio (SDR)
+            elif self.NameModel == 'SDR' and self.NativeSDR:
+                ws_id, Sim = Execute_SDR_Batch(self.InputPath, self.UserData, [x])
+                Sim = Sim[0]
+            elif self.NameModel == 'SDR':
+                ws_id, Sim = Execute_SDR(self.InputPath, self.UserData, x, WorkPath, self.Cache)
+            # Nutrient Delivery Ratio - Nitrogen y Phosphorus (NDR) con el motor incremental
+            elif self.NameModel in ('NDR_N', 'NDR_P') and self.NativeNDR:
+                ws_id, Sim = Execute_NDR_Batch(self.InputPath, self.UserData, [x], self.NameModel)
+                Sim = Sim[0]
+            # Nutrient Delivery Ratio - Nitrogen (NDR)
+            elif self.NameModel == 'NDR_N':
+                ws_id, Sim = Execute_NDR_N(self.InputPath, self.UserData, x, WorkPath, self.Cache)
+            # Nutrient Delivery Ratio - Phosphorus (NDR)
+            elif self.NameModel == 'NDR_P':
+                ws_id, Sim = Execute_NDR_P(self.InputPath, self.UserData, x, WorkPath, self.Cache)
+
+            # ----------------------------------------------------------------------------------------------------------
+            # Ordena la simulacion segun las cuencas observadas (NaN si la cuenca no fue simulada)
+            # ----------------------------------------------------------------------------------------------------------
+            with Stage('ismember'):
+                [I, idx]    = ismember(ws_id, self.Obs['ws_id'].values)
+                SimObs      = np.full(len(self.Obs), np.nan)
+                SimObs[idx] = Sim[I]
+
+        # --------------------------------------------------------------------------------------------------------------
+        # Guarda la evaluacion en el almacén de resultados
+        # --------------------------------------------------------------------------------------------------------------
+        if (self.NameModel == 'AWY' and self.NativeAWY) or (self.NameModel == 'SWY' and self.NativeSWY) or \
+                (self.NameModel == 'SDR' and self.NativeSDR) or (self.NameModel in ('NDR_N', 'NDR_P') and self.NativeNDR):
+            CacheStatus = 'native'
+        elif self.Cache is None:
+            CacheStatus = 'off'
+        else:
+            CacheStatus = 'hit' if self.Cache.LastHit else 'miss'
+        # La escritura en el almacén se registra en la evaluación siguiente (sus etapas ya se guardaron)
+        Stages = Take_Stages()
+        WrittenMB, KeptMB = Take_Workspace()
+        with Stage('Results_Store'):
+            self.Store.Add(x, self.Metric(SimObs, self.Obs), SimObs, time.time() - StartTime, CacheStatus, Stages,
+                           self.Fidelity, self.Screening, WrittenMB, KeptMB)
+
+        return SimObs
 
     def evaluation(self):
         return self.Obs
 
-    def objectivefunction(self, simulation, evaluation):
+    def objectivefunction(self, simulation, evaluation, params=None):
+        # La evaluación ya quedó guardada en el almacén de resultados desde simulation
+        Metric = self.Metric(simulation, evaluation)
+
+        # Sustituto: cuenta el candidato y se reentrena con las evaluaciones reales nuevas. Las estimaciones no
+        # cuentan para los criterios de parada
+        if self.Surrogate is not None:
+            self.Surrogate.Count(isinstance(simulation, Prediction))
+            if self.Surrogate.Due():
+                self.Train_Surrogate()
+            if isinstance(simulation, Prediction):
+                return Metric
+
+        # Criterios de parada sobre el error (FactorMetric solo cambia el signo para DDS)
+        if self.Convergence is not None:
+            Stop = self.Convergence.Update(self.FactorMetric*Metric)
+            if Stop is not None:
+                raise Stop_Calibration(Stop)
+
+        return Metric
+
+    def Train_Surrogate(self):
+        # Evaluaciones reales de la calibración en esta fidelidad (en paralelo los procesos ya las escribieron). Solo
+        # las primeras Real: al reanudar, el almacén ya tiene las evaluaciones posteriores de la calibración
+        # interrumpida y el sustituto se entrena con las mismas que antes de la interrupción. En secuencial la
+        # reanudación es exacta; en paralelo las filas quedan en el orden en que terminaron los procesos y es
+        # aproximada
+        self.Store.Flush()
+        Results = Read_Results(self.Store.PathDB, self.FirstId, self.Fidelity, Screening=False)
+        Rows    = slice(0, self.Surrogate.Real)
+        self.Surrogate.Fit(Results['Params'][Rows][:, self.Free], Results['Sim'][Rows],
+                           self.FactorMetric*Results['Metric'][Rows],
+                           lambda Sim: self.FactorMetric*self.Metric(Sim, self.Obs))
+
+    def Metric(self, simulation, evaluation):
+        # --------------------------------------------------------------------------------------------------------------
+        # Observados y simulados de las cuencas con resultado
+        # --------------------------------------------------------------------------------------------------------------
+        Sim         = np.array(simulation, dtype=float)
+        Mask        = ~np.isnan(Sim)
+        Sim         = Sim[Mask]
+        Obs         = evaluation[self.NameModel].values[Mask]
 
-        # Name Model
-        NameModel = self.NameModel
-        
-        # Annual Water Yield (AWY)    
-        if NameModel == 'AWY':
-            return Execute_AWY(self.ProjectPath, self.UserData, simulation, evaluation, self.NameFunObj, self.FactorMetric)
-        # Seasonal Water Yield (AWY)
-        if NameModel == 'SWY':
-            return Execute_SWY(self.ProjectPath, self.UserData, simulation, evaluation, self.NameFunObj, self.FactorMetric)
-        # Sediment Delivery Ratio (SDR)
-        elif NameModel == 'SDR':
-            return Execute_SDR(self.ProjectPath, self.UserData, simulation, evaluation, self.NameFunObj, self.FactorMetric)
-        # Nutrient Delivery Ratio - Nitrogen (NDR)
-        elif NameModel == 'NDR_N':
-            return Execute_NDR_N(self.ProjectPath, self.UserData, simulation, evaluation, self.NameFunObj, self.FactorMetric)
-        # Nutrient Delivery Ratio - Phosphorus (NDR)
-        elif NameModel == 'NDR_P':
-            return Execute_NDR_P(self.ProjectPath, self.UserData, simulation, evaluation, self.NameFunObj, self.FactorMetric)
+        # --------------------------------------------------------------------------------------------------------------
+        # Calcula la metrica
+        # --------------------------------------------------------------------------------------------------------------
+        return self.FactorMetric*Cal_FunObj(Obs, Sim, self.NameFunObj)
 
 def Cal_FunObj(Obs, Sim, NameFunObj):
 
@@ -881,10 +1305,259 @@ def Cal_FunObj(Obs, Sim, NameFunObj):
     elif NameFunObj == "Relative Root Mean Squared Error (RRMSE)":
         return spotpy.objectivefunctions.rrmse(Obs, Sim)
 
-def Execute_AWY(ProjectPath, UserData, simulation, evaluation, NameFunObj, FactorMetric):
+def Worker_Path(ProjectPath, NumWorkers=1, ScratchRoot=None, ScratchMinMB=1024):
+    """
+    Directorio de trabajo de una evaluación.
 
-    # Parameters
-    x = simulation
+    En modo secuencial es el propio proyecto (OUTPUTS y TMP de siempre). En modo paralelo cada
+    proceso usa TMP/WORKERS/PID_<pid>, con sus propias carpetas OUTPUTS y TMP, para que dos
+    evaluaciones simultáneas nunca escriban sobre el mismo workspace ni la misma tabla biofísica temporal.
+
+    Con ScratchRoot (ver Scratch_Root) cada proceso, también en modo secuencial, usa ScratchRoot/PID_<pid>. Si el
+    espacio libre de la carpeta rápida baja de ScratchMinMB, la evaluación vuelve a las carpetas del proyecto.
+    """
+    if ScratchRoot is not None and Free_MB(ScratchRoot) >= ScratchMinMB:
+        WorkPath = os.path.join(ScratchRoot, 'PID_%d' % os.getpid())
+    else:
+        if ScratchRoot is not None and ScratchRoot not in _ScratchFull:
+            _ScratchFull.add(ScratchRoot)
+            print('Scratch workspace %s has less than %d MB free - using the project folder' %
+                  (ScratchRoot, ScratchMinMB))
+        if NumWorkers <= 1:
+            return ProjectPath
+        WorkPath = os.path.join(ProjectPath, 'TMP', 'WORKERS', 'PID_%d' % os.getpid())
+    for Folder in ['OUTPUTS', 'TMP']:
+        CreateFolder(os.path.join(WorkPath, Folder))
+
+    return WorkPath
+
+# Carpetas rápidas que ya avisaron que no tienen espacio (un aviso por proceso)
+_ScratchFull = set()
+
+def Free_MB(PathFolder):
+    # Espacio libre del disco (o tmpfs) de una carpeta en MB
+    return shutil.disk_usage(PathFolder).free / 2**20
+
+def Scratch_Root(ProjectPath, ScratchPath, ScratchMinMB=1024):
+    """
+    Carpeta rápida para los workspaces de las evaluaciones de una calibración: un tmpfs (/dev/shm) o un disco
+    local cuando el proyecto está en una carpeta de red. Las evaluaciones escriben allí la tabla biofísica temporal y
+    los rásteres intermedios de InVEST. PARAMETERS, EVALUATIONS, los motores de TMP y la ejecución final con los
+    mejores parámetros (RunInVEST) siguen en el proyecto.
+
+    Retorna ScratchPath/InVEST_Cal_<hash del proyecto>_<pid>, que se elimina al terminar la calibración
+    (Remove_Scratch) o al salir de Python. Retorna None (se trabaja en el proyecto) si ScratchPath es None o si tiene
+    menos de ScratchMinMB libres.
+    """
+    if not ScratchPath:
+        return None
+
+    os.makedirs(ScratchPath, exist_ok=True)
+    Free = Free_MB(ScratchPath)
+    if Free < ScratchMinMB:
+        print('Scratch workspace %s has %0.0f MB free (minimum %d MB) - using the project folder' %
+              (ScratchPath, Free, ScratchMinMB))
+        return None
+
+    Key         = hashlib.sha1(os.path.abspath(ProjectPath).encode('utf-8')).hexdigest()[:8]
+    ScratchRoot = os.path.join(ScratchPath, 'InVEST_Cal_%s_%d' % (Key, os.getpid()))
+    os.makedirs(ScratchRoot, exist_ok=True)
+    atexit.register(Remove_Scratch, ScratchRoot)
+    print('Scratch workspace: %s (%0.0f MB free)' % (ScratchRoot, Free))
+    return ScratchRoot
+
+def Remove_Scratch(ScratchRoot):
+    if ScratchRoot is not None:
+        shutil.rmtree(ScratchRoot, ignore_errors=True)
+        _ScratchFull.discard(ScratchRoot)
+
+# MB escritos y que quedan en el workspace de la última evaluación de este proceso (los lee Take_Workspace)
+_Workspace = []
+
+def Take_Workspace():
+    # (MB escritos, MB que quedan) de la última poda desde la llamada anterior ((NaN, NaN) sin poda)
+    Sizes = _Workspace[-1] if _Workspace else (np.nan, np.nan)
+    del _Workspace[:]
+    return Sizes
+
+def Prune_Workspace(Workspace, NameModel, UserData, StartTime):
+    """
+    Registra los MB que escribió una evaluación de InVEST en su workspace (Take_Workspace, se guardan en el almacén
+    de resultados) y borra las salidas que la calibración no lee (todo excepto NeededOutputs[NameModel]):
+        UserData['PruneOutputs']    se poda después de cada evaluación
+        UserData['WorkspaceMaxMB']  se poda cuando el workspace supera ese tamaño
+    Sin poda, taskgraph reutiliza en la siguiente evaluación las salidas que no cambian (alineación, ruteo).
+    Retorna los MB escritos y los MB que quedan en el workspace.
+    """
+    Needed  = {os.path.normpath(os.path.join(Workspace, Name.format(Suffix=UserData['Suffix'])))
+               for Name in NeededOutputs[NameModel]}
+    Written = Size = 0
+    Files   = []
+    for Root, _, Names in os.walk(Workspace):
+        for Name in Names:
+            PathFile = os.path.join(Root, Name)
+            try:
+                Stat = os.stat(PathFile)
+            except OSError:
+                continue
+            Size += Stat.st_size
+            # Margen de 1 s por la resolución de st_mtime de algunos sistemas de archivos
+            if Stat.st_mtime >= StartTime - 1:
+                Written += Stat.st_size
+            if os.path.normpath(PathFile) not in Needed:
+                Files.append((PathFile, Stat.st_size))
+
+    MaxMB = UserData.get('WorkspaceMaxMB')
+    if UserData.get('PruneOutputs', False) or (MaxMB is not None and Size/2**20 > MaxMB):
+        for PathFile, Bytes in Files:
+            try:
+                os.remove(PathFile)
+                Size -= Bytes
+            except OSError:
+                pass
+        # Carpetas que quedaron vacías (el workspace se conserva)
+        for Root, Dirs, _ in os.walk(Workspace, topdown=False):
+            for Dir in Dirs:
+                try:
+                    os.rmdir(os.path.join(Root, Dir))
+                except OSError:
+                    pass
+
+    _Workspace.append((Written/2**20, Size/2**20))
+    return Written/2**20, Size/2**20
+
+def Workspace_Summary(PathStore, NameModel, FirstId=0, MaxMB=None):
+    """
+    Imprime los MB que escribieron en su workspace las evaluaciones de InVEST con id > FirstId y los que quedaron
+    después de la poda. Las evaluaciones sin workspace (motores nativos, caché) no cuentan.
+    """
+    Results = Read_Results(PathStore, FirstId)
+    Valid   = np.isfinite(Results['WrittenMB'])
+    if not Valid.any():
+        return
+    Written, Kept = Results['WrittenMB'][Valid], Results['KeptMB'][Valid]
+    print('Workspace %s - %d evaluations | %0.1f MB written per evaluation (max %0.1f MB) | up to %0.1f MB kept' %
+          (NameModel, Valid.sum(), Written.mean(), Written.max(), Kept.max()))
+    if MaxMB is not None and (Kept > MaxMB).any():
+        print('Workspace %s exceeds WorkspaceMaxMB after pruning in %d evaluations (max %0.1f MB > %0.1f MB)' %
+              (NameModel, (Kept > MaxMB).sum(), Kept.max(), MaxMB))
+
+def Parallel_Mode(NameOpt, NumWorkers=1, DDSBatch=None):
+    """
+    Modo de ejecución de spotpy para el optimizador y el número de procesos.
+
+    LHS usa 'umpc' (el orden de las muestras no importa); SCE-UA usa 'mpc' para conservar el orden de los
+    complejos, y el tamizado FAST también porque su análisis necesita las evaluaciones en el orden de su matriz. DDS
+    es secuencial por construcción (cada perturbación parte del mejor punto actual), por lo que se mantiene en
+    'seq', salvo con DDSBatch > 1 (PDDS), que evalúa cada ronda de perturbaciones en 'mpc' para que la selección
+    del mejor punto no dependa del orden en que terminan los procesos.
+    """
+    if int(NumWorkers) <= 1:
+        return "seq"
+    if NameOpt == "Dynamical dimensional search (DDS)" and not (DDSBatch and int(DDSBatch) > 1):
+        return "seq"
+
+    # Número de procesos del pool de spotpy
+    import spotpy.parallel.mproc
+    import spotpy.parallel.umproc
+    spotpy.parallel.mproc.process_count     = int(NumWorkers)
+    spotpy.parallel.umproc.process_count    = int(NumWorkers)
+
+    if NameOpt == "Latin Hypercube Sampling (LHS)":
+        return "umpc"
+    return "mpc"
+
+def Task_Workers(NumWorkers=1, TaskWorkers=-1):
+    """
+    Procesos de taskgraph (args['n_workers']) para cada ejecución de InVEST.
+
+    Con 'auto' los núcleos disponibles se reparten entre las NumWorkers evaluaciones simultáneas; si a cada
+    evaluación le toca un solo núcleo se usa -1 (taskgraph en el mismo proceso, sin el costo de crear procesos).
+    Benchmark_InVEST.Benchmark_Workers mide la mejor combinación para un proyecto.
+    """
+    if TaskWorkers != 'auto':
+        return int(TaskWorkers)
+
+    Cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+    Cores = Cores // max(int(NumWorkers), 1)
+    return Cores if Cores > 1 else -1
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Encabezado y formato de los parámetros en los archivos <Model>_Metric_ de EVALUATIONS
+# ----------------------------------------------------------------------------------------------------------------------
+EvalFormat = {'AWY'     : ('Z,Factor-Kc',
+                           ['%0.2f', '%0.2f']),
+              'SWY'     : ('Alpha,Beta,Gamma,Factor-Kc',
+                           ['%0.3f', '%0.3f', '%0.3f', '%0.2f']),
+              'SDR'     : ('sdr_max,k_param,ic_0_param,l_max,Factor-C,Factor-P',
+                           ['%0.2f', '%0.2f', '%0.2f', '%0.2f', '%0.5f', '%0.5f']),
+              'NDR_N'   : ('SubCri_Len_N,Sub_Eff_N,Borselli-K,Factor_Load_N,Factor_Eff_N',
+                           ['%0.2f', '%0.2f', '%0.2f', '%0.2f', '%0.5f']),
+              'NDR_P'   : ('Borselli-K,Factor_Load_P,Factor_Eff_P',
+                           ['%0.2f', '%0.2f', '%0.2f'])}
+
+def Results_Path(ProjectPath, NameModel, Suffix):
+    # Almacén de resultados de la calibración
+    return os.path.join(ProjectPath, 'EVALUATIONS', NameModel + '_Results_' + Suffix + '.sqlite')
+
+def Load_Results(ProjectPath, NameModel, Suffix):
+    """
+    Lee el almacén de resultados para los Plot_* (solo las evaluaciones de la calibración en la resolución nativa,
+    sin las del tamizado de sensibilidad). Los parámetros se redondean con el formato de EvalFormat (los mismos
+    valores que se escriben en la hoja Params).
+    Retorna Params (n x p), Metric (n), Obs (g x 1) y Sim (g x n)
+    """
+    Results         = Read_Results(Results_Path(ProjectPath, NameModel, Suffix), Fidelity=1, Screening=False)
+    Header, Format  = EvalFormat[NameModel]
+    Params          = np.array([[float(Format[j] % Results['Params'][i, j]) for j in range(0, len(Format))]
+                                for i in range(0, len(Results['Metric']))]).reshape(-1, len(Format))
+    Obs             = Results['Obs'].reshape(-1, 1)
+    Sim             = Results['Sim'].transpose()
+
+    return Params, Results['Metric'], Obs, Sim
+
+def Export_Evaluations(ProjectPath, NameModel, Suffix):
+    """
+    Exporta el almacén de resultados a los CSV Metric, Obs y Sim de EVALUATIONS (mismo formato de siempre, una
+    fila por cuenca de Obs_Data y evaluación; 'nan' si la cuenca no se simuló). Se escribe una sola vez al final. Las
+    evaluaciones de las pirámides gruesas (Fidelity_InVEST) y del tamizado de sensibilidad (Screening_InVEST) quedan
+    solo en el almacén.
+    """
+    Results         = Read_Results(Results_Path(ProjectPath, NameModel, Suffix), Fidelity=1, Screening=False)
+    Header, Format  = EvalFormat[NameModel]
+    nEval           = len(Results['Metric'])
+
+    # Metric
+    PathResults = os.path.join(ProjectPath, 'EVALUATIONS', NameModel + '_Metric_' + Suffix + '.csv')
+    np.savetxt(PathResults, np.column_stack((Results['Params'], Results['Metric'])), delimiter=',',
+               fmt=Format + ['%0.2f'], header=Header + ',' + Results['NameFunObj'], comments='')
+
+    # Observados
+    PathResults = os.path.join(ProjectPath, 'EVALUATIONS', NameModel + '_Obs_' + Suffix + '.csv')
+    np.savetxt(PathResults, np.tile(Results['Obs'], nEval), fmt='%0.2f', header='Obs', comments='')
+
+    # Simulados
+    PathResults = os.path.join(ProjectPath, 'EVALUATIONS', NameModel + '_Sim_' + Suffix + '.csv')
+    np.savetxt(PathResults, Results['Sim'].ravel(), fmt='%0.2f', header='Sim', comments='')
+
+def Export_Timing(ProjectPath, NameModel, Suffix, FirstId=0):
+    """
+    Imprime la tabla de tiempos por etapa (p50/p95) de las evaluaciones con id > FirstId y guarda su traza en
+    EVALUATIONS/<Model>_Trace_<Suffix>.json (chrome://tracing o ui.perfetto.dev). Retorna la tabla.
+    """
+    Results = Read_Results(Results_Path(ProjectPath, NameModel, Suffix), FirstId)
+    Write_Trace(os.path.join(ProjectPath, 'EVALUATIONS', NameModel + '_Trace_' + Suffix + '.json'),
+                list(zip(Results['Pid'], Results['Stages'])))
+    Summary = Stage_Summary(Results['Stages'])
+    print('Stage timing - ' + NameModel)
+    print(Summary.to_string(float_format='%0.2f'))
+
+    return Summary
+
+def Execute_AWY(ProjectPath, UserData, x, WorkPath=None, Cache=None):
+
+    # Directorio de trabajo (el proyecto en modo secuencial)
+    WorkPath = WorkPath or ProjectPath
 
     # --------------------------------------------------------------------------------------------------------------
     # Print
@@ -902,9 +1575,11 @@ def Execute_AWY(ProjectPath, UserData, simulation, evaluation, NameFunObj, Facto
     Params          = {'Z': x[0],'Factor-Kc':x[1]}
     # Aplicar factores a la tabla biofísica y guardar
     PathBioTable    = os.path.join(ProjectPath, 'INPUTS', UserData['BioTable'] + '.csv')
-    Table           = Factor_BioTable(PathBioTable, Params, UserData)
-    PathTable       = os.path.join(ProjectPath, 'TMP', 'AWY_' + UserData['BioTable'] + '.csv')
-    Table.to_csv(PathTable, index=False)
+    with Stage('Factor_BioTable'):
+        Table           = Factor_BioTable(PathBioTable, Params, UserData)
+    PathTable       = os.path.join(WorkPath, 'TMP', 'AWY_' + UserData['BioTable'] + '.csv')
+    with Stage('to_csv'):
+        Table.to_csv(PathTable, index=False)
     # Configuración de diccionario de entrada del modelo
     args    = Create_argsInVEST(ProjectPath, UserData, Params, StatusK="AWY")
     # Ruta de la tabla biofisica temporal de la region
@@ -912,75 +1587,87 @@ def Execute_AWY(ProjectPath, UserData, simulation, evaluation, NameFunObj, Facto
     # Ruta de la cuenca de la Region
     args['watersheds_path']         = os.path.join(ProjectPath, 'INPUTS', 'Basin_Cal_AWY', 'Basin_Cal_AWY.shp')
     # Ruta de la carpeta de resultados de la region
-    args['workspace_dir']           = os.path.join(ProjectPath, 'OUTPUTS', '01-AWY')
+    args['workspace_dir']           = os.path.join(WorkPath, 'OUTPUTS', '01-AWY')
+
+    # Caché de evaluaciones: entradas efectivas idénticas devuelven la simulación almacenada
+    if Cache is not None:
+        with Stage('Eval_Cache'):
+            Key = Cache.Key('AWY', args, Table)
+            Hit = Cache.Get(Key)
+            if Hit is not None:
+                return Hit
 
     # --------------------------------------------------------------------------------------------------------------
     # Ejecución del modelo
     # --------------------------------------------------------------------------------------------------------------
-    awy.execute(args)
+    StartTime = time.time()
+    with Stage('awy.execute'):
+        awy.execute(args)
 
     # --------------------------------------------------------------------------------------------------------------
     # Lectura del csv de resultados
     # --------------------------------------------------------------------------------------------------------------
     NameFile    = os.path.join(args['workspace_dir'], 'output', 'watershed_results_wyield_' + UserData['Suffix'] + '.csv')
-    simulation  = pd.read_csv(NameFile)
-    Sim         = simulation['wyield_vol'].values
+    with Stage('read_results'):
+        simulation  = pd.read_csv(NameFile)
 
-    # --------------------------------------------------------------------------------------------------------------
-    # Busca los datos de rendimiento hidrico en la tabla de resultados asociados a cada cuenca
-    # --------------------------------------------------------------------------------------------------------------
-    [I, idx]    = ismember(simulation['ws_id'].values, evaluation['ws_id'].values)
-    Obs         = evaluation['AWY'].values[idx]
+    # Salidas que no se leen: poda y tamaño escrito
+    with Stage('Prune_Workspace'):
+        Prune_Workspace(args['workspace_dir'], 'AWY', UserData, StartTime)
 
-    # --------------------------------------------------------------------------------------------------------------
-    # Calcula la metrica
-    # --------------------------------------------------------------------------------------------------------------
-    objectivefunction = FactorMetric*Cal_FunObj(Obs, Sim, NameFunObj)
+    # Guardar en la caché de evaluaciones
+    if Cache is not None:
+        with Stage('Eval_Cache'):
+            Cache.Put(Key, 'AWY', simulation['ws_id'].values, simulation['wyield_vol'].values)
 
-    # --------------------------------------------------------------------------------------------------------------
-    # Guarda el valor de la metrica en el CSV Metric
-    # --------------------------------------------------------------------------------------------------------------
-    PathResults = os.path.join(ProjectPath, 'EVALUATIONS', 'AWY_Metric_' + UserData['Suffix'] + '.csv')
-    file_exists = os.path.isfile(PathResults)
-    with open(PathResults, 'a') as ID_File:
-        if not file_exists:
-            ID_File.write('Z,Factor-Kc,' + NameFunObj + '\n')
+    return simulation['ws_id'].values, simulation['wyield_vol'].values
+
+# Motores AWY por directorio de trabajo (se construyen una vez por proceso)
+_AWYEngines = {}
 
-        ID_File.write('%0.2f' % x[0] + ',' +
-                      '%0.2f' % x[1] + ',' +
-                      '%0.2f' % objectivefunction + '\n')
+def Execute_AWY_Batch(ProjectPath, UserData, X, WorkPath=None):
+    """
+    Evalúa un lote de candidatos [Z, Factor-Kc] con el motor nativo de AWY (sin awy.execute).
+    Retorna ws_id y una matriz (candidatos x cuencas) con wyield_vol.
+    """
+    # Directorio de trabajo (el proyecto en modo secuencial)
+    WorkPath = WorkPath or ProjectPath
 
     # --------------------------------------------------------------------------------------------------------------
-    # Guarda el valor observado en el CSV Obs
+    # Print
     # --------------------------------------------------------------------------------------------------------------
-    PathResults = os.path.join(ProjectPath, 'EVALUATIONS', 'AWY_Obs_' + UserData['Suffix'] + '.csv')
-    file_exists = os.path.isfile(PathResults)
-    with open(PathResults, 'a') as ID_File:
-        if not file_exists:
-            ID_File.write('Obs\n')
+    for x in X:
+        print('----------------------------------------')
+        print('Parameters - AWY (native)')
+        print('----------------------------------------')
+        print('Z         = ' + '%.2f' % x[0])
+        print('Factor-Kc = ' + '%.2f' % x[1])
+    print('----------------------------------------')
 
-        for ii in range(0, len(Obs)):
-            ID_File.write('%0.2f' % Obs[ii] + '\n')
+    # Motor del directorio de trabajo
+    PathBioTable    = os.path.join(ProjectPath, 'INPUTS', UserData['BioTable'] + '.csv')
+    if WorkPath not in _AWYEngines:
+        with Stage('engine_build'):
+            args = Create_argsInVEST(ProjectPath, UserData, {'Z': 0}, StatusK="AWY")
+            args['watersheds_path'] = os.path.join(ProjectPath, 'INPUTS', 'Basin_Cal_AWY', 'Basin_Cal_AWY.shp')
+            _AWYEngines[WorkPath]   = AWY_Engine(args, WorkPath)
+    Engine = _AWYEngines[WorkPath]
 
-    # --------------------------------------------------------------------------------------------------------------
-    # Guarda la simulacion en el archivo CSV Sim
-    # --------------------------------------------------------------------------------------------------------------
-    PathResults = os.path.join(ProjectPath, 'EVALUATIONS', 'AWY_Sim_' + UserData['Suffix'] + '.csv')
-    file_exists = os.path.isfile(PathResults)
-    with open(PathResults, 'a') as ID_File:
-        if not file_exists:
-            ID_File.write('Sim\n')
+    # Z con la misma precisión que Create_argsInVEST y Kc afectado con Factor_BioTable
+    Z   = np.array([float('%0.2f' % x[0]) for x in X])
+    with Stage('Factor_BioTable'):
+        Kc  = np.array([Engine.Kc_Vector(Factor_BioTable(PathBioTable, {'Z': x[0], 'Factor-Kc': x[1]}, UserData))
+                        for x in X])
 
-        for ii in range(0, len(Sim)):
-            ID_File.write('%0.2f' % Sim[ii] + '\n')
+    with Stage('engine_evaluate'):
+        Sim = Engine.Evaluate(Z, Kc)
 
-    return objectivefunction
+    return Engine.ws_id, Sim
 
-def Execute_SWY(ProjectPath, UserData, simulation, evaluation, NameFunObj, FactorMetric):
-    # ---------------------------------------------------------------------
-    # Parameters
-    # ---------------------------------------------------------------------
-    x = simulation
+def Execute_SWY(ProjectPath, UserData, x, WorkPath=None, Cache=None):
+
+    # Directorio de trabajo (el proyecto en modo secuencial)
+    WorkPath = WorkPath or ProjectPath
 
     # ---------------------------------------------------------------------
     # Print
@@ -994,12 +1681,14 @@ def Execute_SWY(ProjectPath, UserData, simulation, evaluation, NameFunObj, Facto
     # --------------------------------------------------------------------------------------------------------------
     # Configuración de diccionario de entrada del modelo
     # --------------------------------------------------------------------------------------------------------------
-    Params          = {'Alpha':x[0],'Beta':x[1],'Gamma':x[2],'Factor-Kc_m':x[3]}
+    Params          = SWY_Params(x)
     # Aplicar factores a la tabla biofísica y guardar
     PathBioTable    = os.path.join(ProjectPath, 'INPUTS', UserData['BioTable'] + '.csv')
-    Table           = Factor_BioTable(PathBioTable, Params, UserData)
-    PathTable       = os.path.join(ProjectPath, 'TMP', 'SWY_' + UserData['BioTable'] + '.csv')
-    Table.to_csv(PathTable, index=False)
+    with Stage('Factor_BioTable'):
+        Table           = Factor_BioTable(PathBioTable, Params, UserData)
+    PathTable       = os.path.join(WorkPath, 'TMP', 'SWY_' + UserData['BioTable'] + '.csv')
+    with Stage('to_csv'):
+        Table.to_csv(PathTable, index=False)
     # Configuración de diccionario de entrada del modelo
     args    = Create_argsInVEST(ProjectPath, UserData, Params, StatusK="SWY")
     # Ruta de la tabla biofisica temporal de la region
@@ -1007,73 +1696,91 @@ def Execute_SWY(ProjectPath, UserData, simulation, evaluation, NameFunObj, Facto
     # Ruta de la cuenca de la Region
     args['watersheds_path']         = os.path.join(ProjectPath, 'INPUTS', 'Basin_Cal_SWY', 'Basin_Cal_SWY.shp')
     # Ruta de la carpeta de resultados de la region
-    args['workspace_dir']           = os.path.join(ProjectPath, 'OUTPUTS', '02-SWY')
+    args['workspace_dir']           = os.path.join(WorkPath, 'OUTPUTS', '02-SWY')
+
+    # Caché de evaluaciones: entradas efectivas idénticas devuelven la simulación almacenada
+    if Cache is not None:
+        with Stage('Eval_Cache'):
+            Key = Cache.Key('SWY', args, Table)
+            Hit = Cache.Get(Key)
+            if Hit is not None:
+                return Hit
 
     # Run
-    swy.execute(args)
+    StartTime = time.time()
+    with Stage('swy.execute'):
+        swy.execute(args)
 
     # read Results
     raster_path = os.path.join(args['workspace_dir'], 'intermediate_outputs','aet_' + UserData['Suffix'] + '.tif')
-    output_path = os.path.join(ProjectPath, 'TMP')
-    simulation  = calculate_zonal_stats(args['watersheds_path'], raster_path, output_path,Suffix="SWY")
-    Sim         = simulation['mean'].values
+    output_path = os.path.join(WorkPath, 'TMP')
+    with Stage('calculate_zonal_stats'):
+        simulation  = calculate_zonal_stats(args['watersheds_path'], raster_path, output_path,Suffix="SWY", SaveShp=False)
 
-    # --------------------------------------------------------------------------------------------------------------
-    # Busca los datos de rendimiento hidrico en la tabla de resultados asociados a cada cuenca
-    # --------------------------------------------------------------------------------------------------------------
-    [I, idx] = ismember(simulation['ws_id'].values, evaluation['ws_id'].values)
-    Obs = evaluation['SWY'].values[idx]
+    # Salidas que no se leen: poda y tamaño escrito
+    with Stage('Prune_Workspace'):
+        Prune_Workspace(args['workspace_dir'], 'SWY', UserData, StartTime)
 
-    # --------------------------------------------------------------------------------------------------------------
-    # Calcula la metrica
-    # --------------------------------------------------------------------------------------------------------------
-    objectivefunction = FactorMetric*Cal_FunObj(Obs, Sim, NameFunObj)
+    # Guardar en la caché de evaluaciones
+    if Cache is not None:
+        with Stage('Eval_Cache'):
+            Cache.Put(Key, 'SWY', simulation['ws_id'].values, simulation['mean'].values)
 
-    # --------------------------------------------------------------------------------------------------------------
-    # Guarda el valor de la metrica en el CSV Metric
-    # --------------------------------------------------------------------------------------------------------------
-    PathResults = os.path.join(ProjectPath, 'EVALUATIONS', 'SWY_Metric_' + UserData['Suffix'] + '.csv')
-    file_exists = os.path.isfile(PathResults)
-    with open(PathResults, 'a') as ID_File:
-        if not file_exists:
-            ID_File.write('Alpha,Beta,Gamma,Factor-Kc,' + NameFunObj + '\n')
-
-        ID_File.write('%0.3f' % x[0] + ',' +
-                      '%0.3f' % x[1] + ',' +
-                      '%0.3f' % x[2] + ',' +
-                      '%0.2f' % x[3] + ',' +
-                      '%0.2f' % objectivefunction + '\n')
+    return simulation['ws_id'].values, simulation['mean'].values
 
-    # --------------------------------------------------------------------------------------------------------------
-    # Guarda el valor observado en el CSV Obs
-    # --------------------------------------------------------------------------------------------------------------
-    PathResults = os.path.join(ProjectPath, 'EVALUATIONS', 'SWY_Obs_' + UserData['Suffix'] + '.csv')
-    file_exists = os.path.isfile(PathResults)
-    with open(PathResults, 'a') as ID_File:
-        if not file_exists:
-            ID_File.write('Obs\n')
+_SWYEngines = {}
 
-        for ii in range(0, len(Obs)):
-            ID_File.write('%0.2f' % Obs[ii] + '\n')
+def SWY_Params(x):
+    # Diccionario de parámetros de Execute_SWY a partir del vector x (orden de ModelParams['SWY'])
+    return dict(zip(ModelParams['SWY'], x))
 
+def Execute_SWY_Batch(ProjectPath, UserData, X):
+    """
+    Evalúa un lote de candidatos de SWY con el motor incremental de SWY (sin swy.execute). El flujo rápido mensual y
+    la precipitación y ETo alineadas se calculan una sola vez en TMP/SWY_ENGINE y los comparten todos los procesos.
+    Retorna ws_id y una matriz (candidatos x cuencas) con la media de aet.
+    """
     # --------------------------------------------------------------------------------------------------------------
-    # Guarda la simulacion en el archivo CSV Sim
+    # Print
     # --------------------------------------------------------------------------------------------------------------
-    PathResults = os.path.join(ProjectPath, 'EVALUATIONS', 'SWY_Sim_' + UserData['Suffix'] + '.csv')
-    file_exists = os.path.isfile(PathResults)
-    with open(PathResults, 'a') as ID_File:
-        if not file_exists:
-            ID_File.write('Sim\n')
-
-        for ii in range(0, len(Sim)):
-            ID_File.write('%0.2f' % Sim[ii] + '\n')
-
-    return objectivefunction
-
-def Execute_SDR(ProjectPath, UserData, simulation, evaluation, NameFunObj, FactorMetric):
+    for x in X:
+        print('---------------------------')
+        print('Parameters - SWY (native)')
+        print('Alpha = ' + '%.3f' % x[0])
+        print('Beta  = ' + '%.3f' % x[1])
+        print('Gamma = ' + '%.3f' % x[2])
+        print('Factor-Kc = ' + '%.2f' % x[3])
 
-    # Parameters
-    x = simulation
+    # Motor de las entradas del proyecto
+    PathBioTable    = os.path.join(ProjectPath, 'INPUTS', UserData['BioTable'] + '.csv')
+    args            = Create_argsInVEST(ProjectPath, UserData, SWY_Params(X[0]), StatusK="SWY")
+    args['watersheds_path'] = os.path.join(ProjectPath, 'INPUTS', 'Basin_Cal_SWY', 'Basin_Cal_SWY.shp')
+    Key = SWY_Engine.Key(args)
+    if Key not in _SWYEngines:
+        with Stage('engine_build'):
+            _SWYEngines[Key] = SWY_Engine(ProjectPath, args)
+    Engine = _SWYEngines[Key]
+
+    # alpha_m, beta_i y gamma tal como los recibe swy.execute (Create_argsInVEST) y Kc con Factor_BioTable
+    Alpha, Beta, Gamma, Kc = [], [], [], []
+    with Stage('Factor_BioTable'):
+        for x in X:
+            Params  = SWY_Params(x)
+            args    = Create_argsInVEST(ProjectPath, UserData, Params, StatusK="SWY")
+            Alpha.append(float(args['alpha_m']))
+            Beta.append(float(args['beta_i']))
+            Gamma.append(float(args['gamma']))
+            Kc.append(Engine.Kc_Matrix(Factor_BioTable(PathBioTable, Params, UserData)))
+
+    with Stage('engine_evaluate'):
+        Sim = Engine.Evaluate(Alpha, Beta, Gamma, Kc)
+
+    return Engine.ws_id, Sim
+
+def Execute_SDR(ProjectPath, UserData, x, WorkPath=None, Cache=None):
+
+    # Directorio de trabajo (el proyecto en modo secuencial)
+    WorkPath = WorkPath or ProjectPath
 
     # ---------------------------------------------------------------------
     # Print
@@ -1092,9 +1799,11 @@ def Execute_SDR(ProjectPath, UserData, simulation, evaluation, NameFunObj, Facto
     Params  = {'sdr_max':x[0],'Borselli-K_SDR':x[1],'IC0':x[2],'L_max':x[3],'Factor-C':x[4],'Factor-P':x[5]}
     # Aplicar factores a la tabla biofísica y guardar
     PathBioTable    = os.path.join(ProjectPath, 'INPUTS', UserData['BioTable'] + '.csv')
-    Table           = Factor_BioTable(PathBioTable, Params, UserData)
-    PathTable       = os.path.join(ProjectPath, 'TMP', 'SDR_' + UserData['BioTable'] + '.csv')
-    Table.to_csv(PathTable, index=False)
+    with Stage('Factor_BioTable'):
+        Table           = Factor_BioTable(PathBioTable, Params, UserData)
+    PathTable       = os.path.join(WorkPath, 'TMP', 'SDR_' + UserData['BioTable'] + '.csv')
+    with Stage('to_csv'):
+        Table.to_csv(PathTable, index=False)
     # Configuración de diccionario de entrada del modelo
     args    = Create_argsInVEST(ProjectPath, UserData, Params,StatusK='SDR')
     # Ruta de la tabla biofisica temporal de la region
@@ -1102,80 +1811,96 @@ def Execute_SDR(ProjectPath, UserData, simulation, evaluation, NameFunObj, Facto
     # Ruta de la cuenca de la Region
     args['watersheds_path']         = os.path.join(ProjectPath, 'INPUTS', 'Basin_Cal_SDR', 'Basin_Cal_SDR.shp')
     # Ruta de la carpeta de resultados de la region
-    args['workspace_dir']           = os.path.join(ProjectPath, 'OUTPUTS', '03-SDR')
+    args['workspace_dir']           = os.path.join(WorkPath, 'OUTPUTS', '03-SDR')
     # Metodo direcciones de flujo
     args['flow_dir_algorithm']      = 'MFD'
 
+    # Caché de evaluaciones: entradas efectivas idénticas devuelven la simulación almacenada
+    if Cache is not None:
+        with Stage('Eval_Cache'):
+            Key = Cache.Key('SDR', args, Table)
+            Hit = Cache.Get(Key)
+            if Hit is not None:
+                return Hit
+
     # ---------------------------------------------------------------------
     # Ejecucion del modelo
     # ---------------------------------------------------------------------
-    sdr.execute(args)
+    # Ruteo de flujo desde la caché del proyecto (DEM, umbral y método de direcciones)
+    StartTime = time.time()
+    with Stage('sdr.execute'), Routing_Cache(ProjectPath, args):
+        sdr.execute(args)
 
     # ---------------------------------------------------------------------
     # Lectura del dbf de resultados
     # ---------------------------------------------------------------------
     NameFile    = os.path.join( args['workspace_dir'] , 'watershed_results_sdr_' + UserData['Suffix'] + '.dbf')
-    dbf         = Dbf5(NameFile)
-    simulation  = dbf.to_dataframe()
+    with Stage('read_results'):
+        dbf         = Dbf5(NameFile)
+        simulation  = dbf.to_dataframe()
 
-    # ---------------------------------------------------------------------
-    # Busca los datos de carga de sedimentos en la tabla de resultados asociados a cada cuenca
-    # ---------------------------------------------------------------------
-    Sim         = simulation['sed_export'].values
-    [I, idx]    = ismember(simulation['ws_id'].values, evaluation['ws_id'].values)
-    Obs         = evaluation['SDR'].values[idx]
+    # Salidas que no se leen: poda y tamaño escrito
+    with Stage('Prune_Workspace'):
+        Prune_Workspace(args['workspace_dir'], 'SDR', UserData, StartTime)
 
-    # --------------------------------------------------------------------------------------------------------------
-    # Calcula la metrica
-    # --------------------------------------------------------------------------------------------------------------
-    objectivefunction = FactorMetric*Cal_FunObj(Obs, Sim, NameFunObj)
+    # Guardar en la caché de evaluaciones
+    if Cache is not None:
+        with Stage('Eval_Cache'):
+            Cache.Put(Key, 'SDR', simulation['ws_id'].values, simulation['sed_export'].values)
 
-    # --------------------------------------------------------------------------------------------------------------
-    # Guarda el valor de la metrica en el CSV Metric
-    # --------------------------------------------------------------------------------------------------------------
-    PathResults = os.path.join(ProjectPath, 'EVALUATIONS', 'SDR_Metric_' + UserData['Suffix'] + '.csv')
-    file_exists = os.path.isfile(PathResults)
-    with open(PathResults, 'a') as ID_File:
-        if not file_exists:
-            ID_File.write('sdr_max,k_param,ic_0_param,l_max,Factor-C,Factor-P,' + NameFunObj + '\n')
-
-        ID_File.write('%0.2f' % x[0] + ',' +
-                      '%0.2f' % x[1] + ',' +
-                      '%0.2f' % x[2] + ',' +
-                      '%0.2f' % x[3] + ',' +
-                      '%0.5f' % x[4] + ',' +
-                      '%0.5f' % x[5] + ',' +
-                      '%0.2f' % objectivefunction + '\n')
+    return simulation['ws_id'].values, simulation['sed_export'].values
+
+# Motores SDR por carpeta de preparación (se construyen una vez por proceso)
+_SDREngines = {}
 
+def Execute_SDR_Batch(ProjectPath, UserData, X):
+    """
+    Evalúa un lote de candidatos [sdr_max, K, IC0, L_max, Factor-C, Factor-P] con el motor incremental de SDR (sin
+    sdr.execute). La preparación se guarda en TMP/SDR_ENGINE y la comparten todos los procesos.
+    Retorna ws_id y una matriz (candidatos x cuencas) con sed_export.
+    """
     # --------------------------------------------------------------------------------------------------------------
-    # Guarda el valor observado en el CSV Obs
+    # Print
     # --------------------------------------------------------------------------------------------------------------
-    PathResults = os.path.join(ProjectPath, 'EVALUATIONS', 'SDR_Obs_' + UserData['Suffix'] + '.csv')
-    file_exists = os.path.isfile(PathResults)
-    with open(PathResults, 'a') as ID_File:
-        if not file_exists:
-            ID_File.write('Obs\n')
+    for x in X:
+        print('---------------------------')
+        print('Parameters - SDR (native)')
+        print('sdr_max  = ' + '%.2f' % x[0])
+        print('K        = ' + '%.2f' % x[1])
+        print('IC0      = ' + '%.2f' % x[2])
+        print('l_max    = ' + '%.2f' % x[3])
+        print('Factor-C = ' + '%.2f' % x[4])
+        print('Factor-P = ' + '%.2f' % x[5])
+
+    # Motor de las entradas del proyecto (tabla biofísica sin factores)
+    PathBioTable    = os.path.join(ProjectPath, 'INPUTS', UserData['BioTable'] + '.csv')
+    args            = Create_argsInVEST(ProjectPath, UserData, {'sdr_max': 0, 'Borselli-K_SDR': 0, 'IC0': 0, 'L_max': 0},
+                                        StatusK='SDR')
+    args['watersheds_path']     = os.path.join(ProjectPath, 'INPUTS', 'Basin_Cal_SDR', 'Basin_Cal_SDR.shp')
+    args['flow_dir_algorithm']  = 'MFD'
+    Key = SDR_Engine.Key(args)
+    if Key not in _SDREngines:
+        with Stage('engine_build'):
+            _SDREngines[Key] = SDR_Engine(ProjectPath, args)
+    Engine = _SDREngines[Key]
 
-        for ii in range(0, len(Obs)):
-            ID_File.write('%0.2f' % Obs[ii] + '\n')
+    # Parámetros con la misma precisión que Create_argsInVEST y C, P afectados con Factor_BioTable
+    Values  = np.array([[float('%0.2f' % v) for v in x[:4]] for x in X]).reshape(-1, 4)
+    with Stage('Factor_BioTable'):
+        CP      = [Engine.CP_Vectors(Factor_BioTable(PathBioTable, {'Factor-C': x[4], 'Factor-P': x[5]}, UserData))
+                   for x in X]
+    C       = np.array([Item[0] for Item in CP])
+    P       = np.array([Item[1] for Item in CP])
 
-    # --------------------------------------------------------------------------------------------------------------
-    # Guarda la simulacion en el archivo CSV Sim
-    # --------------------------------------------------------------------------------------------------------------
-    PathResults = os.path.join(ProjectPath, 'EVALUATIONS', 'SDR_Sim_' + UserData['Suffix'] + '.csv')
-    file_exists = os.path.isfile(PathResults)
-    with open(PathResults, 'a') as ID_File:
-        if not file_exists:
-            ID_File.write('Sim\n')
+    with Stage('engine_evaluate'):
+        Sim = Engine.Evaluate(Values[:, 0], Values[:, 1], Values[:, 2], Values[:, 3], C, P)
 
-        for ii in range(0, len(Sim)):
-            ID_File.write('%0.2f' % Sim[ii] + '\n')
+    return Engine.ws_id, Sim
 
-    return objectivefunction
+def Execute_NDR_N(ProjectPath, UserData, x, WorkPath=None, Cache=None):
 
-def Execute_NDR_N(ProjectPath, UserData, simulation, evaluation, NameFunObj, FactorMetric):
-    # Parameters
-    x = simulation
+    # Directorio de trabajo (el proyecto en modo secuencial)
+    WorkPath = WorkPath or ProjectPath
 
     # --------------------------------------------------------------------------------------------------------------
     # Print
@@ -1193,9 +1918,11 @@ def Execute_NDR_N(ProjectPath, UserData, simulation, evaluation, NameFunObj, Fac
     Params  = {'SubCri_Len_N':x[0],'Sub_Eff_N':x[1],'Borselli-K_NDR':x[2],'Factor_Load_N':x[3],'Factor_Eff_N':x[4]}
     # Aplicar factores a la tabla biofísica y guardar
     PathBioTable    = os.path.join(ProjectPath, 'INPUTS', UserData['BioTable'] + '.csv')
-    Table           = Factor_BioTable(PathBioTable, Params, UserData)
-    PathTable       = os.path.join(ProjectPath, 'TMP', 'NDR_N_' + UserData['BioTable'] + '.csv')
-    Table.to_csv(PathTable, index=False)
+    with Stage('Factor_BioTable'):
+        Table           = Factor_BioTable(PathBioTable, Params, UserData)
+    PathTable       = os.path.join(WorkPath, 'TMP', 'NDR_N_' + UserData['BioTable'] + '.csv')
+    with Stage('to_csv'):
+        Table.to_csv(PathTable, index=False)
     # Configuración de diccionario de entrada del modelo
     args    = Create_argsInVEST(ProjectPath, UserData, Params, StatusK='NDR_N')
     # Ruta de la tabla biofisica temporal de la region
@@ -1203,82 +1930,49 @@ def Execute_NDR_N(ProjectPath, UserData, simulation, evaluation, NameFunObj, Fac
     # Ruta de la cuenca de la Region
     args['watersheds_path']         = os.path.join(ProjectPath, 'INPUTS', 'Basin_Cal_NDR_N','Basin_Cal_NDR_N.shp')
     # Ruta de la carpeta de resultados de la region
-    args['workspace_dir']           = os.path.join(ProjectPath, 'OUTPUTS', '04-NDR_N')
+    args['workspace_dir']           = os.path.join(WorkPath, 'OUTPUTS', '04-NDR_N')
     # Metodo de direcciones de flujo
     args['flow_dir_algorithm']      = 'MFD'
 
+    # Caché de evaluaciones: entradas efectivas idénticas devuelven la simulación almacenada
+    if Cache is not None:
+        with Stage('Eval_Cache'):
+            Key = Cache.Key('NDR_N', args, Table)
+            Hit = Cache.Get(Key)
+            if Hit is not None:
+                return Hit
+
     # --------------------------------------------------------------------------------------------------------------
     # Ejecucion del modelo de nutrientes
     # --------------------------------------------------------------------------------------------------------------
-    ndr.execute(args)
+    # Ruteo de flujo desde la caché del proyecto (DEM, umbral y método de direcciones)
+    StartTime = time.time()
+    with Stage('ndr.execute'), Routing_Cache(ProjectPath, args):
+        ndr.execute(args)
 
     # --------------------------------------------------------------------------------------------------------------
     # Lectura del dbf de resultados
     # --------------------------------------------------------------------------------------------------------------
     raster_path = os.path.join(args['workspace_dir'], 'n_total_export_' + UserData['Suffix'] + '.tif')
-    output_path = os.path.join(ProjectPath, 'TMP')
-    simulation  = calculate_zonal_stats(args['watersheds_path'], raster_path, output_path,Suffix="NDR_N")
-    Sim         = simulation['sum'].values
+    output_path = os.path.join(WorkPath, 'TMP')
+    with Stage('calculate_zonal_stats'):
+        simulation  = calculate_zonal_stats(args['watersheds_path'], raster_path, output_path,Suffix="NDR_N", SaveShp=False)
 
-    # --------------------------------------------------------------------------------------------------------------
-    # Busca los datos de carga de nitrogeno en la tabla de resultados asociados a cada cuenca
-    # --------------------------------------------------------------------------------------------------------------
-    [I, idx]    = ismember(simulation['ws_id'].values, evaluation['ws_id'].values)
-    Obs         = evaluation['NDR_N'].values[idx]
-
-    # --------------------------------------------------------------------------------------------------------------
-    # Calcula la metrica
-    # --------------------------------------------------------------------------------------------------------------
-    objectivefunction = FactorMetric*Cal_FunObj(Obs, Sim, NameFunObj)
+    # Salidas que no se leen: poda y tamaño escrito
+    with Stage('Prune_Workspace'):
+        Prune_Workspace(args['workspace_dir'], 'NDR_N', UserData, StartTime)
 
-    # --------------------------------------------------------------------------------------------------------------
-    # Guarda el valor de la metrica en el CSV Metric
-    # --------------------------------------------------------------------------------------------------------------
-    PathResults = os.path.join(ProjectPath, 'EVALUATIONS', 'NDR_N_Metric_' + UserData['Suffix'] + '.csv')
-    file_exists = os.path.isfile(PathResults)
-    with open(PathResults, 'a') as ID_File:
-        if not file_exists:
-            ID_File.write('SubCri_Len_N,Sub_Eff_N,Borselli-K,Factor_Load_N,Factor_Eff_N,' + NameFunObj + '\n')
-
-        ID_File.write('%0.2f' % x[0] + ',' +
-                      '%0.2f' % x[1] + ',' +
-                      '%0.2f' % x[2] + ',' +
-                      '%0.2f' % x[3] + ',' +
-                      '%0.5f' % x[4] + ',' +
-                      '%0.2f' % objectivefunction + '\n')
-
-    # --------------------------------------------------------------------------------------------------------------
-    # Guarda el valor observado en el CSV Obs
-    # --------------------------------------------------------------------------------------------------------------
-    PathResults = os.path.join(ProjectPath, 'EVALUATIONS', 'NDR_N_Obs_' + UserData['Suffix'] + '.csv')
-    file_exists = os.path.isfile(PathResults)
-    with open(PathResults, 'a') as ID_File:
-        if not file_exists:
-            ID_File.write('Obs\n')
-
-        for ii in range(0, len(Obs)):
-            ID_File.write('%0.2f' % Obs[ii] + '\n')
-
-    # --------------------------------------------------------------------------------------------------------------
-    # Guarda la simulacion en el archivo CSV Sim
-    # --------------------------------------------------------------------------------------------------------------
-    PathResults = os.path.join(ProjectPath, 'EVALUATIONS', 'NDR_N_Sim_' + UserData['Suffix'] + '.csv')
-    file_exists = os.path.isfile(PathResults)
-    with open(PathResults, 'a') as ID_File:
-        if not file_exists:
-            ID_File.write('Sim\n')
+    # Guardar en la caché de evaluaciones
+    if Cache is not None:
+        with Stage('Eval_Cache'):
+            Cache.Put(Key, 'NDR_N', simulation['ws_id'].values, simulation['sum'].values)
 
-        for ii in range(0, len(Sim)):
-            ID_File.write('%0.2f' % Sim[ii] + '\n')
+    return simulation['ws_id'].values, simulation['sum'].values
 
-    # --------------------------------------------------------------------------------------------------------------
-    # Salida de la funcion
-    # --------------------------------------------------------------------------------------------------------------
-    return objectivefunction
+def Execute_NDR_P(ProjectPath, UserData, x, WorkPath=None, Cache=None):
 
-def Execute_NDR_P(ProjectPath, UserData, simulation, evaluation, NameFunObj, FactorMetric):
-    # Parameters
-    x = simulation.tolist()
+    # Directorio de trabajo (el proyecto en modo secuencial)
+    WorkPath = WorkPath or ProjectPath
 
     # --------------------------------------------------------------------------------------------------------------
     # Print
@@ -1294,9 +1988,11 @@ def Execute_NDR_P(ProjectPath, UserData, simulation, evaluation, NameFunObj, Fac
     Params  = {'Borselli-K_NDR':x[0],'Factor_Load_P':x[1],'Factor_Eff_P':x[2]}
     # Aplicar factores a la tabla biofísica y guardar
     PathBioTable    = os.path.join(ProjectPath, 'INPUTS', UserData['BioTable'] + '.csv')
-    Table           = Factor_BioTable(PathBioTable, Params, UserData)
-    PathTable       = os.path.join(ProjectPath, 'TMP', 'NDR_P_' + UserData['BioTable'] + '.csv')
-    Table.to_csv(PathTable, index=False)
+    with Stage('Factor_BioTable'):
+        Table           = Factor_BioTable(PathBioTable, Params, UserData)
+    PathTable       = os.path.join(WorkPath, 'TMP', 'NDR_P_' + UserData['BioTable'] + '.csv')
+    with Stage('to_csv'):
+        Table.to_csv(PathTable, index=False)
     # Configuración de diccionario de entrada del modelo
     args    = Create_argsInVEST(ProjectPath, UserData, Params, StatusK='NDR_P')
     # Ruta de la tabla biofisica temporal de la region
@@ -1304,102 +2000,165 @@ def Execute_NDR_P(ProjectPath, UserData, simulation, evaluation, NameFunObj, Fac
     # Ruta de la cuenca de la Region
     args['watersheds_path']         = os.path.join(ProjectPath, 'INPUTS', 'Basin_Cal_NDR_P', 'Basin_Cal_NDR_P.shp')
     # Ruta de la carpeta de resultados de la region
-    args['workspace_dir']           = os.path.join(ProjectPath, 'OUTPUTS', '04-NDR_P')
+    args['workspace_dir']           = os.path.join(WorkPath, 'OUTPUTS', '04-NDR_P')
     # Metodo de direcciones de flujo
     args['flow_dir_algorithm']      = 'MFD'
 
+    # Caché de evaluaciones: entradas efectivas idénticas devuelven la simulación almacenada
+    if Cache is not None:
+        with Stage('Eval_Cache'):
+            Key = Cache.Key('NDR_P', args, Table)
+            Hit = Cache.Get(Key)
+            if Hit is not None:
+                return Hit
+
     # --------------------------------------------------------------------------------------------------------------
     # Ejecucion del modelo de nutrientes
     # --------------------------------------------------------------------------------------------------------------
-    ndr.execute(args)
+    # Ruteo de flujo desde la caché del proyecto (DEM, umbral y método de direcciones)
+    StartTime = time.time()
+    with Stage('ndr.execute'), Routing_Cache(ProjectPath, args):
+        ndr.execute(args)
 
     # --------------------------------------------------------------------------------------------------------------
     # Lectura del dbf de resultados
     # --------------------------------------------------------------------------------------------------------------
     raster_path = os.path.join(args['workspace_dir'], 'p_surface_export_' + UserData['Suffix'] + '.tif')
-    output_path = os.path.join(ProjectPath, 'TMP')
-    simulation  = calculate_zonal_stats(args['watersheds_path'], raster_path, output_path,Suffix="NDR_P")
-    Sim         = simulation['sum'].values
+    output_path = os.path.join(WorkPath, 'TMP')
+    with Stage('calculate_zonal_stats'):
+        simulation  = calculate_zonal_stats(args['watersheds_path'], raster_path, output_path,Suffix="NDR_P", SaveShp=False)
 
-    # --------------------------------------------------------------------------------------------------------------
-    # Busca los datos de carga de nitrogeno en la tabla de resultados asociados a cada cuenca
-    # --------------------------------------------------------------------------------------------------------------
-    [I, idx]    = ismember(simulation['ws_id'].values, evaluation['ws_id'].values)
-    Obs         = evaluation['NDR_P'].values[idx]
+    # Salidas que no se leen: poda y tamaño escrito
+    with Stage('Prune_Workspace'):
+        Prune_Workspace(args['workspace_dir'], 'NDR_P', UserData, StartTime)
 
-    # --------------------------------------------------------------------------------------------------------------
-    # Calcula la metrica
-    # --------------------------------------------------------------------------------------------------------------
-    objectivefunction = FactorMetric*Cal_FunObj(Obs, Sim, NameFunObj)
+    # Guardar en la caché de evaluaciones
+    if Cache is not None:
+        with Stage('Eval_Cache'):
+            Cache.Put(Key, 'NDR_P', simulation['ws_id'].values, simulation['sum'].values)
 
-    # --------------------------------------------------------------------------------------------------------------
-    # Guarda el valor de la metrica en el CSV Metric
-    # --------------------------------------------------------------------------------------------------------------
-    PathResults = os.path.join(ProjectPath, 'EVALUATIONS', 'NDR_P_Metric_' + UserData['Suffix'] + '.csv')
-    file_exists = os.path.isfile(PathResults)
-    with open(PathResults, 'a') as ID_File:
-        if not file_exists:
-            ID_File.write('Borselli-K,Factor_Load_P,Factor_Eff_P,' + NameFunObj + '\n')
+    return simulation['ws_id'].values, simulation['sum'].values
 
-        ID_File.write('%0.2f' % x[0] + ',' +
-                      '%0.2f' % x[1] + ',' +
-                      '%0.2f' % x[2] + ',' +
-                      '%0.2f' % objectivefunction + '\n')
+# Motores NDR por carpeta de preparación (compartidos por N y P; se construyen una vez por proceso)
+_NDREngines = {}
 
-    # --------------------------------------------------------------------------------------------------------------
-    # Guarda el valor observado en el CSV Obs
-    # --------------------------------------------------------------------------------------------------------------
-    PathResults = os.path.join(ProjectPath, 'EVALUATIONS', 'NDR_P_Obs_' + UserData['Suffix'] + '.csv')
-    file_exists = os.path.isfile(PathResults)
-    with open(PathResults, 'a') as ID_File:
-        if not file_exists:
-            ID_File.write('Obs\n')
+def NDR_Params(NameModel, x):
+    # Diccionario de parámetros de Execute_NDR_N / Execute_NDR_P a partir del vector x
+    if NameModel == 'NDR_N':
+        return {'SubCri_Len_N':x[0],'Sub_Eff_N':x[1],'Borselli-K_NDR':x[2],'Factor_Load_N':x[3],'Factor_Eff_N':x[4]}
+    return {'Borselli-K_NDR':x[0],'Factor_Load_P':x[1],'Factor_Eff_P':x[2]}
 
-        for ii in range(0, len(Obs)):
-            ID_File.write('%0.2f' % Obs[ii] + '\n')
+def Execute_NDR_Batch(ProjectPath, UserData, X, NameModel='NDR_N'):
+    """
+    Evalúa un lote de candidatos de NDR_N o NDR_P con el motor incremental de NDR (sin ndr.execute). La preparación
+    se guarda en TMP/NDR_ENGINE y la comparten todos los procesos y ambos nutrientes.
+    Retorna ws_id y una matriz (candidatos x cuencas) con la suma de n_total_export (N) o p_surface_export (P).
+    """
+    Nutrient = NameModel[-1].lower()
 
     # --------------------------------------------------------------------------------------------------------------
-    # Guarda la simulacion en el archivo CSV Sim
+    # Print
     # --------------------------------------------------------------------------------------------------------------
-    PathResults = os.path.join(ProjectPath, 'EVALUATIONS', 'NDR_P_Sim_' + UserData['Suffix'] + '.csv')
-    file_exists = os.path.isfile(PathResults)
-    with open(PathResults, 'a') as ID_File:
-        if not file_exists:
-            ID_File.write('Sim\n')
+    for x in X:
+        print('---------------------------------')
+        print('Parameters - ' + NameModel + ' (native)')
+        for Name, Value in NDR_Params(NameModel, x).items():
+            print('%-15s= %.2f' % (Name, Value))
 
-        for ii in range(0, len(Sim)):
-            ID_File.write('%0.2f' % Sim[ii] + '\n')
-
-    # --------------------------------------------------------------------------------------------------------------
-    # Salida de la funcion
-    # --------------------------------------------------------------------------------------------------------------
-    return objectivefunction
+    # Motor de las entradas del proyecto
+    PathBioTable    = os.path.join(ProjectPath, 'INPUTS', UserData['BioTable'] + '.csv')
+    args            = Create_argsInVEST(ProjectPath, UserData, NDR_Params(NameModel, X[0]), StatusK=NameModel)
+    args['watersheds_path']     = os.path.join(ProjectPath, 'INPUTS', 'Basin_Cal_' + NameModel, 'Basin_Cal_' + NameModel + '.shp')
+    args['flow_dir_algorithm']  = 'MFD'
+    Key = NDR_Engine.Key(args)
+    if Key not in _NDREngines:
+        with Stage('engine_build'):
+            _NDREngines[Key] = NDR_Engine(ProjectPath, args)
+    Engine = _NDREngines[Key]
+
+    # k y parámetros subsuperficiales tal como los recibe ndr.execute (Create_argsInVEST) y tabla con Factor_BioTable
+    K, Load, Eff, CritLen, Prop, SubEff, SubCritLen = [], [], [], [], [], [], []
+    with Stage('Factor_BioTable'):
+        for x in X:
+            Params  = NDR_Params(NameModel, x)
+            args    = Create_argsInVEST(ProjectPath, UserData, Params, StatusK=NameModel)
+            Vectors = Engine.Vectors(Factor_BioTable(PathBioTable, Params, UserData), Nutrient)
+            K.append(float(args['k_param']))
+            for List, Value in zip([Load, Eff, CritLen, Prop], Vectors):
+                List.append(Value)
+            if Nutrient == 'n':
+                SubEff.append(float(args['subsurface_eff_n']))
+                SubCritLen.append(float(args['subsurface_critical_length_n']))
+
+    if Nutrient == 'p':
+        Prop = SubEff = SubCritLen = None
+    with Stage('engine_evaluate'):
+        Sim = Engine.Evaluate(K, Load, Eff, CritLen, Prop, SubEff, SubCritLen)
+
+    return Engine.ws_id, Sim
+
+# Error relativo máximo aceptado por Check_Parity para cada motor nativo
+ParityTol = {'AWY': 1e-4, 'SWY': 1e-3, 'SDR': 1e-3, 'NDR_N': 1e-3, 'NDR_P': 1e-3}
+
+def Check_Parity(ProjectPath, InVEST_Main_Path, NameModel, NumSim=5, rtol=None, Seed=0):
+    """
+    Compara el motor nativo de NameModel (AWY, SWY, SDR, NDR_N o NDR_P) con el modelo de InVEST para NumSim
+    candidatos aleatorios dentro del rango de calibración (p. ej. sobre Dummy_InVEST.zip). Las corridas de InVEST se
+    hacen en TMP/PARITY. Por defecto rtol es el de ParityTol.
+    Retorna True si el error relativo máximo es menor que rtol, y la tabla de comparación.
+    """
+    rtol                = ParityTol[NameModel] if rtol is None else rtol
+    Config              = Load_Config(InVEST_Main_Path, ProjectPath)
+    UserData            = dict(Config.UserData)
+    ParamsMin, ParamsMax = dict(Config.ParamsMin), dict(Config.ParamsMax)
+    WorkPath            = os.path.join(ProjectPath, 'TMP', 'PARITY')
+    for Folder in ['OUTPUTS', 'TMP']:
+        CreateFolder(os.path.join(WorkPath, Folder))
+
+    # Candidatos aleatorios (mismo orden que el vector x de Execute_<Model>)
+    Names   = ModelParams[NameModel]
+    Rng     = np.random.default_rng(Seed)
+    X       = np.column_stack([Rng.uniform(ParamsMin[k], ParamsMax[k], NumSim) for k in Names])
+
+    # Motor nativo (un solo lote) y modelo de InVEST (una corrida por candidato)
+    if NameModel == 'AWY':
+        ws_id, Native = Execute_AWY_Batch(ProjectPath, UserData, X, WorkPath)
+    elif NameModel == 'SWY':
+        ws_id, Native = Execute_SWY_Batch(ProjectPath, UserData, X)
+    elif NameModel == 'SDR':
+        ws_id, Native = Execute_SDR_Batch(ProjectPath, UserData, X)
+    else:
+        ws_id, Native = Execute_NDR_Batch(ProjectPath, UserData, X, NameModel)
+    Execute = {'AWY'    : Execute_AWY,
+               'SWY'    : Execute_SWY,
+               'SDR'    : Execute_SDR,
+               'NDR_N'  : Execute_NDR_N,
+               'NDR_P'  : Execute_NDR_P}[NameModel]
+    Results = []
+    for i, x in enumerate(X):
+        ws_ref, Ref = Execute(ProjectPath, UserData, x, WorkPath)
+        [I, idx]    = ismember(ws_ref, ws_id)
+        for j, k in zip(np.where(I)[0], idx):
+            Results.append([i] + list(x) + [ws_ref[j], Ref[j], Native[i, k]])
+
+    Results = pd.DataFrame(Results, columns=['Sim'] + Names + ['ws_id', 'InVEST', 'Native'])
+    Results['RelError'] = np.abs(Results['Native'] - Results['InVEST']) / np.abs(Results['InVEST'])
+    Status = bool(Results['RelError'].max() < rtol)
+    print('%s parity - max relative error = %0.2e (%s)' %
+          (NameModel, Results['RelError'].max(), 'OK' if Status else 'FAIL'))
+
+    return Status, Results
 
 def Plot_AWY(ProjectPath, Suffix, NameMetric, InVEST_Main_Path, FactorMetric):
 
-    # Metric and parameters
-    FileName    = os.path.join(ProjectPath, 'EVALUATIONS', f'AWY_Metric_{Suffix}.csv')
-    Tmp         = np.loadtxt(FileName, delimiter=',', skiprows=1)
-    Params      = Tmp[:, :2]
-    Metric      = Tmp[:, 2] / (3600 * 24 * 365)
-
-    # Observed
-    FileName    = os.path.join(ProjectPath, 'EVALUATIONS', f'AWY_Obs_{Suffix}.csv')
-    Obs         = np.loadtxt(FileName, delimiter=',', skiprows=1)
-    NGauges     = len(Obs) // len(Metric)
-    Obs         = Obs.reshape(len(Metric),NGauges)
-    Obs         = Obs.transpose()
-    Obs         = Obs[:, 0] / (3600 * 24 * 365)
-    Obs         = Obs.reshape(NGauges,1)
-
-    # Simulation
-    FileName    = os.path.join(ProjectPath, 'EVALUATIONS', f'AWY_Sim_{Suffix}.csv')
-    Sim         = np.loadtxt(FileName, delimiter=',', skiprows=1)
-    Sim         = Sim.reshape(len(Metric),len(Sim) // len(Metric))
-    Sim         = Sim.transpose() / (3600 * 24 * 365)
+    # Metric, parameters, observed and simulation
+    Params, Metric, Obs, Sim = Load_Results(ProjectPath, 'AWY', Suffix)
+    Metric      = Metric / (3600 * 24 * 365)
+    Obs         = Obs / (3600 * 24 * 365)
+    Sim         = Sim / (3600 * 24 * 365)
 
     # Best Parameters
-    id_min      = np.argmin(Metric)
+    id_min      = np.nanargmin(Metric)
     BestParams  = Params[id_min, :]
     BestAREM    = FactorMetric*Metric[id_min]
     Metric      = FactorMetric*Metric
@@ -1409,7 +2168,7 @@ def Plot_AWY(ProjectPath, Suffix, NameMetric, InVEST_Main_Path, FactorMetric):
 
     # Plot Obs Vs Sim
     ax = axes[0]
-    max_val = max(np.max(Obs), np.max(Sim)) * 1.1
+    max_val = max(np.nanmax(Obs), np.nanmax(Sim)) * 1.1
     ax.plot([0, max_val], [0, max_val], linewidth=1.2, color=[0.8, 0.8, 0.8])
     ax.scatter(Obs, Sim[:, id_min], s=100, edgecolor=[0, 0.5, 0.5], facecolor=[0, 0.7, 0.7],alpha=0.2, linewidth=1.2)
     ax.set_xlabel(r'Observed $(\mathrm{m}^3/\mathrm{s})$', fontsize=16)
@@ -1466,29 +2225,11 @@ def Plot_AWY(ProjectPath, Suffix, NameMetric, InVEST_Main_Path, FactorMetric):
 
 def Plot_SWY(ProjectPath, Suffix, NameMetric, InVEST_Main_Path, FactorMetric):
 
-    # Metric and parameters
-    FileName    = os.path.join(ProjectPath, 'EVALUATIONS', f'SWY_Metric_{Suffix}.csv')
-    Tmp         = np.loadtxt(FileName, delimiter=',', skiprows=1)
-    Params      = Tmp[:, :4]
-    Metric      = Tmp[:, 4]
-
-    # Observed
-    FileName    = os.path.join(ProjectPath, 'EVALUATIONS', f'SWY_Obs_{Suffix}.csv')
-    Obs         = np.loadtxt(FileName, delimiter=',', skiprows=1)
-    NGauges     = len(Obs) // len(Metric)
-    Obs         = Obs.reshape(len(Metric),NGauges)
-    Obs         = Obs.transpose()
-    Obs         = Obs[:, 0]
-    Obs         = Obs.reshape(NGauges,1)
-
-    # Simulation
-    FileName    = os.path.join(ProjectPath, 'EVALUATIONS', f'SWY_Sim_{Suffix}.csv')
-    Sim         = np.loadtxt(FileName, delimiter=',', skiprows=1)
-    Sim         = Sim.reshape(len(Metric),len(Sim) // len(Metric))
-    Sim         = Sim.transpose()
+    # Metric, parameters, observed and simulation
+    Params, Metric, Obs, Sim = Load_Results(ProjectPath, 'SWY', Suffix)
 
     # Best Parameters
-    id_min      = np.argmin(Metric)
+    id_min      = np.nanargmin(Metric)
     BestParams  = Params[id_min, :]
     BestAREM    = FactorMetric * Metric[id_min]
     Metric      = FactorMetric * Metric
@@ -1498,7 +2239,7 @@ def Plot_SWY(ProjectPath, Suffix, NameMetric, InVEST_Main_Path, FactorMetric):
 
     # Plot Obs Vs Sim
     ax = axes[0,0]
-    max_val = max(np.max(Obs), np.max(Sim)) * 1.1
+    max_val = max(np.nanmax(Obs), np.nanmax(Sim)) * 1.1
     ax.plot([0, max_val], [0, max_val], linewidth=1.2, color=[0.8, 0.8, 0.8])
     ax.scatter(Obs, Sim[:, id_min], s=100, edgecolor=[0, 0.5, 0.5], facecolor=[0, 0.7, 0.7],alpha=0.2, linewidth=1.2)
     ax.set_xlabel(r'Observed $(mm)$', fontsize=16)
@@ -1573,29 +2314,11 @@ def Plot_SWY(ProjectPath, Suffix, NameMetric, InVEST_Main_Path, FactorMetric):
 
 def Plot_SDR(ProjectPath, Suffix, NameMetric, InVEST_Main_Path, FactorMetric):
 
-    # Metric and parameters
-    FileName    = os.path.join(ProjectPath, 'EVALUATIONS', f'SDR_Metric_{Suffix}.csv')
-    Tmp         = np.loadtxt(FileName, delimiter=',', skiprows=1)
-    Params      = Tmp[:, :6]
-    Metric      = Tmp[:, 6]
-
-    # Observed
-    FileName    = os.path.join(ProjectPath, 'EVALUATIONS', f'SDR_Obs_{Suffix}.csv')
-    Obs         = np.loadtxt(FileName, delimiter=',', skiprows=1)
-    NGauges     = len(Obs) // len(Metric)
-    Obs         = Obs.reshape(len(Metric),NGauges)
-    Obs         = Obs.transpose()
-    Obs         = Obs[:, 0]
-    Obs         = Obs.reshape(NGauges,1)
-
-    # Simulation
-    FileName    = os.path.join(ProjectPath, 'EVALUATIONS', f'SDR_Sim_{Suffix}.csv')
-    Sim         = np.loadtxt(FileName, delimiter=',', skiprows=1)
-    Sim         = Sim.reshape(len(Metric),len(Sim) // len(Metric))
-    Sim         = Sim.transpose()
+    # Metric, parameters, observed and simulation
+    Params, Metric, Obs, Sim = Load_Results(ProjectPath, 'SDR', Suffix)
 
     # Best Parameters
-    id_min      = np.argmin(Metric)
+    id_min      = np.nanargmin(Metric)
     BestParams  = Params[id_min, :]
     BestAREM    = FactorMetric * Metric[id_min]
     Metric      = FactorMetric * Metric
@@ -1605,7 +2328,7 @@ def Plot_SDR(ProjectPath, Suffix, NameMetric, InVEST_Main_Path, FactorMetric):
 
     # Plot Obs Vs Sim
     ax = axes[0,0]
-    max_val = max(np.max(Obs), np.max(Sim)) * 1.1
+    max_val = max(np.nanmax(Obs), np.nanmax(Sim)) * 1.1
     ax.plot([0, max_val], [0, max_val], linewidth=1.2, color=[0.8, 0.8, 0.8])
     ax.scatter(Obs, Sim[:, id_min], s=100, edgecolor=[0, 0.5, 0.5], facecolor=[0, 0.7, 0.7],alpha=0.2, linewidth=1.2)
     ax.set_xlabel(r'Observed $(ton/year)$', fontsize=16)
@@ -1698,29 +2421,11 @@ def Plot_SDR(ProjectPath, Suffix, NameMetric, InVEST_Main_Path, FactorMetric):
 
 def Plot_NDR_N(ProjectPath, Suffix, NameMetric, InVEST_Main_Path, FactorMetric):
 
-    # Metric and parameters
-    FileName    = os.path.join(ProjectPath, 'EVALUATIONS', f'NDR_N_Metric_{Suffix}.csv')
-    Tmp         = np.loadtxt(FileName, delimiter=',', skiprows=1)
-    Params      = Tmp[:, :5]
-    Metric      = Tmp[:, 5]
-
-    # Observed
-    FileName    = os.path.join(ProjectPath, 'EVALUATIONS', f'NDR_N_Obs_{Suffix}.csv')
-    Obs         = np.loadtxt(FileName, delimiter=',', skiprows=1)
-    NGauges     = len(Obs) // len(Metric)
-    Obs         = Obs.reshape(len(Metric),NGauges)
-    Obs         = Obs.transpose()
-    Obs         = Obs[:, 0]
-    Obs         = Obs.reshape(NGauges,1)
-
-    # Simulation
-    FileName    = os.path.join(ProjectPath, 'EVALUATIONS', f'NDR_N_Sim_{Suffix}.csv')
-    Sim         = np.loadtxt(FileName, delimiter=',', skiprows=1)
-    Sim         = Sim.reshape(len(Metric),len(Sim) // len(Metric))
-    Sim         = Sim.transpose()
+    # Metric, parameters, observed and simulation
+    Params, Metric, Obs, Sim = Load_Results(ProjectPath, 'NDR_N', Suffix)
 
     # Best Parameters
-    id_min      = np.argmin(Metric)
+    id_min      = np.nanargmin(Metric)
     BestParams  = Params[id_min, :]
     BestAREM    = FactorMetric * Metric[id_min]
     Metric      = FactorMetric * Metric
@@ -1730,7 +2435,7 @@ def Plot_NDR_N(ProjectPath, Suffix, NameMetric, InVEST_Main_Path, FactorMetric):
 
     # Plot Obs Vs Sim
     ax = axes[0,0]
-    max_val = max(np.max(Obs), np.max(Sim)) * 1.1
+    max_val = max(np.nanmax(Obs), np.nanmax(Sim)) * 1.1
     ax.plot([0, max_val], [0, max_val], linewidth=1.2, color=[0.8, 0.8, 0.8])
     ax.scatter(Obs, Sim[:, id_min], s=100, edgecolor=[0, 0.5, 0.5], facecolor=[0, 0.7, 0.7],alpha=0.2, linewidth=1.2)
     ax.set_xlabel(r'Observed $(kg/year)$', fontsize=16)
@@ -1814,29 +2519,11 @@ def Plot_NDR_N(ProjectPath, Suffix, NameMetric, InVEST_Main_Path, FactorMetric):
 
 def Plot_NDR_P(ProjectPath, Suffix, NameMetric, InVEST_Main_Path, FactorMetric):
 
-    # Metric and parameters
-    FileName    = os.path.join(ProjectPath, 'EVALUATIONS', f'NDR_P_Metric_{Suffix}.csv')
-    Tmp         = np.loadtxt(FileName, delimiter=',', skiprows=1)
-    Params      = Tmp[:, :3]
-    Metric      = Tmp[:, 3]
-
-    # Observed
-    FileName    = os.path.join(ProjectPath, 'EVALUATIONS', f'NDR_P_Obs_{Suffix}.csv')
-    Obs         = np.loadtxt(FileName, delimiter=',', skiprows=1)
-    NGauges     = len(Obs) // len(Metric)
-    Obs         = Obs.reshape(len(Metric),NGauges)
-    Obs         = Obs.transpose()
-    Obs         = Obs[:, 0]
-    Obs         = Obs.reshape(NGauges,1)
-
-    # Simulation
-    FileName    = os.path.join(ProjectPath, 'EVALUATIONS', f'NDR_P_Sim_{Suffix}.csv')
-    Sim         = np.loadtxt(FileName, delimiter=',', skiprows=1)
-    Sim         = Sim.reshape(len(Metric),len(Sim) // len(Metric))
-    Sim         = Sim.transpose()
+    # Metric, parameters, observed and simulation
+    Params, Metric, Obs, Sim = Load_Results(ProjectPath, 'NDR_P', Suffix)
 
     # Best Parameters
-    id_min      = np.argmin(Metric)
+    id_min      = np.nanargmin(Metric)
     BestParams  = Params[id_min, :]
     BestAREM    = FactorMetric * Metric[id_min]
     Metric      = FactorMetric * Metric
@@ -1846,7 +2533,7 @@ def Plot_NDR_P(ProjectPath, Suffix, NameMetric, InVEST_Main_Path, FactorMetric):
 
     # Plot Obs Vs Sim
     ax = axes[0,0]
-    max_val = max(np.max(Obs), np.max(Sim)) * 1.1
+    max_val = max(np.nanmax(Obs), np.nanmax(Sim)) * 1.1
     ax.plot([0, max_val], [0, max_val], linewidth=1.2, color=[0.8, 0.8, 0.8])
     ax.scatter(Obs, Sim[:, id_min], s=100, edgecolor=[0, 0.5, 0.5], facecolor=[0, 0.7, 0.7],alpha=0.2, linewidth=1.2)
     ax.set_xlabel(r'Observed $(kg/year)$', fontsize=16)
@@ -2123,7 +2810,7 @@ def zonal_stats_1(vector_path, raster_path, nodata_value=None, global_src_extent
 
 import pyogrio
 
-def calculate_zonal_stats(shapefile_path, raster_path, output_path_shp, ws_id="ws_id", Suffix=""):
+def calculate_zonal_stats(shapefile_path, raster_path, output_path_shp, ws_id="ws_id", Suffix="", SaveShp=True):
     """
     Calcula estadísticas zonales para un raster basado en un shapefile con múltiples polígonos.
 
@@ -2131,52 +2818,35 @@ def calculate_zonal_stats(shapefile_path, raster_path, output_path_shp, ws_id="w
         shapefile_path (str): Ruta al archivo shapefile.
         raster_path (str): Ruta al archivo raster.
         ws_id (str): Nombre del atributo en el shapefile para agrupar los polígonos.
+        SaveShp (bool): Guardar Zonal_<Suffix>.shp en output_path_shp.
 
     Retorna:
-        gpd.GeoDataFrame: GeoDataFrame con las estadísticas zonales calculadas.
+        pd.DataFrame: DataFrame con ws_id y las estadísticas zonales (mean, min, max, median, sum).
     """
-    try:
-        # Cargar el shapefile usando pyogrio como alternativa a Fiona
-        polygons = gpd.read_file(shapefile_path, engine='pyogrio')
-    except Exception as e:
-        raise RuntimeError(f"Error al leer el shapefile: {e}")
-
-    # Verificar que el shapefile y el raster tienen el mismo sistema de referencia
+    # Lectura del raster. El índice zonal se construye una sola vez por shapefile y grilla
     with rasterio.open(raster_path) as src:
-        raster_crs = src.crs
         nodata_value = src.nodatavals[0] if src.nodatavals and src.nodatavals[0] is not None else None
-
-    if polygons.crs != raster_crs:
-        polygons = polygons.to_crs(raster_crs)
-
-    # Calcular estadísticas zonales agrupadas por el atributo 'ws_id'
-    unique_ids = polygons[ws_id].unique()
-    results = []
-
-    for uid in unique_ids:
-        subset = polygons[polygons[ws_id] == uid]
-        stats = zonal_stats(
-            subset,  # Subconjunto del shapefile
-            raster_path,  # Archivo raster
-            stats=["mean", "min", "max", "median","sum"],
-            nodata=nodata_value, # Estadísticas deseadas
-            geojson_out=True  # Devuelve los resultados como GeoJSON
-        )
-        stats_gdf = gpd.GeoDataFrame.from_features(stats)
-        stats_gdf[ws_id] = uid
-        results.append(stats_gdf)
-
-    # Combinar todos los resultados
-    final_result = gpd.GeoDataFrame(pd.concat(results, ignore_index=True))
-
-    # Guardar los resultados en un nuevo shapefile
-    output_path = "Zonal_{}.shp".format(Suffix)
-    try:
-        final_result.to_file(os.path.join(output_path_shp, output_path), driver='ESRI Shapefile')
-    except Exception as e:
-        raise RuntimeError(f"Error al guardar el shapefile de salida: {e}")
-
-    # Convertir los resultados a un DataFrame
-    final_result = pd.DataFrame(final_result)
+        try:
+            Index = Zonal_Index.Get(shapefile_path, src, ws_id)
+        except Exception as e:
+            raise RuntimeError(f"Error al leer el shapefile: {e}")
+        data = src.read(1)
+
+    # Estadísticas zonales de cada polígono, agrupadas por el atributo 'ws_id' (en el orden de su primera aparición)
+    final_result = Index.Stats(data, nodata_value)
+    final_result.insert(0, ws_id, Index.ws_id)
+    Order        = np.argsort(pd.factorize(Index.ws_id)[0], kind='stable')
+    final_result = final_result.iloc[Order].reset_index(drop=True)
+
+    # Guardar los resultados en un nuevo shapefile (los polígonos originales con sus atributos)
+    if SaveShp:
+        output_path = "Zonal_{}.shp".format(Suffix)
+        try:
+            Polygons = Index.Polygons.iloc[Order].reset_index(drop=True)
+            gpd.GeoDataFrame(pd.concat([Polygons.drop(columns=[ws_id]), final_result], axis=1),
+                             geometry=Polygons.geometry.name, crs=Polygons.crs).to_file(
+                os.path.join(output_path_shp, output_path), driver='ESRI Shapefile')
+        except Exception as e:
+            raise RuntimeError(f"Error al guardar el shapefile de salida: {e}")
 
     return final_result
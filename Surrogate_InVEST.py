@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------------
+# Nature For Water Facility - The Nature Conservancy
+# -------------------------------------------------------------------------
+# InVEST - Version 3.15.1 (update July 2025)
+# -------------------------------------------------------------------------
+#                            DESCRIPTION
+# -------------------------------------------------------------------------
+# Modelo sustituto (RBF, proceso gaussiano o bosque aleatorio) entrenado con
+# el almacén de resultados que decide qué candidatos del optimizador se
+# evalúan con InVEST.
+# -------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Package
+# ----------------------------------------------------------------------------------------------------------------------
+import hashlib
+import os
+import pickle
+import warnings
+import numpy as np
+from scipy.interpolate import RBFInterpolator
+from scipy.spatial import cKDTree
+
+# scikit-learn (sustitutos 'gp' y 'rf') es opcional
+try:
+    from sklearn.ensemble import RandomForestRegressor
+    from sklearn.exceptions import ConvergenceWarning
+    from sklearn.gaussian_process import GaussianProcessRegressor
+    from sklearn.gaussian_process.kernels import ConstantKernel, Matern, WhiteKernel
+    Sklearn = True
+except ImportError:
+    Sklearn = False
+
+# Modelos sustitutos: interpolación RBF cúbica (scipy), proceso gaussiano y bosque aleatorio (scikit-learn)
+Surrogate_Kinds = ['rbf', 'gp', 'rf']
+
+class Prediction(np.ndarray):
+    # Simulación estimada por el sustituto (no se ejecutó InVEST). La clase se conserva al pasar entre procesos
+    pass
+
+# Último modelo leído de disco en este proceso ({archivo: (modelo, árbol)})
+_Loaded = {}
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Sustituto
+# ----------------------------------------------------------------------------------------------------------------------
+class Surrogate_Model(object):
+    """
+    Estimación de la simulación por cuenca en función de los parámetros libres, normalizados con sus límites Lower
+    y Upper (los de rango nulo no entran). Kind es 'rbf' (interpolación RBF cúbica), 'gp' (proceso gaussiano con
+    kernel Matérn 5/2 y ruido) o 'rf' (bosque aleatorio de 200 árboles). Un candidato se evalúa con InVEST (Screen
+    retorna None) si:
+        - el sustituto aún no tiene MinTrain evaluaciones reales para entrenarse
+        - cae en la fracción Exploration de exploración (sorteo fijo por vector, igual en todos los procesos)
+        - es prometedor: su error estimado, menos la tolerancia, es menor que el cuantil Quantile de los errores
+          reales. La tolerancia es el percentil 90 del error absoluto con que el sustituto estimó el error de las
+          últimas evaluaciones reales antes de entrenarse con ellas (validación fuera de muestra)
+        - es incierto: está más lejos de la evaluación real más cercana que el doble de la distancia mediana entre
+          evaluaciones reales vecinas
+    Los demás reciben la simulación estimada (Prediction). Fit se llama en el proceso principal con las evaluaciones
+    reales del almacén cada RetrainEvery evaluaciones reales nuevas (Due).
+    Con File, cada modelo entrenado se guarda en <File>_<Version>.pkl (las Keep últimas versiones) y el sustituto
+    viaja a los procesos del pool sin el modelo: cada proceso lo lee una vez por versión. Sin File el modelo se
+    copia con cada evaluación que spotpy envía al pool.
+    """
+    def __init__(self, Lower, Upper, Exploration=0.1, RetrainEvery=10, Quantile=0.2, MinTrain=None, Kind='rbf',
+                 File=None, Keep=3):
+        if Kind not in Surrogate_Kinds:
+            raise ValueError('Unknown surrogate model: ' + str(Kind) + ' (use "rbf", "gp" or "rf")')
+        if Kind != 'rbf' and not Sklearn:
+            raise ImportError('scikit-learn is not installed (use Surrogate="rbf")')
+        self.Kind           = Kind
+        self.Lower          = np.asarray(Lower, dtype=float)
+        self.Upper          = np.asarray(Upper, dtype=float)
+        self.Exploration    = Exploration
+        self.RetrainEvery   = max(1, int(RetrainEvery))
+        self.Quantile       = Quantile
+        self.MinTrain       = MinTrain or max(10, 2*(len(self.Lower) + 1))
+        self.Model          = None
+        self.Tree           = None
+        self.Columns        = None
+        self.Threshold      = np.inf
+        self.Radius         = np.inf
+        self.Tolerance      = np.inf
+        self.Residuals      = []
+        # Modelos entrenados (Version) y archivos que leen los procesos del pool (solo los escribe el proceso dueño)
+        self.Version        = 0
+        self.File           = File
+        self.Keep           = max(2, int(Keep))
+        self.OwnerPid       = os.getpid()
+        # Contadores del proceso principal: evaluaciones reales, estimadas y reales desde el último entrenamiento
+        self.Real           = 0
+        self.Predicted      = 0
+        self.Pending        = 0
+
+    def _Unit(self, X):
+        Active = self.Upper > self.Lower
+        return (np.atleast_2d(X)[:, Active] - self.Lower[Active]) / (self.Upper - self.Lower)[Active]
+
+    def Count(self, Predicted):
+        if Predicted:
+            self.Predicted += 1
+        else:
+            self.Real       += 1
+            self.Pending    += 1
+
+    def Due(self):
+        # Sin modelo se intenta entrenar después de cada evaluación real
+        return self.Pending > 0 and (self.Version == 0 or self.Pending >= self.RetrainEvery)
+
+    def __getstate__(self):
+        # El modelo del proceso dueño ya está en disco: los procesos del pool lo leen con _Ready
+        State = self.__dict__.copy()
+        if self.File is not None and self.Version > 0 and os.getpid() == self.OwnerPid:
+            State['Model'], State['Tree'] = None, None
+        return State
+
+    def _Path(self, Version):
+        return '%s_%d.pkl' % (self.File, Version)
+
+    def _Save(self):
+        # Escritura atómica de la versión nueva; se borra la que sale de las Keep últimas
+        if self.File is None or os.getpid() != self.OwnerPid:
+            return
+        Path = self._Path(self.Version)
+        with open(Path + '.tmp', 'wb') as Model_File:
+            pickle.dump((self.Model, self.Tree), Model_File, pickle.HIGHEST_PROTOCOL)
+        os.replace(Path + '.tmp', Path)
+        if os.path.isfile(self._Path(self.Version - self.Keep)):
+            os.remove(self._Path(self.Version - self.Keep))
+
+    def _Ready(self):
+        # Modelo de esta versión en memoria (en los procesos del pool se lee del archivo una vez por versión). Si el
+        # archivo ya no existe (versión antigua) el candidato se evalúa con InVEST
+        if self.Model is not None:
+            return True
+        Path = self._Path(self.Version)
+        if Path not in _Loaded:
+            if not os.path.isfile(Path):
+                return False
+            with open(Path, 'rb') as Model_File:
+                Model = pickle.load(Model_File)
+            _Loaded.clear()
+            _Loaded[Path] = Model
+        self.Model, self.Tree = _Loaded[Path]
+        return True
+
+    def Remove(self):
+        # Borra los modelos guardados (al terminar la calibración)
+        if self.File is None or os.getpid() != self.OwnerPid:
+            return
+        for Version in range(max(1, self.Version - self.Keep + 1), self.Version + 1):
+            if os.path.isfile(self._Path(Version)):
+                os.remove(self._Path(Version))
+
+    def Predict(self, Unit):
+        # Simulación estimada en puntos ya normalizados (NaN en las cuencas que no se estiman)
+        Sim = np.full((len(Unit), len(self.Columns)), np.nan)
+        if len(Unit) > 0:
+            Sim[:, self.Columns] = np.reshape(self.Model(Unit) if self.Kind == 'rbf' else self.Model.predict(Unit),
+                                              (len(Unit), -1))
+        return Sim
+
+    def _Train(self, X, Y):
+        # Modelo de Kind entrenado con los puntos normalizados X y las simulaciones Y
+        if self.Kind == 'rbf':
+            return RBFInterpolator(X, Y, kernel='cubic')
+        if self.Kind == 'gp':
+            Kernel  = ConstantKernel()*Matern(length_scale=np.ones(X.shape[1]), nu=2.5) + WhiteKernel(1e-5)
+            Model   = GaussianProcessRegressor(Kernel, normalize_y=True, n_restarts_optimizer=2, random_state=0)
+        else:
+            Model   = RandomForestRegressor(n_estimators=200, random_state=0)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', ConvergenceWarning)
+            return Model.fit(X, Y[:, 0] if Y.shape[1] == 1 else Y)
+
+    def Fit(self, X, Sim, Error, ErrorFunction):
+        """
+        Entrena con las evaluaciones reales X (n x p), Sim (n x g) y su error (n). Se descartan los vectores
+        repetidos y las evaluaciones sin error; las cuencas sin simulación en alguna evaluación no se estiman (NaN).
+        Antes de entrenar, el modelo anterior estima el error de las evaluaciones que aún no conocía (ErrorFunction
+        calcula el error de una simulación) para actualizar la tolerancia.
+        """
+        self.Pending = 0
+        X, Sim, Error = np.atleast_2d(X), np.atleast_2d(Sim), np.asarray(Error, dtype=float)
+        Columns = np.isfinite(Sim).all(axis=0)
+        Rows    = np.isfinite(Error) & np.isfinite(Sim[:, Columns]).all(axis=1)
+        X, Sim, Error = self._Unit(X[Rows]), Sim[Rows], Error[Rows]
+        X, Index = np.unique(X, axis=0, return_index=True)
+        Sim, Error = Sim[Index], Error[Index]
+        if len(X) < self.MinTrain or not Columns.any():
+            return False
+
+        # Validación fuera de muestra con las evaluaciones nuevas (se guardan las últimas 100)
+        if self.Version > 0 and self._Ready():
+            New = self.Tree.query(X)[0] > 0
+            self.Residuals += [abs(ErrorFunction(Item) - Value)
+                               for Item, Value in zip(self.Predict(X[New]), Error[New])]
+            self.Residuals  = self.Residuals[-100:]
+        try:
+            Model = self._Train(X, Sim[:, Columns])
+        except (np.linalg.LinAlgError, ValueError):
+            # Se conserva el modelo anterior (p. ej. puntos en un subespacio)
+            return False
+
+        self.Model, self.Columns = Model, Columns
+        self.Tree       = cKDTree(X)
+        self.Threshold  = np.quantile(Error, self.Quantile)
+        self.Radius     = 2*np.median(self.Tree.query(X, k=2)[0][:, 1])
+        # Sin validación todavía no hay tolerancia: los candidatos se evalúan hasta el siguiente entrenamiento
+        self.Tolerance  = np.quantile(self.Residuals, 0.9) if self.Residuals else np.inf
+        self.Version   += 1
+        self._Save()
+        return True
+
+    def Explore(self, x):
+        # Sorteo uniforme fijo para cada vector: el mismo en los procesos del pool y al reanudar
+        return int.from_bytes(hashlib.sha1(x.tobytes()).digest()[:8], 'little') / 2**64 < self.Exploration
+
+    def Screen(self, x, ErrorFunction):
+        """
+        Retorna la simulación estimada (Prediction) si el candidato x no necesita InVEST, o None si hay que evaluarlo.
+        ErrorFunction calcula el error (menor es mejor) de una simulación.
+        """
+        x = np.asarray(x, dtype=float)
+        if self.Version == 0 or self.Explore(x) or not self._Ready():
+            return None
+        Unit        = self._Unit(x)
+        if self.Tree.query(Unit)[0][0] > self.Radius:
+            return None
+        Sim         = self.Predict(Unit)[0]
+        if ErrorFunction(Sim) - self.Tolerance < self.Threshold:
+            return None
+        return Sim.view(Prediction)
+
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------------
+# Nature For Water Facility - The Nature Conservancy
+# -------------------------------------------------------------------------
+# InVEST - Version 3.15.1 (update July 2025)
+# -------------------------------------------------------------------------
+#                            DESCRIPTION
+# -------------------------------------------------------------------------
+# Tiempos por etapa de cada evaluación (tabla biofísica, InVEST, zonal,
+# almacén de resultados) y exportación como traza de Chrome/Perfetto.
+# -------------------------------------------------------------------------
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Package
+# ----------------------------------------------------------------------------------------------------------------------
+import json
+import time
+import contextlib
+import numpy as np
+import pandas as pd
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Registro de etapas del proceso: [Nombre, inicio (s epoch), duración (s)]
+# ----------------------------------------------------------------------------------------------------------------------
+_Spans = []
+# Etapas abiertas (la última es la etapa en curso; la lee el monitor de recursos)
+_Open  = []
+
+@contextlib.contextmanager
+def Stage(Name):
+    # Mide el bloque aunque termine con una excepción o con un return
+    Start = time.time()
+    _Open.append(Name)
+    try:
+        yield
+    finally:
+        _Open.pop()
+        _Spans.append([Name, Start, time.time() - Start])
+
+def Current_Stage():
+    # Etapa en curso del proceso, p. ej. 'evaluation/sdr.execute' ('' fuera de una etapa)
+    return '/'.join(_Open)
+
+def Take_Stages():
+    # Etapas registradas desde la última llamada (el registro queda vacío)
+    Spans = list(_Spans)
+    del _Spans[:]
+    return Spans
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Resumen y traza
+# ----------------------------------------------------------------------------------------------------------------------
+def Stage_Summary(Stages):
+    """
+    Tabla de tiempos por etapa a partir de una lista de registros (una lista de etapas por evaluación):
+    número de llamadas, tiempo total (s) y percentiles 50 y 95 de cada llamada (ms). Ordenada por tiempo total.
+    """
+    Times = {}
+    for Spans in Stages:
+        for Name, _, Duration in Spans:
+            Times.setdefault(Name, []).append(Duration)
+
+    Summary = pd.DataFrame([[Name, len(Values), np.sum(Values), 1e3*np.percentile(Values, 50),
+                             1e3*np.percentile(Values, 95)] for Name, Values in Times.items()],
+                           columns=['Stage', 'Calls', 'Total_s', 'p50_ms', 'p95_ms'])
+    return Summary.sort_values('Total_s', ascending=False).set_index('Stage')
+
+def Write_Trace(PathTrace, Records):
+    """
+    Guarda una traza en formato Chrome Trace Event (chrome://tracing, ui.perfetto.dev). Records es una lista de
+    (pid, etapas); cada proceso aparece en su propia fila.
+    """
+    Events = [{'name': Name, 'cat': 'InVEST', 'ph': 'X', 'ts': 1e6*Start, 'dur': 1e6*Duration, 'pid': int(Pid),
+               'tid': int(Pid)}
+              for Pid, Spans in Records for Name, Start, Duration in Spans]
+    Events.sort(key=lambda Event: Event['ts'])
+    with open(PathTrace, 'w') as ID_File:
+        json.dump({'traceEvents': Events, 'displayTimeUnit': 'ms'}, ID_File)
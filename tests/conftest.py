@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------------
+# Nature For Water Facility - The Nature Conservancy
+# -------------------------------------------------------------------------
+# InVEST - Version 3.15.1 (update July 2025)
+# -------------------------------------------------------------------------
+#                            DESCRIPTION
+# -------------------------------------------------------------------------
+# Proyecto de prueba de las pruebas (Dummy_InVEST.zip descomprimido).
+# -------------------------------------------------------------------------
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(scope='session')
+def Dummy(tmp_path_factory):
+    # Las pruebas ejecutan InVEST: sin natcap.invest (o fuera de Windows, sin pywin32) se omiten
+    pytest.importorskip('natcap.invest')
+    pytest.importorskip('win32com.client')
+    from Benchmark_InVEST import Unpack_Dummy
+    ProjectPath = Unpack_Dummy(str(tmp_path_factory.mktemp('Dummy')))
+    return ProjectPath, os.path.join(ProjectPath, 'Main_InVEST.xlsx')
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------------
+# Nature For Water Facility - The Nature Conservancy
+# -------------------------------------------------------------------------
+# InVEST - Version 3.15.1 (update July 2025)
+# -------------------------------------------------------------------------
+#                            DESCRIPTION
+# -------------------------------------------------------------------------
+# Optimizadores y tamizado con un modelo analítico (sin InVEST): con la
+# misma semilla, la ejecución en paralelo ('mpc') da el mismo resultado
+# que la secuencial ('seq').
+# -------------------------------------------------------------------------
+import os
+import numpy as np
+import pytest
+
+spotpy = pytest.importorskip('spotpy')
+pytest.importorskip('pathos')
+
+from Algorithms_InVEST import FAST, Parallel_DDS, Batched_SCEUA
+from Screening_InVEST import FAST_Indices
+
+class Ishigami(object):
+    # Función de Ishigami en los dos primeros parámetros; el tercero no influye en la respuesta
+    def __init__(self):
+        self.params = [spotpy.parameter.Uniform('a', -np.pi, np.pi),
+                       spotpy.parameter.Uniform('b', -np.pi, np.pi),
+                       spotpy.parameter.Uniform('c', -np.pi, np.pi)]
+
+    def parameters(self):
+        return spotpy.parameter.generate(self.params)
+
+    def simulation(self, vector):
+        return [np.sin(vector[0]) + 7.0*np.sin(vector[1])**2]
+
+    def evaluation(self):
+        return [0.0]
+
+    def objectivefunction(self, simulation, evaluation, params=None):
+        return abs(simulation[0] - evaluation[0])
+
+class Noisy_Ishigami(Ishigami):
+    # Como un modelo con sorteos propios: usa el generador global de numpy (en 'seq' en el proceso del optimizador)
+    def simulation(self, vector):
+        np.random.rand()
+        return super(Noisy_Ishigami, self).simulation(vector)
+
+def Run_FAST(Path, Parallel):
+    # FAST sortea el desfase de las frecuencias con el generador global (Screen_Parameters fija la semilla)
+    np.random.seed(7)
+    Sampler = FAST(Ishigami(), parallel=Parallel, dbname=os.path.join(str(Path), 'FAST_' + Parallel),
+                   dbformat='csv', random_state=7)
+    Sampler.sample(400)
+    Error   = Sampler.getdata()['like1']
+    return Error, FAST_Indices(Sampler, [-np.pi]*3, [np.pi]*3, ['a', 'b', 'c'], Error)
+
+def test_FAST_Parallel(tmp_path):
+    Error, Indices          = Run_FAST(tmp_path, 'seq')
+    ErrorMpc, IndicesMpc    = Run_FAST(tmp_path, 'mpc')
+    assert len(Error) >= 400
+    np.testing.assert_array_equal(Error, ErrorMpc)
+    np.testing.assert_allclose(Indices[['S1', 'ST']].values, IndicesMpc[['S1', 'ST']].values)
+    assert Indices.set_index('Parameter').loc['c', 'ST'] < 0.05 < Indices.set_index('Parameter').loc['b', 'ST']
+
+@pytest.mark.parametrize('Sampler, Options', [(Batched_SCEUA, {'Complexes': 3}), (Parallel_DDS, {'Batch': 4})])
+def test_Optimizer_Parallel(tmp_path, Sampler, Options):
+    Data = []
+    for Parallel in ['seq', 'mpc']:
+        # spotpy estima los límites de los parámetros con el generador global (RunCalInVEST fija la semilla)
+        np.random.seed(11)
+        Optimizer = Sampler(Noisy_Ishigami(), parallel=Parallel, dbname=os.path.join(str(tmp_path), Parallel),
+                            dbformat='csv', random_state=11, **Options)
+        Optimizer.sample(60)
+        Data.append(Optimizer.getdata())
+    assert len(Data[0]) == 60
+    for Name in ['like1', 'para', 'parb', 'parc']:
+        np.testing.assert_array_equal(Data[0][Name], Data[1][Name])
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------------
+# Nature For Water Facility - The Nature Conservancy
+# -------------------------------------------------------------------------
+# InVEST - Version 3.15.1 (update July 2025)
+# -------------------------------------------------------------------------
+#                            DESCRIPTION
+# -------------------------------------------------------------------------
+# Caché de evaluaciones e índice zonal (sin InVEST).
+# -------------------------------------------------------------------------
+import os
+import time
+import shutil
+import numpy as np
+import pandas as pd
+import pytest
+
+from Cache_InVEST import Eval_Cache, Zonal_Index
+
+def test_Eval_Cache_Key(tmp_path):
+    Cache   = Eval_Cache(os.path.join(str(tmp_path), 'Cache.sqlite'))
+    PathA   = os.path.join(str(tmp_path), 'A.csv')
+    PathB   = os.path.join(str(tmp_path), 'B.csv')
+    with open(PathA, 'w') as File:
+        File.write('lucode,Kc\n1,0.5\n')
+    shutil.copyfile(PathA, PathB)
+    Table   = pd.DataFrame({'lucode': [1], 'Kc': [0.5]})
+    args    = {'lulc_path': PathA, 'seasonality_constant': 5.0, 'workspace_dir': 'W1', 'n_workers': -1}
+    Key     = Cache.Key('AWY', args, Table)
+
+    # Los archivos se identifican por su contenido y los argumentos ignorados no cambian la clave
+    assert Cache.Key('AWY', dict(args, lulc_path=PathB, workspace_dir='W2', n_workers=4), Table) == Key
+    assert Cache.Key('AWY', dict(args, seasonality_constant=5.5), Table) != Key
+    assert Cache.Key('AWY', args, Table.assign(Kc=0.6)) != Key
+    assert Cache.Key('SWY', args, Table) != Key
+    with open(PathB, 'a') as File:
+        File.write('2,0.7\n')
+    assert Cache.Key('AWY', dict(args, lulc_path=PathB), Table) != Key
+
+def test_Eval_Cache_Eviction(tmp_path):
+    Cache   = Eval_Cache(os.path.join(str(tmp_path), 'Cache.sqlite'))
+    ws_id   = np.array([1.0, 2.0])
+    Cache.Put('A', 'AWY', ws_id, np.array([1.0, 2.0]))
+    Size    = Cache.Stats()['bytes']
+
+    # Caben dos entradas: la tercera desaloja la usada hace más tiempo (B, porque A se leyó después)
+    Cache   = Eval_Cache(Cache.PathDB, MaxMB=2.5*Size/2**20)
+    time.sleep(0.01)
+    Cache.Put('B', 'AWY', ws_id, np.array([3.0, 4.0]))
+    time.sleep(0.01)
+    np.testing.assert_array_equal(Cache.Get('A')[1], [1.0, 2.0])
+    time.sleep(0.01)
+    Cache.Put('C', 'AWY', ws_id, np.array([5.0, 6.0]))
+    assert Cache.Get('B') is None and not Cache.LastHit
+    assert Cache.Get('C') is not None and Cache.LastHit
+    Stats = Cache.Stats()
+    assert (Stats['entries'], Stats['evictions'], Stats['hits'], Stats['misses']) == (2, 1, 2, 1)
+
+def test_Zonal_Stats(tmp_path):
+    rasterio        = pytest.importorskip('rasterio')
+    gpd             = pytest.importorskip('geopandas')
+    rasterstats     = pytest.importorskip('rasterstats')
+    from rasterio.transform import from_origin
+    from shapely.geometry import box
+
+    # Ráster de 8 x 10 con nodata y NaN; cuencas anidadas, una parcialmente fuera del ráster y una sin píxeles
+    PathRaster  = os.path.join(str(tmp_path), 'Data.tif')
+    Data        = np.random.RandomState(3).gamma(2.0, 3.0, (8, 10)).astype('float32')
+    Data[0, :4] = -1.0
+    Data[5, 5]  = np.nan
+    with rasterio.open(PathRaster, 'w', driver='GTiff', width=10, height=8, count=1, dtype='float32', nodata=-1.0,
+                       crs='EPSG:32618', transform=from_origin(500000, 4000080, 10, 10)) as Dst:
+        Dst.write(Data, 1)
+    PathShape   = os.path.join(str(tmp_path), 'Basin.shp')
+    Polygons    = gpd.GeoDataFrame({'ws_id': [1, 2, 3, 4]},
+                                   geometry=[box(500000, 4000000, 500100, 4000080),
+                                             box(500012, 4000033, 500058, 4000077),
+                                             box(500070, 4000010, 500150, 4000050),
+                                             box(600000, 4000000, 600010, 4000010)], crs='EPSG:32618')
+    Polygons.to_file(PathShape)
+
+    with rasterio.open(PathRaster) as Src:
+        Index   = Zonal_Index(PathShape, Src)
+        Stats   = Index.Stats(Src.read(1), Src.nodata)
+    Names       = ['mean', 'min', 'max', 'median', 'sum']
+    Expected    = pd.DataFrame(rasterstats.zonal_stats(PathShape, PathRaster, stats=Names))[Names].astype(float)
+    np.testing.assert_array_equal(Index.ws_id, [1, 2, 3, 4])
+    assert Index.Overlap
+    np.testing.assert_allclose(Stats[Names].values, Expected.values, rtol=1e-6)
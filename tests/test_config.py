@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------------
+# Nature For Water Facility - The Nature Conservancy
+# -------------------------------------------------------------------------
+# InVEST - Version 3.15.1 (update July 2025)
+# -------------------------------------------------------------------------
+#                            DESCRIPTION
+# -------------------------------------------------------------------------
+# Validación del libro de configuración con hojas en memoria (sin Excel).
+# -------------------------------------------------------------------------
+import numpy as np
+import pandas as pd
+
+from Config_InVEST import _Validate, _Run, _Index, Models, UserDataRows, ParamsRows
+
+def Book(Run, Model='SDR'):
+    # Hojas como las lee pd.read_excel sin índice; todos los parámetros son de Model salvo Z (AWY)
+    Rows        = ['Run'] + list(UserDataRows.values())
+    UserData    = pd.DataFrame({'Field': Rows, 'Value': ['x']*len(Rows)})
+    for Name in Models:
+        UserData[Name] = [Run.get(Name, 0)] + ['x']*(len(Rows) - 1)
+    Names       = list(ParamsRows.values())
+    Params      = pd.DataFrame({'Name'  : Names,
+                                'Model' : ['AWY' if Name == 'Z' else Model for Name in Names],
+                                'Min'   : [0.0]*len(Names),
+                                'Max'   : [1.0]*len(Names),
+                                'Value' : [0.5]*len(Names)})
+    return {'UserData': UserData, 'Params': Params, 'Obs_Data': pd.DataFrame({'ws_id': [1], 'Value': [1.0]})}
+
+def test_Valid():
+    assert _Validate(Book({'SDR': 1})) == []
+
+def test_Run_Empty():
+    Tables = Book({'SDR': 1, 'AWY': np.nan})
+    assert _Validate(Tables) == []
+    UserData = _Index(Tables['UserData'])
+    assert _Run(UserData, 'AWY') == 0 and _Run(UserData, 'SDR') == 1
+
+def test_Run_Invalid():
+    assert _Validate(Book({'SDR': 2})) == ['UserData: Run of SDR must be 0, 1 or empty']
+
+def test_Params_Active_Models():
+    # Los parámetros sólo se revisan para los modelos que se ejecutan
+    Tables = Book({'SDR': 1})
+    Tables['Params'].loc[Tables['Params']['Name'] == 'Z', ['Min', 'Max']] = [2.0, 1.0]
+    assert _Validate(Tables) == []
+    Tables['UserData']['AWY'] = Tables['UserData']['SDR']
+    assert _Validate(Tables) == ['Params: Min > Max for Z']
+    Tables['Params']['Value'] = Tables['Params']['Value'].astype(object)
+    Tables['Params'].loc[Tables['Params']['Name'] == 'Z', 'Value'] = 'a'
+    assert _Validate(Tables) == ['Params: non-numeric Min/Max/Value for Z']
+
+def test_Missing():
+    Tables = Book({'SDR': 1})
+    del Tables['Obs_Data']
+    assert _Validate(Tables) == ['missing sheet Obs_Data']
+    Tables = Book({'SDR': 1})
+    Tables['UserData'] = Tables['UserData'].drop(columns='NDR_P')
+    Tables['Obs_Data'] = Tables['Obs_Data'].rename(columns={'ws_id': 'id'})
+    assert _Validate(Tables) == ['UserData: missing column NDR_P', 'Obs_Data: missing column ws_id']
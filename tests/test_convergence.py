@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------------
+# Nature For Water Facility - The Nature Conservancy
+# -------------------------------------------------------------------------
+# InVEST - Version 3.15.1 (update July 2025)
+# -------------------------------------------------------------------------
+#                            DESCRIPTION
+# -------------------------------------------------------------------------
+# Criterios de parada de la calibración.
+# -------------------------------------------------------------------------
+import numpy as np
+
+from Convergence_InVEST import Convergence
+
+def Run(Criteria, Errors):
+    # Evaluación (1, 2, ...) en la que se detiene la calibración y motivo (None si no se detiene)
+    for i, Error in enumerate(Errors):
+        Reason = Criteria.Update(Error)
+        if Reason is not None:
+            return i + 1, Reason
+    return None, None
+
+def test_Inactive():
+    Criteria = Convergence()
+    assert not Criteria.Active()
+    assert Run(Criteria, [5.0, 4.0, 4.0, 4.0]) == (None, None)
+
+def test_Patience():
+    Criteria = Convergence(Patience=2)
+    assert Criteria.Active()
+    Stop, Reason = Run(Criteria, [5.0, 4.0, 4.5, np.nan, 3.0])
+    assert Stop == 4 and Reason.startswith('no improvement')
+    assert Criteria.State()['best'] == 4.0 and Criteria.State()['best_evaluation'] == 2
+
+def test_Min_Improvement():
+    # 9.5 no mejora en 10 % a 10 y 8.5 sí (la paciencia se cuenta de nuevo desde la evaluación 3)
+    assert Run(Convergence(Patience=2, MinImprovement=0.1), [10.0, 9.5, 8.5, 8.0, 8.0])[0] == 5
+    assert Run(Convergence(Patience=2, MinImprovement=0.1), [10.0, 9.5, 9.5])[0] == 3
+
+def test_Target_Metric():
+    Stop, Reason = Run(Convergence(TargetMetric=1.0), [5.0, 0.8, 0.5])
+    assert Stop == 2 and Reason.startswith('target metric')
+
+def test_Max_Minutes():
+    Criteria = Convergence(MaxMinutes=1)
+    assert Criteria.Update(5.0) is None
+    Criteria.StartTime -= 61
+    assert Criteria.Update(5.0).startswith('time budget')
+    # Start reinicia el tiempo (al reanudar)
+    Criteria.Start()
+    assert Criteria.Update(5.0) is None
+    assert Criteria.State()['evaluations'] == 3
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------------
+# Nature For Water Facility - The Nature Conservancy
+# -------------------------------------------------------------------------
+# InVEST - Version 3.15.1 (update July 2025)
+# -------------------------------------------------------------------------
+#                            DESCRIPTION
+# -------------------------------------------------------------------------
+# Reparto de las evaluaciones entre las fases de fidelidad y candidatos
+# que pasan de una fase a la siguiente.
+# -------------------------------------------------------------------------
+import numpy as np
+import pytest
+
+pytest.importorskip('rasterio')
+
+from Fidelity_InVEST import Fidelity_Phases, Top_Candidates, Narrow_Bounds
+
+def test_Fidelity_Phases():
+    assert Fidelity_Phases(100) == [(1, 100)]
+    assert Fidelity_Phases(100, [1]) == [(1, 100)]
+    Phases = Fidelity_Phases(100, [2, 4, 4], CoarseShare=0.5, TopK=5)
+    assert Phases == [(4, 25), (2, 20), (1, 45)]
+    # Las fases después de la primera reevalúan los TopK mejores: el total sigue siendo NumSim
+    assert sum(Sim for _, Sim in Phases) + 5*(len(Phases) - 1) == 100
+    with pytest.raises(ValueError):
+        Fidelity_Phases(12, [2, 4], TopK=5)
+
+def test_Top_Candidates():
+    Params  = np.array([[1.0, 1.0], [2.0, 2.0], [1.0, 1.0], [3.0, 3.0], [4.0, 4.0]])
+    Metric  = np.array([0.5, np.nan, 0.5, 0.7, 0.1])
+    np.testing.assert_array_equal(Top_Candidates(Params, Metric, TopK=3), [[4.0, 4.0], [1.0, 1.0], [3.0, 3.0]])
+
+def test_Narrow_Bounds():
+    Lower, Upper = Narrow_Bounds(np.array([[0.2, 5.0], [0.4, 9.5]]), [0.0, 0.0], [1.0, 10.0])
+    np.testing.assert_allclose(Lower, [0.1, 4.0])
+    np.testing.assert_allclose(Upper, [0.5, 10.0])
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------------
+# Nature For Water Facility - The Nature Conservancy
+# -------------------------------------------------------------------------
+# InVEST - Version 3.15.1 (update July 2025)
+# -------------------------------------------------------------------------
+#                            DESCRIPTION
+# -------------------------------------------------------------------------
+# Paridad de los motores nativos de calibración con los modelos de InVEST
+# sobre Dummy_InVEST.zip.
+# -------------------------------------------------------------------------
+import pytest
+
+@pytest.mark.parametrize('NameModel', ['AWY', 'SWY', 'SDR', 'NDR_N', 'NDR_P'])
+def test_Parity(Dummy, NameModel):
+    import Spotpy_InVEST
+    Status, Results = Spotpy_InVEST.Check_Parity(*Dummy, NameModel)
+    assert Status, Results.to_string()
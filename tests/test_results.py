@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------------
+# Nature For Water Facility - The Nature Conservancy
+# -------------------------------------------------------------------------
+# InVEST - Version 3.15.1 (update July 2025)
+# -------------------------------------------------------------------------
+#                            DESCRIPTION
+# -------------------------------------------------------------------------
+# Almacén de resultados, evaluaciones para reanudar y punto de control
+# (sin InVEST).
+# -------------------------------------------------------------------------
+import os
+import numpy as np
+import pytest
+
+from Results_InVEST import Results_Store, Read_Results, Read_Replay, Last_Id, Read_Checkpoint, Write_Checkpoint
+
+Names   = ['Z', 'Factor-Kc']
+ws_id   = [1, 2, 3]
+Obs     = [10.0, 20.0, 30.0]
+
+def New_Store(tmp_path, Names=Names, BatchSize=50):
+    return Results_Store(os.path.join(str(tmp_path), 'AWY_Results_Test.sqlite'), Names, ws_id, Obs, 'RMSE',
+                         BatchSize=BatchSize)
+
+def test_Store_Read(tmp_path):
+    Store = New_Store(tmp_path)
+    Store.Add([1.0, 0.5], 3.0, [11.0, np.nan, 29.0], WallTime=2.0, Cache='miss', Stages=[['invest', 0.0, 2.0]],
+              WrittenMB=12.0, KeptMB=1.0)
+    Store.Add([2.0, 0.7], 1.0, [10.0, 21.0, 30.0], Fidelity=2)
+    Store.Add([3.0, 0.9], 5.0, [9.0, 19.0, 31.0], Screening=True)
+    # Las filas se escriben por lotes
+    assert len(Read_Results(Store.PathDB)['Metric']) == 0
+    Store.Flush()
+    Store.Set_Meta('stop', {'reason': 'target metric reached'})
+
+    Results = Read_Results(Store.PathDB)
+    assert Results['ParamNames'] == Names and Results['NameFunObj'] == 'RMSE'
+    assert Results['Stop'] == {'reason': 'target metric reached'}
+    np.testing.assert_array_equal(Results['ws_id'], ws_id)
+    np.testing.assert_array_equal(Results['Obs'], Obs)
+    np.testing.assert_array_equal(Results['Params'], [[1.0, 0.5], [2.0, 0.7], [3.0, 0.9]])
+    np.testing.assert_array_equal(Results['Sim'][0], [11.0, np.nan, 29.0])
+    np.testing.assert_array_equal(Results['Metric'], [3.0, 1.0, 5.0])
+    np.testing.assert_array_equal(Results['Fidelity'], [1, 2, 1])
+    np.testing.assert_array_equal(Results['Screening'], [False, False, True])
+    np.testing.assert_array_equal(Results['WrittenMB'], [12.0, np.nan, np.nan])
+    np.testing.assert_array_equal(Results['KeptMB'], [1.0, np.nan, np.nan])
+    assert Results['Cache'][0] == 'miss' and Results['Stages'][0] == [['invest', 0.0, 2.0]]
+
+    # Filtros por fidelidad y tamizado
+    assert len(Read_Results(Store.PathDB, Fidelity=1, Screening=False)['Metric']) == 1
+    assert len(Read_Results(Store.PathDB, Screening=True)['Metric']) == 1
+
+def test_Store_Params_Order(tmp_path):
+    New_Store(tmp_path)
+    New_Store(tmp_path)
+    with pytest.raises(ValueError):
+        New_Store(tmp_path, Names=Names[::-1])
+
+def test_Replay_Checkpoint(tmp_path):
+    # Una calibración anterior, el punto de control de la nueva y sus evaluaciones antes de la interrupción
+    Store = New_Store(tmp_path, BatchSize=1)
+    Store.Add([9.0, 0.1], 7.0, [1.0, 2.0, 3.0])
+    PathCheckpoint = os.path.join(str(tmp_path), 'AWY_Checkpoint.json')
+    Write_Checkpoint(PathCheckpoint, {'FirstId': Last_Id(Store.PathDB), 'Seed': 5})
+    assert not os.path.exists(PathCheckpoint + '.tmp')
+
+    Store.Add([1.0, 0.5], 3.0, [11.0, 21.0, 29.0])
+    Store.Add([1.0, 0.5], 3.0, [12.0, 22.0, 28.0])
+    Store.Add([2.0, 0.7], 1.0, [10.0, 20.0, 30.0], Fidelity=2)
+    Store.Add([3.0, 0.9], 5.0, [9.0, 19.0, 31.0], Screening=True)
+
+    Checkpoint = Read_Checkpoint(PathCheckpoint)
+    assert Checkpoint == {'FirstId': 1, 'Seed': 5}
+    Replay = Read_Replay(Store.PathDB, Checkpoint['FirstId'])
+    assert list(Replay) == [np.array([1.0, 0.5]).tobytes()]
+    np.testing.assert_array_equal(Replay[np.array([1.0, 0.5]).tobytes()], [[11.0, 21.0, 29.0], [12.0, 22.0, 28.0]])
+    assert list(Read_Replay(Store.PathDB, Checkpoint['FirstId'], Fidelity=2)) == [np.array([2.0, 0.7]).tobytes()]
+    assert list(Read_Replay(Store.PathDB, Checkpoint['FirstId'], Screening=True)) == [np.array([3.0, 0.9]).tobytes()]
+
+    assert Read_Checkpoint(os.path.join(str(tmp_path), 'None.json')) is None
+    assert Read_Replay(os.path.join(str(tmp_path), 'None.sqlite')) == {}
+    assert Last_Id(os.path.join(str(tmp_path), 'None.sqlite')) == 0
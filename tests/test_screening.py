@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# -------------------------------------------------------------------------
+# Nature For Water Facility - The Nature Conservancy
+# -------------------------------------------------------------------------
+# InVEST - Version 3.15.1 (update July 2025)
+# -------------------------------------------------------------------------
+#                            DESCRIPTION
+# -------------------------------------------------------------------------
+# Tamaño del tamizado FAST y selección de los parámetros sensibles.
+# -------------------------------------------------------------------------
+import pandas as pd
+
+from Screening_InVEST import Screening_Sim, Select_Parameters, Population_Size, M
+
+def test_Screening_Sim():
+    # Mínimo de 4*M*M + 2 evaluaciones por parámetro
+    assert Screening_Sim(3) == 3*(4*M*M + 2)
+    assert Screening_Sim(3, 300) == 300
+    # Redondeo hacia arriba a un múltiplo del número de parámetros
+    assert Screening_Sim(3, 298) == 300
+    # N = 1 módulo 2*M se evita
+    assert Screening_Sim(3, 3*73) == 3*74
+    for NumParams in range(1, 8):
+        for ScreeningSim in [None, 100, 500, 1000]:
+            N = Screening_Sim(NumParams, ScreeningSim) // NumParams
+            assert N > 4*M*M and N % (2*M) != 1
+
+def test_Select_Parameters():
+    Indices = pd.DataFrame({'Parameter': ['a', 'b', 'c'], 'S1': [0.2, 0.01, 0.5], 'ST': [0.3, 0.02, 0.6]})
+    Table, Fixed = Select_Parameters(Indices, [1.0, 2.0, 3.0])
+    assert list(Table['Parameter']) == ['c', 'a', 'b']
+    assert list(Table['Status']) == ['free', 'free', 'fixed']
+    assert Fixed == {1: 2.0}
+
+    # Con todos bajo el umbral queda libre el más sensible
+    Table, Fixed = Select_Parameters(Indices, [1.0, 2.0, 3.0], Threshold=1.0)
+    assert Fixed == {0: 1.0, 1: 2.0}
+    assert Table.set_index('Parameter').loc['c', 'Status'] == 'free'
+
+def test_Population_Size():
+    assert Population_Size('Shuffled Complex Evolution (SCE-UA)', 4) == 20*9
+    assert Population_Size('Shuffled Complex Evolution (SCE-UA)', 4, Complexes=3) == 3*9
+    assert Population_Size('Dynamical dimensional search (DDS)', 4) == 0